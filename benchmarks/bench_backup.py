@@ -0,0 +1,104 @@
+"""Резервная копия на ходу: сколько она добавляет к задержке обработчиков.
+
+Обработчики получают поток команд (чтение и запись) с частотой --rate сначала
+без копии, потом пока копия базы из --users пользователей делается по кругу.
+Запись во время копии перезапускает пошаговое копирование - это видно в
+числе перезапусков.
+
+Запуск: python benchmarks/bench_backup.py [--users 300000] [--rate 500] [--duration 5] [--pages 256]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+
+os.environ.setdefault('BOT_TOKEN', '0:benchmark')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot  # noqa: E402
+from fakes import make_call, percentile  # noqa: E402
+
+COMMANDS = (
+    ('count', bot.count_days, '/count'),
+    ('birthdays', bot.list_birthdays, '/birthdays'),
+    ('setdate', bot.set_date, '/setdate 14.02.2020 Маша'),
+    ('addbirthday', bot.add_birthday_cmd, '/addbirthday Друг 01.03'),
+)
+
+
+def fill(users):
+    bot.init_db()
+    conn = bot.get_connection()
+    with conn:
+        conn.executemany('INSERT INTO relationships VALUES (?, ?, ?)',
+                         ((i, '2020-02-14', 'Маша') for i in range(users)))
+        conn.executemany('INSERT INTO birthdays VALUES (?, ?, ?, ?, ?)',
+                         ((i, 'Оля', '1990-03-01', 3, 1) for i in range(users)))
+
+
+async def load(users, rate, duration, backup):
+    """Открытая нагрузка; при backup=True копии идут одна за другой все время замера"""
+    loop = asyncio.get_running_loop()
+    handlers = [(bot.instrument(name, handler), text) for name, handler, text in COMMANDS]
+    latencies = []
+    stop = asyncio.Event()
+
+    async def backup_loop():
+        copies = 0
+        while not stop.is_set():
+            if await bot.backups.run():
+                copies += 1
+        return copies
+
+    async def handle(arrival, i):
+        handler, text = handlers[i % len(handlers)]
+        update, context = make_call(i * 7919 % users, text)
+        await handler(update, context)
+        latencies.append(loop.time() - arrival)
+
+    backups = asyncio.ensure_future(backup_loop()) if backup else None
+    started = loop.time()
+    tasks = []
+    for i in range(int(rate * duration)):
+        delay = started + i / rate - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.ensure_future(handle(started + i / rate, i)))
+    await asyncio.gather(*tasks)
+    stop.set()
+    copies = await backups if backups else 0
+    return latencies, copies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=300000)
+    parser.add_argument('--rate', type=float, default=500)
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--pages', type=int, default=bot.BACKUP_PAGES)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bot.DB_PATH = os.path.join(tmp, 'bench.db')
+        bot.BACKUP_DIR = os.path.join(tmp, 'backups')
+        bot.close_connections()
+        fill(args.users)
+        bot.backups.pages = args.pages
+        print(f"база: {args.users:,} пользователей, {os.path.getsize(bot.DB_PATH) / 2 ** 20:.0f} MiB, "
+              f"{args.rate:g} команд/s, шаг копии {args.pages} страниц")
+
+        for label, backup in (("без копии", False), ("во время копий", True)):
+            latencies, copies = asyncio.run(load(args.users, args.rate, args.duration, backup))
+            print(f"{label:<16} p50={percentile(latencies, 50) * 1000:7.2f} ms  "
+                  f"p99={percentile(latencies, 99) * 1000:7.2f} ms  max={max(latencies) * 1000:7.2f} ms")
+        backups = bot.backups
+        print(f"копий: {copies}, последняя {backups.last_duration:.2f} s, {backups.last_size / 2 ** 20:.1f} MiB, "
+              f"перезапусков {backups.restarts}, ошибок {backups.failures}")
+        print(f"добавка к средней задержке (метрика): {backups.added_latency() * 1000:.2f} ms")
+        bot.db_worker.stop()
+        bot.close_connections()
+
+
+if __name__ == '__main__':
+    main()
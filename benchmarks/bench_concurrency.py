@@ -0,0 +1,95 @@
+"""Параллельная обработка апдейтов: пропускная способность от CONCURRENT_UPDATES.
+
+Каждый из --users пользователей присылает /setdate и сразу /count; все апдейты
+кладутся в MockBotAPI одной пачкой, запрос к Bot API идет с задержкой --rtt-ms.
+Для каждого лимита из --limits печатается время до последнего ответа и ответов
+в секунду. Порядок проверяется: у каждого пользователя ответ /count должен
+прийти после /setdate и уже видеть дату (иначе код выхода 1).
+
+Рост упирается в пул соединений к Bot API (--pool, BOT_API_POOL_SIZE): лимит
+больше пула только удлиняет очередь запросов внутри httpx.
+
+Запуск: python benchmarks/bench_concurrency.py [--users 150] [--limits 1,2,4,8,16,32,64] [--rtt-ms 50] [--pool 16]
+"""
+import argparse
+import collections
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bot_runner import BotRunner, bot  # noqa: E402
+from mock_bot_api import MockBotAPI, make_update  # noqa: E402
+
+
+def run(limit, users, rtt, tmp):
+    """(секунд до последнего ответа, пользователей с нарушенным порядком)"""
+    bot.DB_PATH = os.path.join(tmp, f'concurrency-{limit}.db')
+    bot.close_connections()
+    bot.init_db()
+    bot.update_processor.concurrency = limit
+
+    replies = collections.defaultdict(list)
+    done = threading.Event()
+    expected = users * 2
+
+    def on_send(chat_id, text, payload):
+        replies[chat_id].append(text)
+        if sum(map(len, replies.values())) >= expected:
+            done.set()
+
+    api = MockBotAPI(rtt=rtt)
+    api.on_send = on_send
+    api.start()
+    runner = BotRunner(api, mode='polling').start()
+    try:
+        started = time.perf_counter()
+        for user_id in range(1, users + 1):
+            api.push_update(make_update(api.next_update_id(), user_id, f'/setdate {user_id % 28 + 1:02d}.02.2020 Маша'))
+            api.push_update(make_update(api.next_update_id(), user_id, '/count'))
+        if not done.wait(120):
+            sys.exit(f"❌ лимит {limit}: получено {sum(map(len, replies.values()))} ответов из {expected}")
+        elapsed = time.perf_counter() - started
+    finally:
+        runner.stop()
+        api.stop()
+        bot.db_worker.stop()
+        bot.close_connections()
+
+    broken = sum(1 for texts in replies.values()
+                 if len(texts) != 2 or texts[0].startswith('❌') or texts[1].startswith('❌'))
+    return elapsed, broken
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=150)
+    parser.add_argument('--limits', default='1,2,4,8,16,32,64')
+    parser.add_argument('--rtt-ms', type=float, default=50, help='имитация сетевой задержки до Telegram')
+    parser.add_argument('--pool', type=int, default=bot.BOT_API_POOL_SIZE, help='соединений к Bot API')
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    bot.BOT_API_POOL_SIZE = args.pool
+
+    print(f"{args.users} пользователей x (/setdate, /count), задержка Bot API {args.rtt_ms:g} ms, "
+          f"пул {args.pool} соединений")
+    print(f"{'лимит':>6} {'время s':>8} {'ответов/s':>10} {'ускорение':>10} {'порядок':>8}")
+    baseline = None
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp:
+        for limit in (int(x) for x in args.limits.split(',')):
+            elapsed, broken = run(limit, args.users, args.rtt_ms / 1000, tmp)
+            baseline = baseline or elapsed
+            failed = failed or broken
+            print(f"{limit:>6} {elapsed:>8.2f} {args.users * 2 / elapsed:>10.0f} {baseline / elapsed:>9.1f}x "
+                  f"{'ok' if not broken else f'{broken} ❌':>8}")
+    if failed:
+        sys.exit("❌ у части пользователей /count обогнал /setdate")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""Бенчмарк слоя БД: запросы в секунду до и после пула соединений.
+
+"До" - старая схема из bot.py: новое соединение на каждый запрос и коммит с fsync.
+"После" - хелперы bot.py поверх постоянного соединения в режиме WAL.
+
+Запуск: python benchmarks/bench_db.py [--users 2000] [--ops 20000]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import date
+
+os.environ.setdefault('BOT_TOKEN', '0:benchmark')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot  # noqa: E402
+
+
+def legacy_get_relationship_data(db_path, user_id):
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    cursor.execute('SELECT start_date, partner_name FROM relationships WHERE user_id = ?', (user_id,))
+    result = cursor.fetchone()
+    conn.close()
+    return result
+
+
+def legacy_set_relationship_data(db_path, user_id, start_date, partner_name=None):
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    cursor.execute('''
+        INSERT OR REPLACE INTO relationships (user_id, start_date, partner_name)
+        VALUES (?, ?, ?)
+    ''', (user_id, start_date.isoformat(), partner_name))
+    conn.commit()
+    conn.close()
+
+
+def measure(name, ops, func):
+    started = time.perf_counter()
+    for i in range(ops):
+        func(i)
+    elapsed = time.perf_counter() - started
+    qps = ops / elapsed
+    print(f"{name:<34} {ops:>8} ops  {elapsed:8.3f} s  {qps:>12,.0f} q/s")
+    return qps
+
+
+def run(users, ops):
+    start_date = date(2020, 2, 14)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        # Старая схема: отдельный файл без WAL, соединение на каждый вызов
+        legacy_path = os.path.join(tmp, 'legacy.db')
+        conn = sqlite3.connect(legacy_path)
+        conn.execute('CREATE TABLE relationships (user_id INTEGER PRIMARY KEY, start_date TEXT, partner_name TEXT)')
+        conn.executemany('INSERT INTO relationships VALUES (?, ?, ?)',
+                         ((u, start_date.isoformat(), 'Маша') for u in range(users)))
+        conn.commit()
+        conn.close()
+
+        rnd = random.Random(1)
+        results['legacy_read'] = measure(
+            'before: read (connect per query)', ops,
+            lambda i: legacy_get_relationship_data(legacy_path, rnd.randrange(users)))
+        write_ops = max(1, ops // 10)
+        results['legacy_write'] = measure(
+            'before: write (connect + fsync)', write_ops,
+            lambda i: legacy_set_relationship_data(legacy_path, rnd.randrange(users), start_date, 'Маша'))
+
+        # Новая схема: хелперы bot.py поверх постоянного соединения
+        bot.DB_PATH = os.path.join(tmp, 'pooled.db')
+        bot.close_connections()
+        bot.init_db()
+        for u in range(users):
+            bot.set_relationship_data(u, start_date, 'Маша')
+
+        rnd = random.Random(1)
+        results['pooled_read'] = measure(
+            'after: read (pooled, WAL)', ops,
+            lambda i: bot.get_relationship_data(rnd.randrange(users)))
+        results['pooled_write'] = measure(
+            'after: write (pooled, WAL)', write_ops,
+            lambda i: bot.set_relationship_data(rnd.randrange(users), start_date, 'Маша'))
+        bot.close_connections()
+
+    print()
+    print(f"read speedup:  x{results['pooled_read'] / results['legacy_read']:.1f}")
+    print(f"write speedup: x{results['pooled_write'] / results['legacy_write']:.1f}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--ops', type=int, default=20000)
+    args = parser.parse_args()
+    run(args.users, args.ops)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Поиск событий "сегодня и в ближайшие 7 дней" по всем пользователям.
+
+Сравнивает полный перебор дат в Python (как было без колонок month/day)
+с запросом get_events_between по индексу (month, day) и печатает план запроса.
+
+Запуск: python benchmarks/bench_events.py [--rows 200000]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+os.environ.setdefault('BOT_TOKEN', '0:benchmark')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot  # noqa: E402
+
+
+def seed(rows):
+    rnd = random.Random(8)
+    conn = bot.get_connection()
+    with conn:
+        conn.executemany(
+            'INSERT OR REPLACE INTO birthdays (user_id, name, date, month, day) VALUES (?, ?, ?, ?, ?)',
+            ((i // 3, f"Друг{i % 3}", d.isoformat(), d.month, d.day)
+             for i, d in ((i, date(2024, 1, 1) + timedelta(days=rnd.randrange(366))) for i in range(rows))))
+
+
+def full_scan(first, last):
+    wanted = set()
+    current = first
+    while current <= last:
+        wanted.add((current.month, current.day))
+        current += timedelta(days=1)
+    conn = bot.get_connection()
+    result = []
+    for user_id, name, date_str in conn.execute('SELECT user_id, name, date FROM birthdays'):
+        parsed = date.fromisoformat(date_str)
+        if (parsed.month, parsed.day) in wanted:
+            result.append((user_id, name))
+    return result
+
+
+def timed(name, func, repeat=5):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    elapsed = (time.perf_counter() - started) / repeat
+    print(f"{name:<22} {len(result):>7} rows  {elapsed * 1000:9.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=200000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bot.DB_PATH = os.path.join(tmp, 'events.db')
+        bot.close_connections()
+        bot.init_db()
+        seed(args.rows)
+
+        first = date(2026, 12, 28)
+        last = first + timedelta(days=7)
+        print("plan:")
+        for row in bot.get_connection().execute(
+                'EXPLAIN QUERY PLAN SELECT user_id, name FROM birthdays WHERE month = ? AND day BETWEEN ? AND ?',
+                (12, 28, 31)):
+            print("   ", row[-1])
+        timed('full scan (python)', lambda: full_scan(first, last))
+        timed('index range scan', lambda: bot.get_events_between(first, last))
+        bot.close_connections()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""Выгрузка и загрузка данных пользователей: строк в секунду и размер файла.
+
+База из --users пользователей (отношения, день рождения, покупка) выгружается
+в JSONL и JSONL.gz и загружается в пустую базу. Память процесса не должна
+расти с числом пользователей - выгрузка и загрузка идут пачками.
+
+Запуск: python benchmarks/bench_export.py [--users 1000000]
+"""
+import argparse
+import asyncio
+import os
+import resource
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('BOT_TOKEN', '0:benchmark')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot  # noqa: E402
+
+
+def use_db(path):
+    bot.DB_PATH = path
+    bot.close_connections()
+
+
+def fill(users):
+    bot.init_db()
+    conn = bot.get_connection()
+    with conn:
+        conn.executemany('INSERT INTO relationships VALUES (?, ?, ?)',
+                         ((i, '2020-02-14', 'Маша') for i in range(users)))
+        conn.executemany('INSERT INTO birthdays VALUES (?, ?, ?, ?, ?)',
+                         ((i, 'Оля', '1990-03-01', 3, 1) for i in range(users)))
+        conn.executemany('INSERT INTO premium_users (user_id, features) VALUES (?, ?)',
+                         ((i, 1) for i in range(0, users, 10)))
+
+
+def peak_mib():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def timed(label, coro):
+    started = time.perf_counter()
+    counts = asyncio.run(coro)
+    elapsed = time.perf_counter() - started
+    rows = sum(counts.values())
+    print(f"{label:<22} {rows:>10,} строк {elapsed:>7.2f} s {rows / elapsed:>10,.0f} строк/s  "
+          f"пик памяти {peak_mib():.0f} MiB")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=200000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        use_db(os.path.join(tmp, 'source.db'))
+        started = time.perf_counter()
+        fill(args.users)
+        print(f"база: {args.users:,} пользователей ({time.perf_counter() - started:.1f} s), "
+              f"пик памяти {peak_mib():.0f} MiB")
+
+        for name in ('dump.jsonl', 'dump.jsonl.gz'):
+            path = os.path.join(tmp, name)
+            use_db(os.path.join(tmp, 'source.db'))
+            exported = timed(f"выгрузка {name}", bot.export_data(path))
+            print(f"{'':<22} файл {os.path.getsize(path) / 2 ** 20:.1f} MiB")
+
+            use_db(os.path.join(tmp, f'target-{name}.db'))
+            imported = timed(f"загрузка {name}", bot.import_data(path))
+            if {table: rows for table, rows in exported.items() if rows} != imported:
+                sys.exit(f"❌ загружено не то, что выгружено: {exported} != {imported}")
+        bot.close_connections()
+
+
+if __name__ == '__main__':
+    main()
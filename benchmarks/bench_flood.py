@@ -0,0 +1,85 @@
+"""Защита от флуда: цена проверки, память на пользователя и поведение со спамером.
+
+1. Проверка check() для --users разных пользователей: время на вызов и
+   память корзин (корзины простаивающих пользователей удаляются).
+2. Спамер шлет одну и ту же или разные команды --spam раз в секунду в течение
+   --duration секунд через flood_guard + обработчик: сколько команд дошло до
+   обработчика и сколько предупреждений он получил (должно быть одно на серию).
+
+Запуск: python benchmarks/bench_flood.py [--users 100000] [--spam 50] [--duration 10]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import tracemalloc
+
+os.environ.setdefault('BOT_TOKEN', '0:benchmark')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot  # noqa: E402
+from fakes import make_call  # noqa: E402
+from telegram.ext import ApplicationHandlerStop  # noqa: E402
+
+
+def bench_check(users):
+    key = hash('/count')
+    limiter = bot.FloodLimiter(max_users=users)
+    started = time.perf_counter()
+    for user_id in range(users):
+        limiter.check(user_id, key, started)
+    elapsed = time.perf_counter() - started
+
+    # Память отдельным проходом: tracemalloc замедляет выделения
+    limiter = bot.FloodLimiter(max_users=users)
+    tracemalloc.start()
+    for user_id in range(users):
+        limiter.check(user_id, key, started)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f"check(): {elapsed / users * 1e6:.2f} мкс на вызов, {memory / users:.0f} байт на пользователя")
+
+    limiter.check(-1, hash('/count'), started + limiter.idle + 1)
+    print(f"после простоя {limiter.idle:g} s осталось корзин: {len(limiter.users)}")
+
+
+async def spam(texts, rate, duration):
+    """Спамер с виртуальным временем: (дошло до обработчика, предупреждений, всего)"""
+    bot.flood_limiter = limiter = bot.FloodLimiter()
+    handled = 0
+    notices = 0
+    now = 0.0
+    bot.monotonic, real_monotonic = (lambda: now), bot.monotonic
+    try:
+        for i in range(int(rate * duration)):
+            now = i / rate
+            update, context = make_call(7, texts[i % len(texts)])
+            try:
+                await bot.flood_guard(update, context)
+                handled += 1
+            except ApplicationHandlerStop:
+                notices += len(update.replies)
+    finally:
+        bot.monotonic = real_monotonic
+    return handled, notices, limiter
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--spam', type=float, default=50)
+    parser.add_argument('--duration', type=float, default=10)
+    args = parser.parse_args()
+
+    bench_check(args.users)
+    print(f"лимит: {bot.FLOOD_BURST:g} команд сразу, потом {bot.FLOOD_RATE:g}/s, повторы за {bot.FLOOD_DEDUP_SEC:g} s")
+    for label, texts in (("одна команда", ['/allholidays']), ("разные команды", ['/count', '/stats', '/holidays'])):
+        handled, notices, limiter = asyncio.run(spam(texts, args.spam, args.duration))
+        total = int(args.spam * args.duration)
+        print(f"{label:<16} {total} команд: обработано {handled}, повторов {limiter.duplicates}, "
+              f"сверх лимита {limiter.throttled}, предупреждений {notices}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+"""Офлайн-бенчмарк всех обработчиков bot.py на поддельных Update/Context.
+
+База заполняется заданным числом пользователей и дней рождения (от тысяч до
+миллиона строк), затем каждый обработчик вызывается от случайных пользователей
+в течение --min-time секунд CPU (но не меньше --calls раз). Печатаются
+вызовы в секунду и пиковая память на вызов (tracemalloc, отдельный проход).
+
+Для сравнения с baseline берутся вызовы на секунду CPU процесса (меньше
+зависят от соседей по машине) относительно калибровочного цикла на чистом
+Python, поэтому baseline переносим между машинами. Калибровка повторяется
+перед каждым прогоном: скорость машины плавает, и сравнивать нужно с ней же
+в тот же момент. После прогрева каждый обработчик прогоняется --repeat раз и
+сравнивается медиана: единичный удачный или неудачный прогон на нее не влияет.
+Если обработчик стал медленнее baseline больше чем на --tolerance, скрипт
+завершается с кодом 1.
+
+При изменении списка HANDLERS baseline нужно перезаписать.
+
+Запуск:
+    python benchmarks/bench_handlers.py [--users 1000] [--birthdays 3] [--min-time 0.25]
+    python benchmarks/bench_handlers.py --save-baseline   # обновить benchmarks/baseline.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import tracemalloc
+from datetime import date, timedelta
+from time import perf_counter, process_time
+
+os.environ.setdefault('BOT_TOKEN', '0:benchmark')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot  # noqa: E402
+from fakes import make_call, make_callback  # noqa: E402
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# Администратор для /broadcast: вне диапазона id пользователей из seed
+ADMIN_ID = -1
+
+
+def make_admin_call(user_id, command_line):
+    return make_call(ADMIN_ID, command_line)
+
+
+# (обработчик, шаблон команды[, сборщик Update]); {n} - номер вызова
+HANDLERS = (
+    (bot.start, '/start'),
+    (bot.help_command, '/help'),
+    (bot.set_date, '/setdate 14.02.2020 Маша'),
+    (bot.count_days, '/count'),
+    (bot.stats, '/stats'),
+    (bot.add_birthday_cmd, '/addbirthday Гость{n} 15.03'),
+    (bot.list_birthdays, '/birthdays'),
+    (bot.delete_birthday_cmd, '/delbirthday Гость{n}'),
+    (bot.list_holidays, '/holidays'),
+    (bot.all_holidays, '/allholidays'),
+    (bot.find_holiday, '/find день'),
+    (bot.next_holiday, '/nextholiday'),
+    (bot.bot_birthday_info, '/botday'),
+    (bot.premium_shop, '/premium_shop'),
+    (bot.advanced_stats, '/advanced_stats'),
+    (bot.add_personal_holiday, '/add_holiday Праздник{n} 01.06'),
+    (bot.compatibility_test, '/compatibility'),
+    (bot.buy_advanced_stats, '/buy_advanced_stats'),
+    (bot.set_timezone, '/timezone Europe/Berlin'),
+    (bot.show_page, 'page:allholidays:{n}', make_callback),
+    (bot.broadcast, '/broadcast Новость {n}', make_admin_call),
+)
+
+SEED_CHUNK = 50000
+# Сколько секунд CPU прогрев может занять на обработчик (важно при --users в сотни тысяч)
+WARMUP_LIMIT = 2.0
+
+
+def seed(users, birthdays_per_user, premium_share=0.3):
+    """Заполнить базу пачками через executemany"""
+    rnd = random.Random(11)
+    conn = bot.get_connection()
+    start = date(2024, 1, 1)
+
+    def chunks(rows):
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= SEED_CHUNK:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    relationships = ((u, (date(2015, 1, 1) + timedelta(days=rnd.randrange(3000))).isoformat(), f"Партнер{u}")
+                     for u in range(users))
+    for chunk in chunks(relationships):
+        with conn:
+            conn.executemany('INSERT OR REPLACE INTO relationships VALUES (?, ?, ?)', chunk)
+
+    def birthday_rows():
+        for u in range(users):
+            for i in range(birthdays_per_user):
+                d = start + timedelta(days=rnd.randrange(366))
+                yield u, f"Друг{i}", d.isoformat(), d.month, d.day
+    for chunk in chunks(birthday_rows()):
+        with conn:
+            conn.executemany('INSERT OR REPLACE INTO birthdays (user_id, name, date, month, day) '
+                             'VALUES (?, ?, ?, ?, ?)', chunk)
+
+    premium = ((u, bot.features_to_mask(bot.PREMIUM_FEATURES), '2024-01-01') for u in range(users)
+               if rnd.random() < premium_share)
+    for chunk in chunks(premium):
+        with conn:
+            conn.executemany('INSERT OR REPLACE INTO premium_users (user_id, features, purchase_date) '
+                             'VALUES (?, ?, ?)', chunk)
+
+
+def calibrate(loops=3):
+    """Скорость эталонного цикла на чистом Python (итераций в секунду)"""
+    speeds = []
+    for _ in range(loops):
+        started = process_time()
+        total = 0
+        for i in range(300000):
+            total += i % 7
+        speeds.append(300000 / (process_time() - started))
+    return statistics.median(speeds)
+
+
+async def run_relative(handler, template, make, calls, min_time, users, rnd):
+    """Прогон вместе со своей калибровкой: (вызовов в секунду, вызовов на итерацию эталона)"""
+    calibration = calibrate()
+    ops, cpu_ops = await run_handler(handler, template, make, calls, min_time, users, rnd)
+    return ops, cpu_ops / ((calibration + calibrate()) / 2)
+
+
+async def call_handler(handler, template, make, n, users, rnd):
+    update, context = make(rnd.randrange(users), template.format(n=n % 50))
+    await handler(update, context)
+    # Рассылка только ставит сообщения в очередь; без отправителя очередь не должна расти между вызовами
+    bot.outbound_queue.ready.clear()
+
+
+async def warm_up(handler, template, make, users, rnd, limit):
+    """Каждый пользователь по разу (но не дольше limit секунд CPU)
+
+    Кэши по пользователям (состояние, ответы за день) после прогрева те же,
+    что в середине длинного прогона, поэтому короткий прогон не меряет
+    холодные промахи и не зависит от --min-time.
+    """
+    user_ids = list(range(users))
+    rnd.shuffle(user_ids)
+    started = process_time()
+    for n, user_id in enumerate(user_ids):
+        update, context = make(user_id, template.format(n=n % 50))
+        await handler(update, context)
+        bot.outbound_queue.ready.clear()
+        if process_time() - started > limit:
+            break
+
+
+async def run_handler(handler, template, make, calls, min_time, users, rnd):
+    """(вызовов в секунду, вызовов на секунду CPU процесса)
+
+    Прогон длится min_time секунд CPU, а не фиксированное число вызовов: у
+    быстрых обработчиков короткий прогон тонет в шуме, а медленные (рассылка)
+    не затягивают весь бенчмарк. calls - минимум вызовов для медленных.
+    """
+    started, cpu_started = perf_counter(), process_time()
+    n = 0
+    while n < calls or process_time() - cpu_started < min_time:
+        await call_handler(handler, template, make, n, users, rnd)
+        n += 1
+    return n / (perf_counter() - started), n / max(process_time() - cpu_started, 1e-9)
+
+
+async def measure_memory(handler, template, make, calls, users, rnd):
+    peaks = 0
+    for n in range(calls):
+        update, context = make(rnd.randrange(users), template.format(n=n % 50))
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        await handler(update, context)
+        peaks += tracemalloc.get_traced_memory()[1] - before
+        bot.outbound_queue.ready.clear()
+    return peaks / calls
+
+
+async def run_suite(users, calls, min_time, memory_calls, repeat):
+    # То же, что on_startup, без сети
+    bot.entitlements.load(await bot.run_db(bot.get_all_feature_masks))
+    await bot.user_timezones.load()
+    await bot.event_owners.load()
+    bot.holiday_calendar.rebuild()
+    bot.ADMIN_IDS.add(ADMIN_ID)
+
+    results = {}
+    for handler, template, *rest in HANDLERS:
+        make = rest[0] if rest else make_call
+        rnd = random.Random(handler.__name__)
+        await warm_up(handler, template, make, users, rnd, WARMUP_LIMIT)
+        # Медиана нескольких прогонов не зависит от единичных помех в одну или другую сторону
+        runs = [await run_relative(handler, template, make, calls, min_time, users, rnd) for _ in range(repeat)]
+        results[handler.__name__] = {'ops': statistics.median(run[0] for run in runs),
+                                     'relative_cpu_ops': statistics.median(run[1] for run in runs)}
+
+    tracemalloc.start()
+    for handler, template, *rest in HANDLERS:
+        make = rest[0] if rest else make_call
+        rnd = random.Random(handler.__name__)
+        results[handler.__name__]['alloc_kb'] = await measure_memory(handler, template, make, memory_calls,
+                                                                     users, rnd) / 1024
+    tracemalloc.stop()
+    return results
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    print(f"{'handler':<22} {'ops/s':>10} {'KiB/call':>9} {'vs baseline':>12}")
+    for name, result in results.items():
+        line = f"{name:<22} {result['ops']:>10,.0f} {result['alloc_kb']:>9.1f}"
+        base = baseline.get('handlers', {}).get(name)
+        if base:
+            ratio = result['relative_cpu_ops'] / base['relative_cpu_ops']
+            line += f" {ratio:>11.0%}"
+            if ratio < 1 - tolerance:
+                regressions.append(name)
+                line += "  РЕГРЕССИЯ"
+        print(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--birthdays', type=int, default=3, help='дней рождения на пользователя')
+    parser.add_argument('--calls', type=int, default=50, help='минимум вызовов в прогоне')
+    parser.add_argument('--min-time', type=float, default=0.25, help='минимум секунд CPU в прогоне')
+    parser.add_argument('--repeat', type=int, default=7, help='прогонов на обработчик, берется медиана')
+    parser.add_argument('--memory-calls', type=int, default=200)
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--tolerance', type=float, default=0.25, help='допустимое замедление (0.25 = 25%%)')
+    parser.add_argument('--save-baseline', action='store_true')
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bot.DB_PATH = os.path.join(tmp, 'handlers.db')
+        bot.close_connections()
+        bot.init_db()
+        started = perf_counter()
+        seed(args.users, args.birthdays)
+        print(f"база: {args.users} пользователей, {args.users * args.birthdays} дней рождения "
+              f"({perf_counter() - started:.1f} s)")
+
+        results = asyncio.run(run_suite(args.users, args.calls, args.min_time, args.memory_calls,
+                                        args.repeat))
+        bot.db_worker.stop()
+        bot.close_connections()
+
+    if args.save_baseline:
+        baseline = {
+            'users': args.users, 'birthdays': args.birthdays,
+            'handlers': {name: {'relative_cpu_ops': result['relative_cpu_ops'], 'alloc_kb': result['alloc_kb']}
+                         for name, result in results.items()},
+        }
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, ensure_ascii=False, indent=2, sort_keys=True)
+        compare(results, {}, args.tolerance)
+        print(f"baseline сохранен: {args.baseline}")
+        return
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if (baseline.get('users'), baseline.get('birthdays')) != (args.users, args.birthdays):
+            print("⚠️ baseline снят на другом размере базы, сравнение приблизительное")
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print(f"❌ регрессия производительности: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""Задержка обработчиков под конкурентной нагрузкой: БД в event loop против потока БД.
+
+Часть виртуальных пользователей пишет (/setdate, /addbirthday), остальные читают
+(/count, /stats, /birthdays, /botday). Чтобы воспроизвести медленный диск, каждая
+запись искусственно задерживается на --disk-delay-ms. В режиме "blocking" запросы
+выполняются прямо в event loop (как раньше), в режиме "worker" - через run_db.
+
+Запуск: python benchmarks/bench_latency.py [--rate 1000] [--duration 3] [--disk-delay-ms 5]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('BOT_TOKEN', '0:benchmark')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot  # noqa: E402
+from fakes import make_call, percentile  # noqa: E402
+
+READ_COMMANDS = (
+    (bot.count_days, '/count'),
+    (bot.stats, '/stats'),
+    (bot.list_birthdays, '/birthdays'),
+    (bot.bot_birthday_info, '/botday'),
+)
+
+WRITE_COMMANDS = (
+    (bot.set_date, '/setdate 14.02.2020 Маша'),
+    (bot.add_birthday_cmd, '/addbirthday Друг{n} 0{n}.03'),
+)
+
+
+def slow_writes(delay):
+    """Оборачивает пишущие хелперы задержкой, имитирующей медленный fsync"""
+    for name in ('set_relationship_data', 'add_birthday'):
+        func = getattr(bot, name)
+
+        def wrapper(*args, _func=func):
+            time.sleep(delay)
+            return _func(*args)
+        setattr(bot, name, wrapper)
+
+
+async def blocking_run_db(func, *args):
+    return func(*args)
+
+
+async def run_mode(users, rate, duration, writers_share):
+    """Открытая модель нагрузки: запросы приходят с заданной частотой независимо
+    от того, успел ли бот ответить на предыдущие. Задержка считается от момента
+    прихода запроса, поэтому остановка event loop попадает в измерения."""
+    loop = asyncio.get_running_loop()
+    latencies = []
+    tasks = []
+    writers = max(1, int(users * writers_share))
+
+    async def handle(arrival, user_id, i):
+        if user_id < writers:
+            handler, text = WRITE_COMMANDS[i % len(WRITE_COMMANDS)]
+            text = text.format(n=i % 9 + 1)
+        else:
+            handler, text = READ_COMMANDS[i % len(READ_COMMANDS)]
+        update, context = make_call(user_id, text)
+        await handler(update, context)
+        latencies.append(loop.time() - arrival)
+
+    started = loop.time()
+    total = int(rate * duration)
+    for i in range(total):
+        arrival = started + i / rate
+        delay = arrival - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(handle(arrival, i % users, i)))
+    await asyncio.gather(*tasks)
+    return latencies, loop.time() - started
+
+
+def report(mode, latencies, elapsed):
+    ms = [x * 1000 for x in latencies]
+    print(f"{mode:<9} calls={len(ms):>6}  {len(ms) / elapsed:>8,.0f} calls/s  "
+          f"p50={percentile(ms, 50):7.2f} ms  p99={percentile(ms, 99):7.2f} ms  max={max(ms):7.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--rate', type=float, default=1000, help='запросов в секунду')
+    parser.add_argument('--duration', type=float, default=3, help='секунд на режим')
+    parser.add_argument('--writers', type=float, default=0.1, help='доля пишущих пользователей')
+    parser.add_argument('--disk-delay-ms', type=float, default=5.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bot.DB_PATH = os.path.join(tmp, 'latency.db')
+        bot.close_connections()
+        bot.init_db()
+        slow_writes(args.disk_delay_ms / 1000)
+
+        worker_run_db = bot.run_db
+        for mode in ('blocking', 'worker'):
+            bot.run_db = blocking_run_db if mode == 'blocking' else worker_run_db
+            latencies, elapsed = asyncio.run(run_mode(args.users, args.rate, args.duration, args.writers))
+            report(mode, latencies, elapsed)
+        bot.db_worker.stop()
+        bot.close_connections()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""Накладные расходы инструментирования обработчиков (bot.instrument).
+
+Меряет стоимость обертки на пустом обработчике и сравнивает ее со временем
+настоящих обработчиков на поддельных Update/Context. Отправка ответа
+имитируется задержкой --send-ms, как у настоящего запроса к Telegram.
+
+Запуск: python benchmarks/bench_metrics.py [--calls 3000] [--send-ms 1]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+from datetime import date
+from time import perf_counter
+
+os.environ.setdefault('BOT_TOKEN', '0:benchmark')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot  # noqa: E402
+import fakes  # noqa: E402
+
+
+async def measure(handler, text, calls):
+    started = perf_counter()
+    for i in range(calls):
+        update, context = fakes.make_call(i % 100, text)
+        await handler(update, context)
+    return (perf_counter() - started) / calls
+
+
+async def run(calls, send_delay):
+    original_reply = fakes.FakeMessage.reply_text
+
+    async def slow_reply(self, text, **kwargs):
+        await asyncio.sleep(send_delay)
+        return await original_reply(self, text, **kwargs)
+
+    if send_delay:
+        fakes.FakeMessage.reply_text = slow_reply
+
+    # Чистая стоимость обертки: пустой обработчик с ней и без нее
+    async def noop(update, context):
+        return None
+
+    wrapped_noop = bot.instrument('noop', noop)
+    base = await measure(noop, '/noop', calls * 10)
+    cost = await measure(wrapped_noop, '/noop', calls * 10) - base
+    print(f"стоимость обертки: {cost * 1e6:.2f} us на вызов")
+
+    for handler, text in ((bot.bot_birthday_info, '/botday'), (bot.count_days, '/count'),
+                          (bot.list_birthdays, '/birthdays')):
+        await measure(handler, text, calls // 10)  # прогрев
+        raw = await measure(handler, text, calls) - base
+        print(f"{handler.__name__:<20} {raw * 1e6:8.1f} us на вызов, накладные расходы {cost / raw * 100:5.2f}%")
+    fakes.FakeMessage.reply_text = original_reply
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--calls', type=int, default=3000)
+    parser.add_argument('--send-ms', type=float, default=1.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bot.DB_PATH = os.path.join(tmp, 'metrics.db')
+        bot.close_connections()
+        bot.init_db()
+        for user_id in range(100):
+            bot.set_relationship_data(user_id, date(2020, 2, 14), 'Маша')
+            bot.add_birthday(user_id, 'Оля', date(2024, 3, 1))
+        asyncio.run(run(args.calls, args.send_ms / 1000))
+        bot.db_worker.stop()
+        bot.close_connections()
+
+
+if __name__ == '__main__':
+    main()
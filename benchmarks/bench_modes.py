@@ -0,0 +1,107 @@
+"""Задержка "апдейт -> ответ" в режимах polling и webhook против локального MockBotAPI.
+
+Последовательные пробы меряют чистую задержку доставки апдейта и ответа,
+пачка одновременных апдейтов - пропускную способность.
+
+Запуск: python benchmarks/bench_modes.py [--probes 200] [--burst 500] [--rtt-ms 50]
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bot_runner import BotRunner, bot  # noqa: E402
+from fakes import percentile  # noqa: E402
+from mock_bot_api import MockBotAPI, make_update  # noqa: E402
+
+
+class ReplyWaiter:
+    """Ждет ответы бота (sendMessage) в заданные чаты"""
+
+    def __init__(self, api):
+        self.lock = threading.Lock()
+        self.waiting = {}
+        api.on_send = self.on_send
+
+    def expect(self, chat_id):
+        event = threading.Event()
+        with self.lock:
+            self.waiting[chat_id] = event
+        return event
+
+    def on_send(self, chat_id, text, payload):
+        with self.lock:
+            event = self.waiting.pop(chat_id, None)
+        if event:
+            event.set()
+
+
+def deliver(api, runner, update):
+    if runner.mode == 'webhook':
+        # Путь Telegram -> бот занимает половину RTT
+        time.sleep(api.rtt / 2)
+        request = urllib.request.Request(runner.webhook_url, data=json.dumps(update).encode('utf-8'),
+                                         headers={'Content-Type': 'application/json'})
+        urllib.request.urlopen(request).read()
+    else:
+        api.push_update(update)
+
+
+def run_mode(mode, probes, burst, rtt):
+    api = MockBotAPI(rtt=rtt).start()
+    runner = BotRunner(api, mode=mode).start()
+    waiter = ReplyWaiter(api)
+    try:
+        latencies = []
+        for i in range(probes):
+            user_id = 1000 + i
+            event = waiter.expect(user_id)
+            started = time.perf_counter()
+            deliver(api, runner, make_update(api.next_update_id(), user_id, '/botday'))
+            if not event.wait(10):
+                raise RuntimeError(f"{mode}: нет ответа на пробу {i}")
+            latencies.append((time.perf_counter() - started) * 1000)
+
+        events = [waiter.expect(100000 + i) for i in range(burst)]
+        updates = [make_update(api.next_update_id(), 100000 + i, '/botday') for i in range(burst)]
+        started = time.perf_counter()
+        # Telegram шлет вебхуки параллельно, поэтому и здесь доставляем в несколько потоков
+        with ThreadPoolExecutor(16) as pool:
+            list(pool.map(lambda update: deliver(api, runner, update), updates))
+        for event in events:
+            event.wait(30)
+        elapsed = time.perf_counter() - started
+    finally:
+        runner.stop()
+        api.stop()
+
+    print(f"{mode:<8} p50={percentile(latencies, 50):6.2f} ms  p99={percentile(latencies, 99):6.2f} ms  "
+          f"burst {burst} updates: {elapsed:5.2f} s ({burst / elapsed:,.0f} updates/s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--probes', type=int, default=200)
+    parser.add_argument('--burst', type=int, default=500)
+    parser.add_argument('--rtt-ms', type=float, default=0, help='имитация сетевой задержки до Telegram')
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bot.DB_PATH = os.path.join(tmp, 'modes.db')
+        bot.close_connections()
+        bot.init_db()
+        for mode in ('polling', 'webhook'):
+            run_mode(mode, args.probes, args.burst, args.rtt_ms / 1000)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Массовая рассылка через OutboundQueue против наивного asyncio.gather.
+
+Оба варианта отправляют одно и то же на локальный MockBotAPI с включенным
+флуд-контролем. Наивная рассылка упирается в шторм 429, очередь держит
+скорость у допустимого максимума без отказов.
+
+Запуск: python benchmarks/bench_outbound.py [--chats 100] [--per-chat 3]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+os.environ.setdefault('BOT_TOKEN', '0:benchmark')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram import Bot  # noqa: E402
+from telegram.error import TelegramError  # noqa: E402
+
+import bot  # noqa: E402
+from mock_bot_api import MockBotAPI  # noqa: E402
+
+
+def messages(chats, per_chat):
+    for i in range(per_chat):
+        for chat_id in range(1, chats + 1):
+            yield chat_id, f"Объявление {i}"
+
+
+async def naive(api, chats, per_chat):
+    async with Bot(api.token, base_url=api.base_url) as tg:
+        async def send(chat_id, text):
+            try:
+                await tg.send_message(chat_id=chat_id, text=text)
+            except TelegramError:
+                pass
+        await asyncio.gather(*(send(chat_id, text) for chat_id, text in messages(chats, per_chat)))
+
+
+async def queued(api, chats, per_chat, global_rate):
+    async with Bot(api.token, base_url=api.base_url) as tg:
+        outbound = bot.OutboundQueue(global_rate=global_rate)
+        outbound.start(tg)
+        deliveries = [outbound.send(chat_id, text) for chat_id, text in messages(chats, per_chat)]
+        await asyncio.gather(*deliveries, return_exceptions=True)
+        await outbound.stop()
+        return outbound.stats()
+
+
+def run(name, coro_factory, global_rate, total):
+    api = MockBotAPI(flood_control=True, global_rate=global_rate).start()
+    started = time.perf_counter()
+    stats = asyncio.run(coro_factory(api))
+    elapsed = time.perf_counter() - started
+    api.stop()
+    delivered = len(api.sent)
+    print(f"{name:<6} delivered={delivered:>5}/{total}  429={api.rejected:>5}  "
+          f"{elapsed:6.2f} s  {delivered / elapsed:6.1f} msg/s (limit {global_rate:g})")
+    if stats:
+        avg = stats['delivery_seconds_total'] / max(1, stats['sent'])
+        print(f"       queue: sent={stats['sent']} failed={stats['failed']} retried={stats['retried']} "
+              f"retry_after={stats['retry_after']} avg_delivery={avg:.2f} s max={stats['delivery_seconds_max']:.2f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--chats', type=int, default=100)
+    parser.add_argument('--per-chat', type=int, default=3)
+    parser.add_argument('--global-rate', type=float, default=30)
+    args = parser.parse_args()
+    total = args.chats * args.per_chat
+
+    run('naive', lambda api: naive(api, args.chats, args.per_chat), args.global_rate, total)
+    run('queue', lambda api: queued(api, args.chats, args.per_chat, args.global_rate), args.global_rate, total)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""Поиск /find: линейный перебор названий против HolidaySearchIndex.
+
+Каталог дополняется синтетическими праздниками до --entries записей,
+для каждого вида запроса печатается среднее и p99 время одного поиска.
+Перед замерами индекс сверяется с перебором: все названия, где запрос
+встречается подстрокой, должны найтись (иначе код 1).
+
+Запуск: python benchmarks/bench_search.py [--entries 5000] [--queries 2000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+os.environ.setdefault('BOT_TOKEN', '0:benchmark')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import bot  # noqa: E402
+from fakes import percentile  # noqa: E402
+
+WORDS = ("день", "праздник", "фестиваль", "неделя", "памяти", "независимости", "урожая", "весны",
+         "света", "музыки", "моря", "города", "науки", "поэзии", "рыбака", "учителя", "молодежи")
+QUERIES = {
+    "префикс": ("нов", "фест", "неде", "хэл"),
+    "подстрока": ("новый год", "урожая", "день незав", "валентин"),
+    "английский": ("halloween", "christmas", "earth day", "diwali"),
+    "опечатка": ("хелоуин", "фистиваль", "нидеря", "рождиство"),
+}
+
+# Запросы из справки /find и что по ним обязательно находится
+EXPECTED = {
+    "новый год": {"Новый год", "Старый Новый год", "Китайский Новый год", "Лунный Новый год"},
+}
+
+
+def build_catalog(entries):
+    rnd = random.Random(14)
+    names = list(bot.holiday_catalog.names)
+    while len(names) < entries:
+        names.append(" ".join(rnd.sample(WORDS, 3)).capitalize() + f" {len(names)}")
+    return names
+
+
+def linear_search(names, query):
+    query = query.lower()
+    return [name for name in names if query in name.lower()]
+
+
+def check_results(index, names):
+    """Запросы, для которых индекс потерял совпадения по подстроке"""
+    failed = []
+    queries = [q for kind in ("префикс", "подстрока") for q in QUERIES[kind]] + list(EXPECTED)
+    for query in dict.fromkeys(queries):
+        found = set(index.search(query))
+        missing = (set(linear_search(names, query)) | EXPECTED.get(query, set())) - found
+        if missing:
+            failed.append(f"{query}: нет {', '.join(sorted(missing))}")
+    return failed
+
+
+def measure(search, queries, rounds):
+    timings = []
+    for _ in range(rounds):
+        for query in queries:
+            started = time.perf_counter()
+            search(query)
+            timings.append((time.perf_counter() - started) * 1e6)
+    return sum(timings) / len(timings), percentile(timings, 99)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--entries', type=int, default=5000)
+    parser.add_argument('--queries', type=int, default=2000)
+    args = parser.parse_args()
+
+    names = build_catalog(args.entries)
+    started = time.perf_counter()
+    index = bot.HolidaySearchIndex(names, bot.holiday_catalog.aliases)
+    print(f"каталог: {len(names)} праздников, индекс построен за {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    failed = check_results(index, names)
+    if failed:
+        print("❌ поиск теряет результаты:\n" + "\n".join(failed))
+        sys.exit(1)
+
+    rounds = max(1, args.queries // 4)
+    print(f"{'запрос':<12} {'перебор µs':>11} {'индекс µs':>10} {'индекс p99':>11} {'найдено':>8}")
+    for kind, queries in QUERIES.items():
+        linear_mean, _ = measure(lambda q: linear_search(names, q), queries, max(1, rounds // 20))
+        mean, p99 = measure(lambda q: index.search(q, limit=bot.FIND_LIMIT), queries, rounds)
+        hits = sum(len(index.search(q)) for q in queries)
+        print(f"{kind:<12} {linear_mean:>11.0f} {mean:>10.0f} {p99:>11.0f} {hits:>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Кэш состояния пользователей: память на миллион пользователей, доля попаданий и скорость чтения.
+
+Память меряется tracemalloc на заполненном кэше (отношения и два дня рождения
+на пользователя) и пересчитывается на миллион пользователей. Доля попаданий
+и скорость - на чтениях с распределением Ципфа
+пользователей, как у реальной аудитории: в сравнении с чтением из БД.
+
+Запуск: python benchmarks/bench_user_cache.py [--users 200000] [--size 50000] [--reads 200000]
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+os.environ.setdefault('BOT_TOKEN', '0:benchmark')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot  # noqa: E402
+
+
+def measure_memory(users):
+    cache = bot.UserStateCache(maxsize=users)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for user_id in range(users):
+        entry = cache._entry(user_id)
+        # Строки из БД у каждого пользователя свои
+        start = date(2015, 1, 1) + timedelta(days=user_id % 3650)
+        entry.relationship = bot.compact_state('relationship', (start.isoformat(), f"Партнер{user_id}"))
+        entry.birthdays = bot.compact_state('birthdays', ((f"Мама{user_id}", date(2026, 3, 8).isoformat()),
+                                                          (f"Друг{user_id}", date(2026, 1, 1 + user_id % 31).isoformat())))
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return used / users
+
+
+def seed(users):
+    conn = bot.get_connection()
+    with conn:
+        conn.executemany('INSERT OR REPLACE INTO relationships (user_id, start_date, partner_name) VALUES (?, ?, ?)',
+                         ((user_id, '2020-02-14', f"Партнер{user_id}") for user_id in range(users)))
+
+
+def skewed_users(users, reads, seed_value=17):
+    """Закон Ципфа: k-й по активности пользователь пишет в 1/k раз реже самого активного"""
+    rnd = random.Random(seed_value)
+    cum_weights = list(itertools.accumulate(1 / rank for rank in range(1, users + 1)))
+    return [rank * 7919 % users for rank in rnd.choices(range(users), cum_weights=cum_weights, k=reads)]
+
+
+async def measure_reads(users, size, reads):
+    access = skewed_users(users, reads)
+
+    started = time.perf_counter()
+    for user_id in access:
+        await bot.run_db(bot.get_relationship_data, user_id)
+    db_rate = reads / (time.perf_counter() - started)
+
+    bot.user_state = cache = bot.UserStateCache(maxsize=size)
+    started = time.perf_counter()
+    for user_id in access:
+        await cache.relationship(user_id)
+    cache_rate = reads / (time.perf_counter() - started)
+    return db_rate, cache_rate, cache.hits / reads
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=200000)
+    parser.add_argument('--size', type=int, default=50000, help='размер кэша')
+    parser.add_argument('--reads', type=int, default=200000)
+    args = parser.parse_args()
+
+    per_user = measure_memory(args.users)
+    print(f"память: {per_user:.0f} байт на пользователя, {per_user * 1e6 / 2 ** 20:.0f} MiB на миллион")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bot.DB_PATH = os.path.join(tmp, 'bench.db')
+        bot.close_connections()
+        bot.init_db()
+        seed(args.users)
+        db_rate, cache_rate, hit_rate = asyncio.run(measure_reads(args.users, args.size, args.reads))
+        bot.db_worker.stop()
+        bot.close_connections()
+    print(f"чтение отношений: БД {db_rate:,.0f}/s, кэш {cache_rate:,.0f}/s "
+          f"(x{cache_rate / db_rate:.1f}), попаданий {hit_rate:.0%} при кэше на {args.size} из {args.users}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""Всплеск изменений: запись каждой транзакцией против отложенной записи пачками.
+
+Одновременно приходят --writes изменений (/setdate и /addbirthday) от разных
+пользователей. Время считается до момента, когда все изменения лежат в БД.
+
+Запуск: python benchmarks/bench_writes.py [--writes 20000] [--interval-ms 20] [--batch 200]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import date
+
+os.environ.setdefault('BOT_TOKEN', '0:benchmark')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot  # noqa: E402
+
+
+def make_writes(count):
+    writes = []
+    for i in range(count):
+        if i % 2:
+            writes.append((i, bot.relationship_write(i, date(2020, 2, 14), "Маша")))
+        else:
+            writes.append((i, bot.birthday_write(i, "Друг", date(2024, 3, 1 + i % 28))))
+    return writes
+
+
+async def burst(write_behind, writes, wave=100):
+    """Изменения приходят волнами по wave одновременных обработчиков"""
+    started = time.perf_counter()
+    for i in range(0, len(writes), wave):
+        await asyncio.gather(*(write_behind.save(user_id, write) for user_id, write in writes[i:i + wave]))
+    await write_behind.flush()
+    return time.perf_counter() - started
+
+
+def run(label, interval_ms, batch, writes):
+    with tempfile.TemporaryDirectory() as tmp:
+        bot.DB_PATH = os.path.join(tmp, 'bench.db')
+        bot.close_connections()
+        bot.init_db()
+        write_behind = bot.WriteBehind(interval_ms, batch)
+        elapsed = asyncio.run(burst(write_behind, writes))
+        rows = bot.get_connection().execute(
+            'SELECT (SELECT COUNT(*) FROM relationships) + (SELECT COUNT(*) FROM birthdays)').fetchone()[0]
+        bot.db_worker.stop()
+        bot.close_connections()
+    flushes = f", {write_behind.flushes} пачек" if write_behind.enabled else ""
+    print(f"{label:<28} {len(writes) / elapsed:>10,.0f} изменений/s  ({rows} строк{flushes})")
+    return len(writes) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--writes', type=int, default=20000)
+    parser.add_argument('--interval-ms', type=float, default=20)
+    parser.add_argument('--batch', type=int, default=200)
+    args = parser.parse_args()
+
+    writes = make_writes(args.writes)
+    immediate = run("транзакция на изменение", 0, args.batch, writes)
+    batched = run(f"пачки {args.interval_ms:g} ms / {args.batch}", args.interval_ms, args.batch, writes)
+    print(f"ускорение x{batched / immediate:.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""Запуск настоящего Application из bot.py в фоновом потоке против MockBotAPI."""
+import asyncio
+import os
+import socket
+import sys
+import threading
+import time
+
+os.environ.setdefault('BOT_TOKEN', '0:benchmark')
+# Нагрузку дают тысячи виртуальных пользователей с повторами команд - защита от флуда мешала бы замеру
+os.environ.setdefault('FLOOD_RATE', '0')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot  # noqa: E402
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class BotRunner:
+    """Бот в отдельном потоке со своим event loop: build_application + run_bot"""
+
+    def __init__(self, api, mode='polling', port=None, configure=None):
+        self.api = api
+        self.mode = mode
+        self.port = port or free_port()
+        self.configure = configure  # callback(application) до запуска
+        self.application = None
+        self._loop = None
+        self._stop = None
+        self._started = threading.Event()
+        self._thread = None
+        self.error = None
+
+    @property
+    def webhook_url(self):
+        return f"http://127.0.0.1:{self.port}{bot.WEBHOOK_PATH}"
+
+    def start(self, timeout=10):
+        bot.WEBHOOK_URL = f"http://127.0.0.1:{self.port}"
+        self._thread = threading.Thread(target=self._run, name='bot-runner', daemon=True)
+        self._thread.start()
+        if not self._started.wait(timeout):
+            raise RuntimeError(f"бот не запустился: {self.error}")
+        # Ждем, пока бот реально начнет получать апдейты
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.mode == 'webhook' and self.api.webhook_url:
+                break
+            if self.mode == 'polling' and self.application.updater and self.application.updater.running:
+                break
+            time.sleep(0.01)
+        return self
+
+    def stop(self):
+        if self._loop and self._stop:
+            self._loop.call_soon_threadsafe(self._stop.set)
+        if self._thread:
+            self._thread.join(30)
+
+    def _run(self):
+        try:
+            asyncio.run(self._main())
+        except Exception as e:  # noqa: BLE001 - сообщаем в start()
+            self.error = e
+            self._started.set()
+
+    async def _main(self):
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        self.application = bot.build_application(self.api.token, base_url=self.api.base_url, mode=self.mode)
+        if self.configure:
+            self.configure(self.application)
+        task = asyncio.create_task(bot.run_bot(self.application, self.mode, self.port, self._stop))
+        await asyncio.sleep(0)
+        self._started.set()
+        await task
@@ -0,0 +1,167 @@
+"""Проверка хранилищ: SQLite и PostgreSQL должны отвечать одинаково.
+
+Один и тот же сценарий (записи, чтения, покупки, напоминания) выполняется
+на временной базе SQLite и, если задан адрес, во временной схеме PostgreSQL.
+Ответы сравниваются шаг за шагом, при расхождении код выхода 1.
+
+Запуск: python benchmarks/check_storage.py [--postgres postgresql://user@localhost/db] [--ops 2000]
+(без --postgres адрес берется из DATABASE_URL; без адреса проверяется только SQLite)
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import date
+
+os.environ.setdefault('BOT_TOKEN', '0:benchmark')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot  # noqa: E402
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+ALICE, BOB, CAROL = 101, 202, 303
+
+
+async def scenario(storage):
+    """Список (шаг, ответ); неупорядоченные выборки отсортированы"""
+    steps = []
+
+    def check(step, value):
+        steps.append((step, value))
+
+    await storage.open()
+    await storage.open()  # повторное открытие не меняет схему и данные
+
+    check('пустое отношение', await storage.relationship(ALICE))
+    check('пустые дни рождения', await storage.birthdays(ALICE))
+    check('пустая маска', await storage.features_mask(ALICE))
+
+    await storage.write([bot.relationship_write(ALICE, date(2020, 2, 14), 'Маша')])
+    await storage.write([bot.relationship_write(ALICE, date(2021, 3, 8), 'Маша')])
+    await storage.write([bot.relationship_write(BOB, date(2019, 1, 1))])
+    check('отношение', await storage.relationship(ALICE))
+    check('отношение без имени', await storage.relationship(BOB))
+
+    await storage.write([
+        bot.birthday_write(ALICE, 'Оля', date(1990, 5, 1)),
+        bot.birthday_write(ALICE, 'Петя', date(1985, 5, 1)),
+        bot.birthday_write(ALICE, 'Аня', date(1999, 12, 31)),
+        bot.birthday_delete_write(ALICE, 'Аня'),
+        bot.birthday_write(ALICE, 'Оля', date(1991, 5, 1)),
+    ])
+    check('дни рождения', sorted(await storage.birthdays(ALICE)))
+
+    await storage.write([
+        bot.personal_holiday_write(ALICE, 'Годовщина', '14.02'),
+        bot.personal_holiday_write(ALICE, 'Первое свидание', '01.05'),
+        bot.personal_holiday_write(ALICE, 'Кривая дата', 'когда-нибудь'),
+        bot.personal_holiday_write(CAROL, 'Новоселье', '20.09'),
+    ])
+    check('личные праздники', sorted(await storage.personal_holidays(ALICE)))
+    check('события пользователя', await storage.user_events(ALICE))
+    check('владельцы событий', sorted(await storage.event_owner_ids()))
+
+    check('пачка изменений', await storage.write_batch([
+        bot.birthday_write(BOB, 'Друг', date(2000, 7, 7)),
+        bot.relationship_write(CAROL, date(2022, 6, 1), 'Дима'),
+    ]))
+    check('все пользователи', sorted(await storage.all_user_ids()))
+
+    check('запись часового пояса', await storage.set_timezone(ALICE, 'Asia/Tokyo'))
+    check('смена часового пояса', await storage.set_timezone(ALICE, 'Europe/Berlin'))
+    await storage.set_timezone(BOB, 'America/New_York')
+    check('часовые пояса', sorted(await storage.user_timezones()))
+
+    check('покупка', await storage.add_feature(ALICE, 'smart_reminders'))
+    check('вторая покупка', await storage.add_feature(ALICE, 'personal_holidays'))
+    check('повторная покупка', await storage.add_feature(ALICE, 'personal_holidays'))
+    check('пакет', await storage.add_feature(CAROL, 'premium_pack'))
+    check('маска', await storage.features_mask(ALICE))
+    check('все маски', sorted(await storage.feature_masks()))
+
+    check('напоминания', sorted(await storage.reminder_events()))
+    check('напоминания пользователя', sorted(await storage.reminder_events(ALICE)))
+    check('напоминания без подписки', await storage.reminder_events(BOB))
+    return steps
+
+
+async def throughput(storage, ops, concurrency=50):
+    """Записей и чтений в секунду при concurrency одновременных обработчиках"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(coro):
+        async with semaphore:
+            await coro
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(storage.write([bot.relationship_write(10000 + i, date(2020, 2, 14), 'Маша')]))
+                           for i in range(ops)))
+    writes = ops / (time.perf_counter() - started)
+    started = time.perf_counter()
+    await asyncio.gather(*(one(storage.relationship(10000 + i)) for i in range(ops)))
+    reads = ops / (time.perf_counter() - started)
+    return writes, reads
+
+
+async def run_sqlite(ops):
+    with tempfile.TemporaryDirectory() as tmp:
+        bot.DB_PATH = os.path.join(tmp, 'check.db')
+        bot.close_connections()
+        storage = bot.SQLiteStorage()
+        try:
+            return await scenario(storage), await throughput(storage, ops)
+        finally:
+            await storage.close()
+
+
+async def run_postgres(url, ops):
+    """Сценарий во временной схеме, чтобы не трогать таблицы бота"""
+    schema = f"check_storage_{os.getpid()}"
+    conn = await asyncpg.connect(url)
+    await conn.execute(f'CREATE SCHEMA {schema}')
+    try:
+        # Неизвестные параметры адреса asyncpg передает серверу как настройки сессии
+        separator = '&' if '?' in url else '?'
+        storage = bot.PostgresStorage(f"{url}{separator}search_path={schema}")
+        try:
+            return await scenario(storage), await throughput(storage, ops)
+        finally:
+            await storage.close()
+    finally:
+        await conn.execute(f'DROP SCHEMA {schema} CASCADE')
+        await conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--postgres', default=os.environ.get('DATABASE_URL', ''))
+    parser.add_argument('--ops', type=int, default=2000)
+    args = parser.parse_args()
+
+    reference, (writes, reads) = asyncio.run(run_sqlite(args.ops))
+    print(f"{'SQLite':<12} {len(reference)} шагов, {writes:>8,.0f} записей/s {reads:>8,.0f} чтений/s")
+    if not args.postgres.startswith(('postgres://', 'postgresql://')):
+        print("PostgreSQL не задан (--postgres или DATABASE_URL), проверено только SQLite")
+        return
+    if asyncpg is None:
+        sys.exit("Для проверки PostgreSQL нужен пакет asyncpg: pip install asyncpg")
+
+    steps, (writes, reads) = asyncio.run(run_postgres(args.postgres, args.ops))
+    print(f"{'PostgreSQL':<12} {len(steps)} шагов, {writes:>8,.0f} записей/s {reads:>8,.0f} чтений/s")
+    mismatches = [(step, expected, actual) for (step, expected), (_, actual) in zip(reference, steps)
+                  if expected != actual]
+    for step, expected, actual in mismatches:
+        print(f"❌ {step}: SQLite {expected!r}, PostgreSQL {actual!r}")
+    if mismatches:
+        sys.exit(1)
+    print("✅ ответы совпадают")
+
+
+if __name__ == '__main__':
+    main()
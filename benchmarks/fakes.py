@@ -0,0 +1,99 @@
+"""Поддельные Update/Context для прогона обработчиков bot.py без Telegram."""
+import asyncio
+import time
+
+
+class FakeUser:
+    __slots__ = ('id', 'first_name')
+
+    def __init__(self, user_id):
+        self.id = user_id
+        self.first_name = f"user{user_id}"
+
+
+class FakeMessage:
+    """Сообщение, которое запоминает ответы вместо отправки в Telegram"""
+
+    def __init__(self, text, replies):
+        self.text = text
+        self.replies = replies
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append((text, kwargs))
+
+
+class FakeUpdate:
+    def __init__(self, user_id, text, replies=None):
+        self.replies = [] if replies is None else replies
+        self.effective_user = FakeUser(user_id)
+        self.effective_chat = self.effective_user
+        self.message = FakeMessage(text, self.replies)
+        self.effective_message = self.message
+        self.callback_query = None
+
+
+class FakeCallbackQuery:
+    """Нажатие inline-кнопки: правки сообщения запоминаются как ответы"""
+
+    def __init__(self, user, data, replies):
+        self.from_user = user
+        self.data = data
+        self.replies = replies
+
+    async def answer(self, text=None, **kwargs):
+        pass
+
+    async def edit_message_text(self, text, **kwargs):
+        self.replies.append((text, kwargs))
+
+
+class FakeApplication:
+    async def _noop(self):
+        pass
+
+    def create_task(self, coroutine):
+        # Фоновые задачи обработчиков (например, отчет о рассылке) в замерах не выполняются
+        coroutine.close()
+        return asyncio.ensure_future(self._noop())
+
+
+class FakeContext:
+    def __init__(self, args=None, bot=None, job_queue=None):
+        self.args = list(args or [])
+        self.bot = bot
+        self.job_queue = job_queue
+        self.application = FakeApplication()
+        self.error = None
+
+
+def make_call(user_id, command_line):
+    """Update и Context для текста команды вида '/setdate 14.02.2020 Маша'"""
+    parts = command_line.split()
+    return FakeUpdate(user_id, command_line), FakeContext(parts[1:])
+
+
+def make_callback(user_id, data):
+    """Update и Context для нажатия кнопки с callback_data вида 'page:birthdays:1'"""
+    update = FakeUpdate(user_id, None)
+    update.message = update.effective_message = None
+    update.callback_query = FakeCallbackQuery(update.effective_user, data, update.replies)
+    return update, FakeContext()
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class Stopwatch:
+    __slots__ = ('started', 'elapsed')
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.started
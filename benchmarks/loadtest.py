@@ -0,0 +1,176 @@
+"""Сквозной нагрузочный тест: тысячи виртуальных пользователей против настоящего Application.
+
+Бот из bot.py (build_application + run_bot, режим polling) получает апдейты
+из локального MockBotAPI через getUpdates и отвечает через sendMessage.
+Генератор подает апдейты с заданной частотой (открытая модель) по ступеням
+--rates и для каждой ступени печатает фактическую пропускную способность,
+перцентили задержки "апдейт -> ответ", отставание и загрузку БД.
+Ступень, на которой бот перестает успевать, - точка насыщения инстанса.
+
+Запуск: python benchmarks/loadtest.py [--users 5000] [--rates 50,100,200,400] [--step-seconds 5] [--rtt-ms 0]
+"""
+import argparse
+import collections
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bot_runner import BotRunner, bot  # noqa: E402
+from fakes import percentile  # noqa: E402
+from mock_bot_api import MockBotAPI, make_update  # noqa: E402
+
+# Смесь команд, похожая на реальный трафик: (вес, шаблон)
+COMMAND_MIX = (
+    (30, '/count'),
+    (15, '/holidays'),
+    (10, '/stats'),
+    (10, '/birthdays'),
+    (8, '/setdate {day:02d}.0{month}.2021 Партнер'),
+    (8, '/addbirthday Друг{n} {day:02d}.0{month}'),
+    (5, '/nextholiday'),
+    (5, '/allholidays'),
+    (4, '/find день'),
+    (3, '/buy_advanced_stats'),
+    (2, '/buy_smart_reminders'),
+)
+
+
+class LoadGenerator:
+    def __init__(self, api, users, seed=1):
+        self.api = api
+        self.users = users
+        self.rnd = random.Random(seed)
+        self.weights = [weight for weight, _ in COMMAND_MIX]
+        self.templates = [template for _, template in COMMAND_MIX]
+        self.lock = threading.Lock()
+        self.pending = collections.defaultdict(collections.deque)  # user_id -> времена отправки
+        self.latencies = []
+        self.replies = 0
+        api.on_send = self.on_reply
+
+    def make_text(self):
+        template = self.rnd.choices(self.templates, self.weights)[0]
+        return template.format(n=self.rnd.randrange(20), day=self.rnd.randrange(1, 28),
+                               month=self.rnd.randrange(1, 10))
+
+    def on_reply(self, chat_id, text, payload):
+        now = time.perf_counter()
+        with self.lock:
+            sent = self.pending.get(chat_id)
+            if sent:
+                self.latencies.append(now - sent.popleft())
+                self.replies += 1
+
+    def backlog(self):
+        with self.lock:
+            return sum(len(sent) for sent in self.pending.values())
+
+    def run_step(self, rate, seconds):
+        with self.lock:
+            self.latencies = []
+            self.replies = 0
+        total = int(rate * seconds)
+        started = self.started = time.perf_counter()
+        for i in range(total):
+            target = started + i / rate
+            delay = target - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            user_id = 1 + self.rnd.randrange(self.users)
+            update = make_update(self.api.next_update_id(), user_id, self.make_text())
+            with self.lock:
+                self.pending[user_id].append(time.perf_counter())
+            self.api.push_update(update)
+        return total
+
+
+class DBSampler:
+    """Фоновый замер глубины очереди к БД"""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.samples.append(bot.db_worker.depth())
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def handler_totals():
+    stats = bot.metrics.handlers.values()
+    return (sum(s.total for s in stats), sum(s.db_seconds for s in stats),
+            sum(s.send_seconds for s in stats), sum(s.count for s in stats))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--rates', default='50,100,200,400', help='ступени нагрузки, апдейтов в секунду')
+    parser.add_argument('--step-seconds', type=float, default=5)
+    parser.add_argument('--drain-seconds', type=float, default=10, help='сколько ждать ответы после ступени')
+    parser.add_argument('--rtt-ms', type=float, default=0, help='имитация сетевой задержки до Telegram')
+    parser.add_argument('--p99-limit-ms', type=float, default=1000, help='порог p99 для точки насыщения')
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bot.DB_PATH = os.path.join(tmp, 'loadtest.db')
+        bot.close_connections()
+        bot.init_db()
+        api = MockBotAPI(rtt=args.rtt_ms / 1000).start()
+        runner = BotRunner(api, mode='polling').start()
+        generator = LoadGenerator(api, args.users)
+        saturation = None
+        print(f"{'rate':>6} {'sent':>6} {'replied':>7} {'thrpt/s':>8} {'p50 ms':>8} {'p95 ms':>8} "
+              f"{'p99 ms':>8} {'backlog':>7} {'dbq max':>7} {'db %':>5} {'tg %':>5}")
+        try:
+            for rate in (float(r) for r in args.rates.split(',')):
+                before = handler_totals()
+                with DBSampler() as sampler:
+                    sent = generator.run_step(rate, args.step_seconds)
+                    deadline = time.monotonic() + args.drain_seconds
+                    while generator.backlog() and time.monotonic() < deadline:
+                        time.sleep(0.05)
+                elapsed = time.perf_counter() - generator.started
+                after = handler_totals()
+                handler_seconds = max(after[0] - before[0], 1e-9)
+                ms = [x * 1000 for x in generator.latencies]
+                backlog = generator.backlog()
+                throughput = generator.replies / max(elapsed, 1e-9)
+                p99 = percentile(ms, 99)
+                print(f"{rate:>6.0f} {sent:>6} {generator.replies:>7} {throughput:>8.0f} "
+                      f"{percentile(ms, 50):>8.1f} {percentile(ms, 95):>8.1f} {p99:>8.1f} {backlog:>7} "
+                      f"{max(sampler.samples or [0]):>7} "
+                      f"{(after[1] - before[1]) / handler_seconds:>5.0%} {(after[2] - before[2]) / handler_seconds:>5.0%}")
+                if saturation is None and (backlog or p99 > args.p99_limit_ms):
+                    saturation = rate
+                    break
+        finally:
+            runner.stop()
+            api.stop()
+
+    if saturation:
+        print(f"\nнасыщение: около {saturation:.0f} апдейтов/с (отставание или p99 > {args.p99_limit_ms:.0f} ms)")
+    else:
+        print("\nнасыщение не достигнуто, увеличь --rates")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+"""Локальная подмена Telegram Bot API для бенчмарков.
+
+Понимает getMe, getUpdates (long polling), setWebhook/deleteWebhook и sendMessage.
+Может имитировать флуд-контроль Telegram: при превышении общего лимита или лимита
+на чат отвечает 429 с retry_after, как настоящий сервер.
+
+    api = MockBotAPI(flood_control=True)
+    api.start()
+    bot = telegram.Bot(api.token, base_url=api.base_url)
+"""
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+
+class _Bucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def take(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        # Небольшой допуск на сетевой джиттер между отправкой и приемом
+        if self.tokens >= 0.95:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class _QuietServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # При параллельной обработке бот открывает десятки соединений сразу; с очередью
+    # accept по умолчанию (5) лишние SYN теряются и ждут повтора TCP около секунды
+    request_queue_size = 1024
+
+    def handle_error(self, request, client_address):
+        # Бот закрывает long polling соединение при остановке - это не ошибка
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class MockBotAPI:
+    def __init__(self, token='123456:MOCK', flood_control=False, global_rate=30, chat_rate=1,
+                 send_delay=0.0, rtt=0.0, host='127.0.0.1', port=0):
+        self.token = token
+        self.rtt = rtt                # имитация сетевой задержки до Telegram на каждый запрос
+        self.flood_control = flood_control
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.send_delay = send_delay
+        self.sent = []            # (время, chat_id, текст)
+        self.rejected = 0         # ответов 429
+        self.on_send = None       # callback(chat_id, text, payload) при каждом sendMessage
+        self.webhook_url = None
+        self._updates = []
+        self._update_id = 0
+        self._offset = 0
+        self._cond = threading.Condition()
+        self._lock = threading.Lock()
+        self._global_bucket = _Bucket(global_rate, global_rate, time.monotonic())
+        self._chat_buckets = {}
+        self._message_id = 0
+        self._server = _QuietServer((host, port), self._handler_class())
+        self._thread = None
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}/bot"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='mock-bot-api', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        with self._cond:
+            self._cond.notify_all()
+
+    def next_update_id(self):
+        with self._cond:
+            self._update_id += 1
+            return self._update_id
+
+    def push_update(self, update):
+        """Добавить апдейт для getUpdates; возвращает его update_id"""
+        with self._cond:
+            if 'update_id' not in update:
+                self._update_id += 1
+                update['update_id'] = self._update_id
+            self._updates.append(update)
+            self._cond.notify_all()
+            return update['update_id']
+
+    def _get_updates(self, params):
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 100)
+        timeout = min(float(params.get('timeout') or 0), 1.0)
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            if offset:
+                self._updates = [u for u in self._updates if u['update_id'] >= offset]
+            while not self._updates and time.monotonic() < deadline:
+                self._cond.wait(deadline - time.monotonic())
+            return self._updates[:limit]
+
+    def _send_message(self, params):
+        chat_id = int(params['chat_id'])
+        now = time.monotonic()
+        if self.flood_control:
+            with self._lock:
+                bucket = self._chat_buckets.get(chat_id)
+                if bucket is None:
+                    bucket = self._chat_buckets[chat_id] = _Bucket(self.chat_rate, 1, now)
+                allowed = bucket.take(now) and self._global_bucket.take(now)
+                if not allowed:
+                    self.rejected += 1
+                    return 429, {'ok': False, 'error_code': 429,
+                                 'description': 'Too Many Requests: retry after 1',
+                                 'parameters': {'retry_after': 1}}
+        if self.send_delay:
+            time.sleep(self.send_delay)
+        with self._lock:
+            self._message_id += 1
+            message_id = self._message_id
+            self.sent.append((time.monotonic(), chat_id, params.get('text')))
+        if self.on_send:
+            self.on_send(chat_id, params.get('text'), params)
+        return 200, {'ok': True, 'result': {
+            'message_id': message_id, 'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'}, 'text': params.get('text', ''),
+        }}
+
+    def handle(self, method, params):
+        if method == 'getMe':
+            return 200, {'ok': True, 'result': {'id': int(self.token.split(':')[0]), 'is_bot': True,
+                                                'first_name': 'Mock', 'username': 'mock_bot'}}
+        if method == 'getUpdates':
+            return 200, {'ok': True, 'result': self._get_updates(params)}
+        if method == 'setWebhook':
+            self.webhook_url = params.get('url')
+            return 200, {'ok': True, 'result': True}
+        if method == 'deleteWebhook':
+            self.webhook_url = None
+            return 200, {'ok': True, 'result': True}
+        if method == 'sendMessage':
+            return self._send_message(params)
+        return 200, {'ok': True, 'result': True}
+
+    def _handler_class(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length).decode('utf-8') if length else ''
+                if self.headers.get('Content-Type', '').startswith('application/json'):
+                    params = json.loads(body or '{}')
+                else:
+                    params = dict(parse_qsl(body))
+                method = self.path.rsplit('/', 1)[-1]
+                # Половина RTT - запрос идет до Telegram, половина - ответ обратно
+                if api.rtt:
+                    time.sleep(api.rtt / 2)
+                status, payload = api.handle(method, params)
+                if api.rtt:
+                    time.sleep(api.rtt / 2)
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST
+
+        return Handler
+
+
+def make_update(update_id, user_id, text):
+    """JSON апдейта с текстовым сообщением, как его присылает Telegram"""
+    message = {
+        'message_id': update_id,
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'},
+        'text': text,
+    }
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {'update_id': update_id, 'message': message}
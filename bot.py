@@ -1,32 +1,40 @@
+import abc
+import argparse
+import asyncio
+import bisect
+import calendar
+import collections
+import contextvars
+import functools
+import gzip
+import heapq
+import itertools
+import queue
 import sqlite3
 import logging
+import math
+import json
 import os
-from telegram import Update
-from telegram.ext import Application, CommandHandler, ContextTypes
-from datetime import datetime
+import re
+import shutil
+import signal
+import sys
+import threading
+from time import monotonic, perf_counter, sleep
+from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram.error import BadRequest, NetworkError, RetryAfter, TelegramError, TimedOut
+from telegram.ext import (Application, ApplicationHandlerStop, BaseUpdateProcessor, CallbackQueryHandler,
+                          CommandHandler, ContextTypes, TypeHandler)
+from telegram.request import HTTPXRequest
+from datetime import date, datetime, time, timedelta
 import pytz
-from flask import Flask
-from threading import Thread
+import tornado.httpclient
+import tornado.web
 
-# Веб-сервер для Render
-app = Flask('')
-
-@app.route('/')
-def home():
-    return "🤖 Love Days Bot is running! 🌟"
-
-@app.route('/health')
-def health():
-    return "✅ Bot is healthy and running!"
-
-def run_web_server():
-    port = int(os.environ.get('PORT', 10000))
-    app.run(host='0.0.0.0', port=port)
-
-def keep_alive():
-    t = Thread(target=run_web_server)
-    t.daemon = True
-    t.start()
+try:
+    import asyncpg
+except ImportError:  # нужен только для хранилища PostgreSQL
+    asyncpg = None
 
 # Настройка логирования
 logging.basicConfig(
@@ -35,20 +43,12 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Получаем токен из переменных окружения Render
+# Получаем токен из переменных окружения Render (проверяется при запуске бота,
+# служебным командам вроде reshard токен не нужен)
 BOT_TOKEN = os.environ.get('BOT_TOKEN')
 
-if not BOT_TOKEN:
-    print("❌ Ошибка: BOT_TOKEN не найден!")
-    print("ℹ️ Установи переменную BOT_TOKEN в настройках Render")
-    exit(1)
-
-BOT_TOKEN = os.environ.get('BOT_TOKEN') or "8475594457:AAG-W1Xk46Igpv9yMibtOFmZhSy_Q7LEcsM"
-
-if not BOT_TOKEN:
-    print("❌ Ошибка: BOT_TOKEN не найден!")
-    print("ℹ️ Проверь файл .env")
-    exit(1)
+# Администраторы бота (для рассылок), через запятую
+ADMIN_IDS = {int(user_id) for user_id in os.environ.get('ADMIN_IDS', '').split(',') if user_id.strip()}
 
 # Премиум функции и их стоимость в звездах
 PREMIUM_FEATURES = {
@@ -79,209 +79,2605 @@ PREMIUM_FEATURES = {
     }
 }
 
-# Праздники мира
-HOLIDAYS = {
-    # 🇷🇺 Российские праздники
-    "Новый год": "01.01",
-    "Рождество": "07.01",
-    "Старый Новый год": "14.01",
-    "День защитника Отечества": "23.02",
-    "Международный женский день": "08.03",
-    "День весны и труда": "01.05",
-    "День Победы": "09.05",
-    "День России": "12.06",
-    "День народного единства": "04.11",
-
-    # 🌍 Международные праздники
-    "День святого Валентина": "14.02",
-    "День смеха": "01.04",
-    "Хэллоуин": "31.10",
-    "День рождения бота": "15.11",
-
-    # 🇺🇸 Американские праздники
-    "День независимости США": "04.07",
-    "День благодарения": "28.11",
-    "Хэллоуин в США": "31.10",
-    "День памяти": "27.05",
-
-    # 🇪🇺 Европейские праздники
-    "День Европы": "09.05",
-    "Октоберфест": "16.09",
-    "День святого Патрика": "17.03",
-
-    # 🇨🇳 Китайские праздники
-    "Китайский Новый год": "29.01",
-    "Праздник луны": "15.08",
-    "День образования КНР": "01.10",
-
-    # 🇧🇷 Бразильские праздники
-    "Карнавал в Рио": "24.02",
-    "День независимости Бразилии": "07.09",
-
-    # 🇮🇳 Индийские праздники
-    "Дивали": "01.11",
-    "День независимости Индии": "15.08",
-    "Холи": "25.03",
-
-    # 🇲🇽 Мексиканские праздники
-    "День мёртвых": "02.11",
-    "День независимости Мексики": "16.09",
-
-    # 🇯🇵 Японские праздники
-    "Ханами": "27.03",
-    "День основания государства": "11.02",
-    "День рождения императора": "23.02",
-
-    # 🇰🇷 Корейские праздники
-    "Лунный Новый год": "10.02",
-    "День освобождения Кореи": "15.08",
-
-    # 🌐 Другие международные
-    "Международный день мира": "21.09",
-    "День Земли": "22.04",
-    "День защиты детей": "01.06",
-    "Всемирный день туризма": "27.09",
-    "Международный день музыки": "01.10",
-    "День космонавтики": "12.04",
-    "День учителя": "05.10"
+# Биты премиум функций в premium_users.features (номера битов хранятся в БД - не менять)
+FEATURE_BITS = {
+    "advanced_stats": 1 << 0,
+    "personal_holidays": 1 << 1,
+    "smart_reminders": 1 << 2,
+    "compatibility_tests": 1 << 3,
+    "premium_pack": 1 << 4,
 }
 
+# Каталог праздников: правила дат, регионы, категории и синонимы для поиска
+HOLIDAYS_PATH = os.environ.get('HOLIDAYS_PATH') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'holidays.json')
+
+
+# Путь к БД вычисляем один раз (DB_PATH можно переопределить через окружение)
+DB_PATH = os.environ.get('DB_PATH') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'relationships.db')
+
+# Настройки SQLite: WAL + synchronous=NORMAL убирают fsync на каждом коммите,
+# кэш страниц и mmap снижают количество обращений к диску
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+)
+
+# Сколько подготовленных запросов держит каждое соединение
+SQLITE_STATEMENT_CACHE = 128
+
+_db_local = threading.local()
+_db_connections = []
+_db_connections_lock = threading.Lock()
+_db_generation = 0
+
 
 def get_db_path():
-    return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'relationships.db')
-
-
-def init_db():
-    db_path = get_db_path()
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS relationships (
-            user_id INTEGER PRIMARY KEY,
-            start_date TEXT,
-            partner_name TEXT
-        )
-    ''')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS birthdays (
-            user_id INTEGER,
-            name TEXT,
-            date TEXT,
-            PRIMARY KEY (user_id, name)
-        )
-    ''')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS personal_holidays (
-            user_id INTEGER,
-            name TEXT,
-            date TEXT,
-            PRIMARY KEY (user_id, name)
-        )
-    ''')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS premium_users (
-            user_id INTEGER PRIMARY KEY,
-            purchased_features TEXT,
-            purchase_date TEXT
-        )
-    ''')
-    conn.commit()
-    conn.close()
+    return DB_PATH
+
+
+def get_connection():
+    """Постоянное соединение с БД для текущего потока"""
+    conn = getattr(_db_local, 'conn', None)
+    if conn is None or _db_local.generation != _db_generation:
+        conn = sqlite3.connect(get_db_path(), cached_statements=SQLITE_STATEMENT_CACHE,
+                               check_same_thread=False)
+        for pragma in SQLITE_PRAGMAS:
+            conn.execute(pragma)
+        _db_local.conn = conn
+        _db_local.generation = _db_generation
+        with _db_connections_lock:
+            _db_connections.append(conn)
+    return conn
+
+
+def close_connections():
+    """Закрыть все открытые соединения (при остановке бота или смене DB_PATH)"""
+    global _db_generation
+    with _db_connections_lock:
+        for conn in _db_connections:
+            conn.close()
+        _db_connections.clear()
+        _db_generation += 1
+
+
+# МИГРАЦИИ СХЕМЫ
+# Версия схемы хранится в PRAGMA user_version, каждая миграция выполняется один раз.
+# Миграции должны переживать повторный запуск после сбоя на середине.
+MIGRATION_BATCH_SIZE = 5000
+
+
+def migration_base_schema(conn):
+    with conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS relationships (
+                user_id INTEGER PRIMARY KEY,
+                start_date TEXT,
+                partner_name TEXT
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS birthdays (
+                user_id INTEGER,
+                name TEXT,
+                date TEXT,
+                PRIMARY KEY (user_id, name)
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS personal_holidays (
+                user_id INTEGER,
+                name TEXT,
+                date TEXT,
+                PRIMARY KEY (user_id, name)
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS premium_users (
+                user_id INTEGER PRIMARY KEY,
+                purchased_features TEXT,
+                purchase_date TEXT,
+                features INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        migrate_premium_features(conn)
+
+
+def migrate_premium_features(conn):
+    """Перенос покупок из строки через запятую в битовую маску features"""
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(premium_users)')]
+    if 'features' in columns:
+        return
+    conn.execute('ALTER TABLE premium_users ADD COLUMN features INTEGER NOT NULL DEFAULT 0')
+    rows = conn.execute('SELECT user_id, purchased_features FROM premium_users').fetchall()
+    conn.executemany('UPDATE premium_users SET features = ? WHERE user_id = ?',
+                     [(features_to_mask((features or '').split(',')), user_id) for user_id, features in rows])
+
+
+def migration_month_day_columns(conn):
+    """Отдельные колонки месяц/день с индексом для поиска событий по дате у всех пользователей"""
+    for table in ('birthdays', 'personal_holidays'):
+        columns = [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+        with conn:
+            if 'month' not in columns:
+                conn.execute(f'ALTER TABLE {table} ADD COLUMN month INTEGER')
+            if 'day' not in columns:
+                conn.execute(f'ALTER TABLE {table} ADD COLUMN day INTEGER')
+
+        # Заполняем пачками, чтобы не держать блокировку записи на всю таблицу
+        last_rowid = 0
+        while True:
+            rows = conn.execute(f'''
+                SELECT rowid, date FROM {table}
+                WHERE month IS NULL AND rowid > ? ORDER BY rowid LIMIT ?
+            ''', (last_rowid, MIGRATION_BATCH_SIZE)).fetchall()
+            if not rows:
+                break
+            last_rowid = rows[-1][0]
+            updates = []
+            for rowid, date_str in rows:
+                day_month = parse_day_month(date_str) if date_str else None
+                if day_month:
+                    updates.append((day_month[0], day_month[1], rowid))
+            with conn:
+                conn.executemany(f'UPDATE {table} SET month = ?, day = ? WHERE rowid = ?', updates)
+
+        with conn:
+            conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_month_day ON {table} (month, day)')
+
+
+def migration_user_settings(conn):
+    with conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS user_settings (
+                user_id INTEGER PRIMARY KEY,
+                timezone TEXT
+            )
+        ''')
+
+
+MIGRATIONS = (
+    (1, migration_base_schema),
+    (2, migration_month_day_columns),
+    (3, migration_user_settings),
+)
+
+
+def init_db(conn=None):
+    conn = conn or get_connection()
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    for target_version, migration in MIGRATIONS:
+        if target_version <= version:
+            continue
+        logger.info(f"Миграция БД до версии {target_version}: {migration.__name__}")
+        migration(conn)
+        with conn:
+            conn.execute(f'PRAGMA user_version = {target_version}')
 
 
 def get_relationship_data(user_id):
-    db_path = get_db_path()
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute('SELECT start_date, partner_name FROM relationships WHERE user_id = ?', (user_id,))
-    result = cursor.fetchone()
-    conn.close()
-    return result
+    conn = get_connection()
+    return conn.execute('SELECT start_date, partner_name FROM relationships WHERE user_id = ?',
+                        (user_id,)).fetchone()
 
 
-def set_relationship_data(user_id, start_date, partner_name=None):
-    db_path = get_db_path()
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute('''
+# Изменения данных пользователей описываются как (операция, параметры), чтобы их
+# можно было выполнить сразу или пачкой через WriteBehind в любом хранилище
+SQLITE_WRITES = {
+    'relationship': '''
         INSERT OR REPLACE INTO relationships (user_id, start_date, partner_name)
         VALUES (?, ?, ?)
-    ''', (user_id, start_date.isoformat(), partner_name))
-    conn.commit()
-    conn.close()
+    ''',
+    'birthday': '''
+        INSERT OR REPLACE INTO birthdays (user_id, name, date, month, day)
+        VALUES (?, ?, ?, ?, ?)
+    ''',
+    'birthday_delete': 'DELETE FROM birthdays WHERE user_id = ? AND name = ?',
+    'personal_holiday': '''
+        INSERT OR REPLACE INTO personal_holidays (user_id, name, date, month, day)
+        VALUES (?, ?, ?, ?, ?)
+    ''',
+}
+
+
+def execute_writes(writes):
+    """Записи одной транзакцией; подряд идущие одинаковые операции - одним executemany"""
+    conn = get_connection()
+    with conn:
+        for operation, group in itertools.groupby(writes, key=lambda write: write[0]):
+            conn.executemany(SQLITE_WRITES[operation], [params for _, params in group])
+
+
+def relationship_write(user_id, start_date, partner_name=None):
+    return 'relationship', (user_id, start_date.isoformat(), partner_name)
+
+
+def set_relationship_data(user_id, start_date, partner_name=None):
+    execute_writes([relationship_write(user_id, start_date, partner_name)])
+
+
+def get_user_timezones():
+    conn = get_connection()
+    return conn.execute('SELECT user_id, timezone FROM user_settings WHERE timezone IS NOT NULL').fetchall()
+
+
+def set_user_timezone(user_id, timezone):
+    conn = get_connection()
+    with conn:
+        conn.execute('''
+            INSERT INTO user_settings (user_id, timezone) VALUES (?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET timezone = excluded.timezone
+        ''', (user_id, timezone))
 
 
 def get_birthdays(user_id):
-    db_path = get_db_path()
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute('SELECT name, date FROM birthdays WHERE user_id = ?', (user_id,))
-    result = cursor.fetchall()
-    conn.close()
-    return result
+    conn = get_connection()
+    return conn.execute('SELECT name, date FROM birthdays WHERE user_id = ?', (user_id,)).fetchall()
+
+
+def load_birthdays(user_id):
+    return tuple(get_birthdays(user_id))
+
+
+def birthday_write(user_id, name, date):
+    return 'birthday', (user_id, name, date.isoformat(), date.month, date.day)
 
 
 def add_birthday(user_id, name, date):
-    db_path = get_db_path()
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT OR REPLACE INTO birthdays (user_id, name, date)
-        VALUES (?, ?, ?)
-    ''', (user_id, name, date.isoformat()))
-    conn.commit()
-    conn.close()
+    execute_writes([birthday_write(user_id, name, date)])
+
+
+def birthday_delete_write(user_id, name):
+    return 'birthday_delete', (user_id, name)
+
+
+def personal_holiday_write(user_id, name, date_str):
+    month, day = parse_day_month(date_str) or (None, None)
+    return 'personal_holiday', (user_id, name, date_str, month, day)
+
+
+def get_event_owner_ids():
+    conn = get_connection()
+    return [row[0] for row in conn.execute('SELECT user_id FROM birthdays UNION SELECT user_id FROM personal_holidays')]
+
+
+def get_user_events(user_id):
+    """Личные праздники и дни рождения пользователя: два списка (месяц, день, название) по дате"""
+    conn = get_connection()
+    personal_holidays = conn.execute('''
+        SELECT month, day, name FROM personal_holidays
+        WHERE user_id = ? AND month IS NOT NULL ORDER BY month, day, name
+    ''', (user_id,)).fetchall()
+    birthdays = conn.execute('''
+        SELECT month, day, name FROM birthdays
+        WHERE user_id = ? AND month IS NOT NULL ORDER BY month, day, name
+    ''', (user_id,)).fetchall()
+    return personal_holidays, birthdays
+
+
+def get_personal_holidays(user_id):
+    conn = get_connection()
+    return conn.execute('SELECT name, date FROM personal_holidays WHERE user_id = ?', (user_id,)).fetchall()
+
+
+def get_events_between(first, last):
+    """Дни рождения и личные праздники всех пользователей с first по last включительно.
+
+    Диапазон дат раскладывается на отрезки внутри месяцев, и каждый отрезок
+    читается по индексу (month, day). Возвращает (user_id, тип, название, месяц, день).
+    """
+    segments = []
+    current = first
+    while current <= last:
+        month_end = safe_date(current.year, current.month, calendar.monthrange(current.year, current.month)[1])
+        segment_end = min(month_end, last)
+        segments.append((current.month, current.day, segment_end.day))
+        current = segment_end + timedelta(days=1)
+
+    conn = get_connection()
+    rows = []
+    for month, first_day, last_day in segments:
+        rows += conn.execute('''
+            SELECT user_id, 'birthday', name, month, day FROM birthdays
+            WHERE month = ? AND day BETWEEN ? AND ?
+            UNION ALL
+            SELECT user_id, 'holiday', name, month, day FROM personal_holidays
+            WHERE month = ? AND day BETWEEN ? AND ?
+        ''', (month, first_day, last_day, month, first_day, last_day)).fetchall()
+    return rows
 
 
-def delete_birthday(user_id, name):
-    db_path = get_db_path()
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM birthdays WHERE user_id = ? AND name = ?', (user_id, name))
-    conn.commit()
-    conn.close()
+def get_all_user_ids():
+    conn = get_connection()
+    return [row[0] for row in conn.execute('''
+        SELECT user_id FROM relationships
+        UNION SELECT user_id FROM birthdays
+        UNION SELECT user_id FROM personal_holidays
+        UNION SELECT user_id FROM premium_users
+    ''')]
 
 
-def get_user_features(user_id):
-    db_path = get_db_path()
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute('SELECT purchased_features FROM premium_users WHERE user_id = ?', (user_id,))
-    result = cursor.fetchone()
-    conn.close()
+def features_to_mask(features):
+    mask = 0
+    for feature in features:
+        mask |= FEATURE_BITS.get(feature, 0)
+    return mask
 
-    if result and result[0]:
-        return result[0].split(',')
-    return []
+
+def mask_grants(mask, feature):
+    """Дает ли набор покупок доступ к функции (премиум пакет открывает все)"""
+    return bool(mask & (FEATURE_BITS[feature] | FEATURE_BITS["premium_pack"]))
+
+
+def get_user_features_mask(user_id):
+    conn = get_connection()
+    result = conn.execute('SELECT features FROM premium_users WHERE user_id = ?', (user_id,)).fetchone()
+    return result[0] if result else 0
+
+
+def get_all_feature_masks():
+    conn = get_connection()
+    return conn.execute('SELECT user_id, features FROM premium_users WHERE features != 0').fetchall()
 
 
 def add_user_feature(user_id, feature):
-    current_features = get_user_features(user_id)
-    if feature not in current_features:
-        current_features.append(feature)
-
-    db_path = get_db_path()
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT OR REPLACE INTO premium_users (user_id, purchased_features, purchase_date)
-        VALUES (?, ?, ?)
-    ''', (user_id, ','.join(current_features), datetime.now().isoformat()))
-    conn.commit()
-    conn.close()
+    """Атомарно добавить покупку; возвращает новую маску функций пользователя"""
+    conn = get_connection()
+    with conn:
+        conn.execute('''
+            INSERT INTO premium_users (user_id, features, purchase_date)
+            VALUES (?, ?, ?)
+            ON CONFLICT (user_id) DO UPDATE SET
+                features = features | excluded.features,
+                purchase_date = excluded.purchase_date
+        ''', (user_id, FEATURE_BITS[feature], datetime.now().isoformat()))
+        return conn.execute('SELECT features FROM premium_users WHERE user_id = ?', (user_id,)).fetchone()[0]
+
+
+REMINDER_EVENTS_QUERY = '''
+    WITH subscribers AS (
+        SELECT user_id FROM premium_users
+        WHERE features & :mask != 0 {user_filter}
+    )
+    SELECT b.user_id, 'birthday', b.name, b.date, b.name
+    FROM birthdays b JOIN subscribers s ON s.user_id = b.user_id
+    UNION ALL
+    SELECT p.user_id, 'holiday', p.name, p.date, p.name
+    FROM personal_holidays p JOIN subscribers s ON s.user_id = p.user_id
+    UNION ALL
+    SELECT r.user_id, 'anniversary', '', r.start_date, r.partner_name
+    FROM relationships r JOIN subscribers s ON s.user_id = r.user_id
+'''
+
+
+def get_reminder_events(user_id=None):
+    """События подписчиков умных напоминаний: (user_id, тип, название, дата, заголовок)"""
+    conn = get_connection()
+    mask = FEATURE_BITS["smart_reminders"] | FEATURE_BITS["premium_pack"]
+    if user_id is None:
+        return conn.execute(REMINDER_EVENTS_QUERY.format(user_filter=''), {'mask': mask}).fetchall()
+    return conn.execute(REMINDER_EVENTS_QUERY.format(user_filter='AND user_id = :user_id'),
+                        {'mask': mask, 'user_id': user_id}).fetchall()
+
+
+# Таблицы с данными пользователей: колонки (первая - user_id) и первичный ключ
+DATA_TABLES = {
+    'relationships': (('user_id', 'start_date', 'partner_name'), ('user_id',)),
+    'birthdays': (('user_id', 'name', 'date', 'month', 'day'), ('user_id', 'name')),
+    'personal_holidays': (('user_id', 'name', 'date', 'month', 'day'), ('user_id', 'name')),
+    'premium_users': (('user_id', 'purchased_features', 'purchase_date', 'features'), ('user_id',)),
+    'user_settings': (('user_id', 'timezone'), ('user_id',)),
+}
+
+
+def export_query(table):
+    columns, key = DATA_TABLES[table]
+    return f'SELECT {", ".join(columns)} FROM {table} ORDER BY {", ".join(key)}'
+
+
+def import_rows(table, columns, rows):
+    """Строки выгрузки одной транзакцией, существующие записи заменяются"""
+    conn = get_connection()
+    with conn:
+        conn.executemany(f'INSERT OR REPLACE INTO {table} ({", ".join(columns)}) '
+                         f'VALUES ({", ".join("?" * len(columns))})', rows)
+
+
+# МЕТРИКИ
+# Время обработчиков, ошибки и доли времени на БД и на запросы к Telegram
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') != '0'
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# [секунды в БД, секунды в Telegram] текущего обработчика
+handler_timing = contextvars.ContextVar('handler_timing', default=None)
+
+
+class HandlerStats:
+    __slots__ = ('buckets', 'count', 'errors', 'total', 'db_seconds', 'send_seconds')
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.db_seconds = 0.0
+        self.send_seconds = 0.0
+
+    def observe(self, seconds, db_seconds, send_seconds):
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.db_seconds += db_seconds
+        self.send_seconds += send_seconds
+
+
+class Metrics:
+    """Метрики бота в текстовом формате Prometheus"""
+
+    def __init__(self):
+        self.handlers = {}
+        self.collectors = []
+
+    def handler(self, name):
+        stats = self.handlers.get(name)
+        if stats is None:
+            stats = self.handlers[name] = HandlerStats()
+        return stats
+
+    def add_collector(self, collector):
+        """collector() возвращает [(имя, тип, описание, значение)] для прочих подсистем"""
+        self.collectors.append(collector)
+
+    def render(self):
+        lines = [
+            "# HELP bot_handler_latency_seconds Время выполнения обработчика",
+            "# TYPE bot_handler_latency_seconds histogram",
+        ]
+        for name, stats in sorted(self.handlers.items()):
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), stats.buckets):
+                cumulative += count
+                lines.append(f'bot_handler_latency_seconds_bucket{{handler="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'bot_handler_latency_seconds_sum{{handler="{name}"}} {stats.total}')
+            lines.append(f'bot_handler_latency_seconds_count{{handler="{name}"}} {stats.count}')
+
+        for metric, attr, help_text in (
+                ('bot_handler_calls_total', 'count', 'Вызовы обработчика'),
+                ('bot_handler_errors_total', 'errors', 'Исключения в обработчике'),
+                ('bot_handler_db_seconds_total', 'db_seconds', 'Время обработчика в БД'),
+                ('bot_handler_telegram_seconds_total', 'send_seconds', 'Время обработчика в запросах к Telegram')):
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} counter")
+            for name, stats in sorted(self.handlers.items()):
+                lines.append(f'{metric}{{handler="{name}"}} {getattr(stats, attr)}')
+
+        for collector in self.collectors:
+            for metric, metric_type, help_text, value in collector():
+                lines.append(f"# HELP {metric} {help_text}")
+                lines.append(f"# TYPE {metric} {metric_type}")
+                lines.append(f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+def add_timing(index, seconds):
+    timing = handler_timing.get()
+    if timing is not None:
+        timing[index] += seconds
+
+
+def instrument(name, callback):
+    """Обертка обработчика, которая пишет его время и ошибки в metrics"""
+    stats = metrics.handler(name)
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        timing = [0.0, 0.0]
+        token = handler_timing.set(timing)
+        started = perf_counter()
+        try:
+            return await callback(update, context)
+        except ApplicationHandlerStop:
+            raise  # штатная остановка обработки апдейта, не ошибка
+        except Exception:
+            stats.errors += 1
+            raise
+        finally:
+            elapsed = perf_counter() - started
+            stats.observe(elapsed, timing[0], timing[1])
+            backups.observe_handler(elapsed)
+            handler_timing.reset(token)
+    return wrapper
+
+
+def observe_backups(name, callback):
+    """Обертка без метрик: время обработчика нужно только менеджеру резервных копий"""
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = perf_counter()
+        try:
+            return await callback(update, context)
+        finally:
+            backups.observe_handler(perf_counter() - started)
+    return wrapper
+
+
+def instrument_handlers(application, wrap=instrument):
+    """Обернуть все зарегистрированные обработчики (имя метрики - команда)"""
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            if isinstance(handler, CommandHandler):
+                name = sorted(handler.commands)[0]
+            else:
+                name = handler.callback.__name__
+            handler.callback = wrap(name, handler.callback)
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTP-клиент Bot API, который учитывает время запросов в метриках обработчика"""
+
+    async def do_request(self, *args, **kwargs):
+        started = perf_counter()
+        try:
+            return await super().do_request(*args, **kwargs)
+        finally:
+            add_timing(1, perf_counter() - started)
+
+
+# Все обращения к SQLite выполняются в отдельных потоках,
+# чтобы медленный диск не блокировал event loop и обработку других пользователей.
+# В режиме WAL читатели не ждут писателя, поэтому потоков несколько.
+DB_QUEUE_SIZE = int(os.environ.get('DB_QUEUE_SIZE', 1000))
+DB_THREADS = int(os.environ.get('DB_THREADS', 4))
+
+
+def _resolve_future(future, result, error):
+    if future.done():  # обработчик мог быть отменен, пока запрос ждал в очереди
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+class DBWorker:
+    """Потоки-исполнители запросов к БД с общей ограниченной очередью"""
+
+    def __init__(self, threads=DB_THREADS, maxsize=DB_QUEUE_SIZE):
+        self.threads = threads
+        self.maxsize = maxsize
+        self._queue = queue.Queue(maxsize=maxsize + threads)
+        self._threads = []
+        self._slots = None
+        self._slots_loop = None
+
+    def start(self):
+        if self._threads:
+            return
+        for i in range(self.threads):
+            thread = threading.Thread(target=self._run, name=f'db-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            loop, future, func, args = item
+            result, error = None, None
+            try:
+                result = func(*args)
+            except Exception as e:
+                error = e
+            try:
+                loop.call_soon_threadsafe(_resolve_future, future, result, error)
+            except RuntimeError:  # event loop уже закрыт
+                pass
+
+    async def run(self, func, *args):
+        """Выполнить func(*args) в потоке БД и дождаться результата"""
+        loop = asyncio.get_running_loop()
+        if self._slots_loop is not loop:
+            self._slots = asyncio.Semaphore(self.maxsize)
+            self._slots_loop = loop
+        self.start()
+        # Семафор ограничивает очередь: при перегрузке обработчики ждут слот,
+        # а не блокируют event loop на put()
+        started = perf_counter()
+        try:
+            async with self._slots:
+                future = loop.create_future()
+                self._queue.put_nowait((loop, future, func, args))
+                return await future
+        finally:
+            add_timing(0, perf_counter() - started)
+
+    def depth(self):
+        return self._queue.qsize()
+
+
+db_worker = DBWorker()
+
+
+async def run_db(func, *args):
+    return await db_worker.run(func, *args)
+
+
+# ХРАНИЛИЩЕ
+# Обработчики работают с данными только через storage. По умолчанию это SQLite
+# в файле DB_PATH; DATABASE_URL=postgresql://... переключает бота на PostgreSQL
+# (пакет asyncpg), когда записи перестает хватать одного файла.
+DATABASE_URL = os.environ.get('DATABASE_URL', '')
+POSTGRES_POOL_SIZE = int(os.environ.get('POSTGRES_POOL_SIZE', 10))
+
+
+class Storage(abc.ABC):
+    """Отношения, дни рождения, личные праздники, покупки и настройки пользователей.
+
+    Результаты у всех реализаций одинаковые: кортежи в том же порядке
+    колонок, что и у функций SQLite выше. Изменения приходят списком
+    операций из *_write функций. Реализацию без какого-то метода нельзя создать.
+    """
+
+    # Ошибки БД, после которых пачку изменений можно повторить по одному
+    errors = ()
+
+    @abc.abstractmethod
+    async def open(self):
+        """Подключиться и довести схему до актуальной"""
+
+    async def close(self):
+        pass
+
+    @abc.abstractmethod
+    async def relationship(self, user_id):
+        """(start_date, partner_name) или None"""
+
+    @abc.abstractmethod
+    async def birthdays(self, user_id):
+        """Кортеж (имя, дата)"""
+
+    @abc.abstractmethod
+    async def personal_holidays(self, user_id):
+        """Список (название, DD.MM)"""
+
+    @abc.abstractmethod
+    async def user_events(self, user_id):
+        """Личные праздники и дни рождения: два списка (месяц, день, название) по дате"""
+
+    @abc.abstractmethod
+    async def event_owner_ids(self):
+        """Пользователи, у которых есть дни рождения или личные праздники"""
+
+    @abc.abstractmethod
+    async def all_user_ids(self):
+        """Все пользователи, о которых есть хоть одна запись"""
+
+    @abc.abstractmethod
+    async def user_timezones(self):
+        """Список (user_id, часовой пояс) пользователей, выбравших пояс"""
+
+    @abc.abstractmethod
+    async def set_timezone(self, user_id, timezone):
+        """Запомнить часовой пояс пользователя"""
+
+    @abc.abstractmethod
+    async def features_mask(self, user_id):
+        """Маска купленных функций пользователя (0 - ничего)"""
+
+    @abc.abstractmethod
+    async def feature_masks(self):
+        """Список (user_id, маска) всех покупателей"""
+
+    @abc.abstractmethod
+    async def add_feature(self, user_id, feature):
+        """Атомарно добавить покупку; возвращает новую маску функций пользователя"""
+
+    @abc.abstractmethod
+    async def reminder_events(self, user_id=None):
+        """События подписчиков умных напоминаний: (user_id, тип, название, дата, заголовок)"""
+
+    @abc.abstractmethod
+    async def write(self, writes):
+        """Применить изменения одной транзакцией"""
+
+    @abc.abstractmethod
+    def export_rows(self, tables, chunk):
+        """Асинхронный генератор (таблица, строки) по chunk строк из одного снимка БД"""
+
+    @abc.abstractmethod
+    async def import_rows(self, table, columns, rows):
+        """Записать строки выгрузки одной транзакцией (с заменой существующих)"""
+
+    async def write_batch(self, writes):
+        """Пачка изменений; если транзакция упала, изменения применяются по одному. Возвращает число потерянных"""
+        try:
+            await self.write(writes)
+            return 0
+        except self.errors:
+            logger.exception(f"Ошибка записи пачки из {len(writes)} изменений, пишем по одному")
+        failed = 0
+        for write in writes:
+            try:
+                await self.write([write])
+            except self.errors as e:
+                failed += 1
+                logger.error(f"Изменение потеряно: {write[0]} {write[1]}: {e}")
+        return failed
+
+
+class SQLiteStorage(Storage):
+    """SQLite в файле DB_PATH, запросы выполняются в потоках DBWorker"""
+
+    errors = (sqlite3.Error,)
+
+    async def open(self):
+        await run_db(init_db)
+
+    async def close(self):
+        # Дожидаемся записи уже поставленных в очередь запросов и закрываем соединения
+        await asyncio.to_thread(db_worker.stop)
+        close_connections()
+
+    async def relationship(self, user_id):
+        return await run_db(get_relationship_data, user_id)
+
+    async def birthdays(self, user_id):
+        return await run_db(load_birthdays, user_id)
+
+    async def personal_holidays(self, user_id):
+        return await run_db(get_personal_holidays, user_id)
+
+    async def user_events(self, user_id):
+        return await run_db(get_user_events, user_id)
+
+    async def event_owner_ids(self):
+        return await run_db(get_event_owner_ids)
+
+    async def all_user_ids(self):
+        return await run_db(get_all_user_ids)
+
+    async def user_timezones(self):
+        return await run_db(get_user_timezones)
+
+    async def set_timezone(self, user_id, timezone):
+        await run_db(set_user_timezone, user_id, timezone)
+
+    async def features_mask(self, user_id):
+        return await run_db(get_user_features_mask, user_id)
+
+    async def feature_masks(self):
+        return await run_db(get_all_feature_masks)
+
+    async def add_feature(self, user_id, feature):
+        return await run_db(add_user_feature, user_id, feature)
+
+    async def reminder_events(self, user_id=None):
+        return await run_db(get_reminder_events, user_id)
+
+    async def write(self, writes):
+        await run_db(execute_writes, writes)
+
+    async def export_rows(self, tables, chunk):
+        # Отдельное соединение: все таблицы читаются в одной транзакции
+        conn = sqlite3.connect(get_db_path(), check_same_thread=False)
+        try:
+            conn.execute('BEGIN')
+            for table in tables:
+                cursor = conn.execute(export_query(table))
+                while True:
+                    rows = await asyncio.to_thread(cursor.fetchmany, chunk)
+                    if not rows:
+                        break
+                    yield table, rows
+        finally:
+            conn.close()
+
+    async def import_rows(self, table, columns, rows):
+        await run_db(import_rows, table, columns, rows)
+
+
+# Та же схема, что у SQLite после всех миграций
+POSTGRES_SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS relationships (
+        user_id BIGINT PRIMARY KEY,
+        start_date TEXT,
+        partner_name TEXT
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS birthdays (
+        user_id BIGINT,
+        name TEXT,
+        date TEXT,
+        month SMALLINT,
+        day SMALLINT,
+        PRIMARY KEY (user_id, name)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS personal_holidays (
+        user_id BIGINT,
+        name TEXT,
+        date TEXT,
+        month SMALLINT,
+        day SMALLINT,
+        PRIMARY KEY (user_id, name)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS premium_users (
+        user_id BIGINT PRIMARY KEY,
+        purchased_features TEXT,
+        purchase_date TEXT,
+        features BIGINT NOT NULL DEFAULT 0
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS user_settings (
+        user_id BIGINT PRIMARY KEY,
+        timezone TEXT
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_birthdays_month_day ON birthdays (month, day)',
+    'CREATE INDEX IF NOT EXISTS idx_personal_holidays_month_day ON personal_holidays (month, day)',
+)
+
+POSTGRES_WRITES = {
+    'relationship': '''
+        INSERT INTO relationships (user_id, start_date, partner_name) VALUES ($1, $2, $3)
+        ON CONFLICT (user_id) DO UPDATE SET
+            start_date = excluded.start_date, partner_name = excluded.partner_name
+    ''',
+    'birthday': '''
+        INSERT INTO birthdays (user_id, name, date, month, day) VALUES ($1, $2, $3, $4, $5)
+        ON CONFLICT (user_id, name) DO UPDATE SET
+            date = excluded.date, month = excluded.month, day = excluded.day
+    ''',
+    'birthday_delete': 'DELETE FROM birthdays WHERE user_id = $1 AND name = $2',
+    'personal_holiday': '''
+        INSERT INTO personal_holidays (user_id, name, date, month, day) VALUES ($1, $2, $3, $4, $5)
+        ON CONFLICT (user_id, name) DO UPDATE SET
+            date = excluded.date, month = excluded.month, day = excluded.day
+    ''',
+}
+
+POSTGRES_REMINDER_EVENTS_QUERY = '''
+    WITH subscribers AS (
+        SELECT user_id FROM premium_users
+        WHERE features & $1 != 0 {user_filter}
+    )
+    SELECT b.user_id, 'birthday', b.name, b.date, b.name
+    FROM birthdays b JOIN subscribers s ON s.user_id = b.user_id
+    UNION ALL
+    SELECT p.user_id, 'holiday', p.name, p.date, p.name
+    FROM personal_holidays p JOIN subscribers s ON s.user_id = p.user_id
+    UNION ALL
+    SELECT r.user_id, 'anniversary', '', r.start_date, r.partner_name
+    FROM relationships r JOIN subscribers s ON s.user_id = r.user_id
+'''
+
+
+class PostgresStorage(Storage):
+    """PostgreSQL через пул соединений asyncpg, запросы не занимают потоки"""
+
+    def __init__(self, dsn, pool_size=POSTGRES_POOL_SIZE):
+        self.dsn = dsn
+        self.pool_size = pool_size
+        self.pool = None
+        self.errors = (asyncpg.PostgresError,) if asyncpg else ()
+
+    async def open(self):
+        if asyncpg is None:
+            raise RuntimeError("Для DATABASE_URL=postgresql://... нужен пакет asyncpg: pip install asyncpg")
+        self.pool = await asyncpg.create_pool(self.dsn, min_size=1, max_size=self.pool_size)
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                # Шарды стартуют одновременно - схему создает кто-то один
+                await conn.execute('SELECT pg_advisory_xact_lock(20240214)')
+                for statement in POSTGRES_SCHEMA:
+                    await conn.execute(statement)
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    async def _fetch(self, sql, *args):
+        started = perf_counter()
+        try:
+            return [tuple(row) for row in await self.pool.fetch(sql, *args)]
+        finally:
+            add_timing(0, perf_counter() - started)
+
+    async def _fetchval(self, sql, *args):
+        started = perf_counter()
+        try:
+            return await self.pool.fetchval(sql, *args)
+        finally:
+            add_timing(0, perf_counter() - started)
+
+    async def _execute(self, sql, *args):
+        started = perf_counter()
+        try:
+            await self.pool.execute(sql, *args)
+        finally:
+            add_timing(0, perf_counter() - started)
+
+    async def relationship(self, user_id):
+        rows = await self._fetch('SELECT start_date, partner_name FROM relationships WHERE user_id = $1', user_id)
+        return rows[0] if rows else None
+
+    async def birthdays(self, user_id):
+        return tuple(await self._fetch('SELECT name, date FROM birthdays WHERE user_id = $1', user_id))
+
+    async def personal_holidays(self, user_id):
+        return await self._fetch('SELECT name, date FROM personal_holidays WHERE user_id = $1', user_id)
+
+    async def user_events(self, user_id):
+        # COLLATE "C" - порядок имен как в SQLite (по байтам), а не по локали сервера
+        personal_holidays = await self._fetch('''
+            SELECT month, day, name FROM personal_holidays
+            WHERE user_id = $1 AND month IS NOT NULL ORDER BY month, day, name COLLATE "C"
+        ''', user_id)
+        birthdays = await self._fetch('''
+            SELECT month, day, name FROM birthdays
+            WHERE user_id = $1 AND month IS NOT NULL ORDER BY month, day, name COLLATE "C"
+        ''', user_id)
+        return personal_holidays, birthdays
+
+    async def event_owner_ids(self):
+        rows = await self._fetch('SELECT user_id FROM birthdays UNION SELECT user_id FROM personal_holidays')
+        return [row[0] for row in rows]
+
+    async def all_user_ids(self):
+        rows = await self._fetch('''
+            SELECT user_id FROM relationships
+            UNION SELECT user_id FROM birthdays
+            UNION SELECT user_id FROM personal_holidays
+            UNION SELECT user_id FROM premium_users
+        ''')
+        # Шарды делят одну БД: каждый рассылает только своим пользователям
+        return [row[0] for row in rows if shard_for(row[0]) == SHARD_INDEX]
+
+    async def user_timezones(self):
+        return await self._fetch('SELECT user_id, timezone FROM user_settings WHERE timezone IS NOT NULL')
+
+    async def set_timezone(self, user_id, timezone):
+        await self._execute('''
+            INSERT INTO user_settings (user_id, timezone) VALUES ($1, $2)
+            ON CONFLICT (user_id) DO UPDATE SET timezone = excluded.timezone
+        ''', user_id, timezone)
+
+    async def features_mask(self, user_id):
+        mask = await self._fetchval('SELECT features FROM premium_users WHERE user_id = $1', user_id)
+        return mask or 0
+
+    async def feature_masks(self):
+        return await self._fetch('SELECT user_id, features FROM premium_users WHERE features != 0')
+
+    async def add_feature(self, user_id, feature):
+        return await self._fetchval('''
+            INSERT INTO premium_users (user_id, features, purchase_date) VALUES ($1, $2, $3)
+            ON CONFLICT (user_id) DO UPDATE SET
+                features = premium_users.features | excluded.features,
+                purchase_date = excluded.purchase_date
+            RETURNING features
+        ''', user_id, FEATURE_BITS[feature], datetime.now().isoformat())
+
+    async def reminder_events(self, user_id=None):
+        mask = FEATURE_BITS["smart_reminders"] | FEATURE_BITS["premium_pack"]
+        if user_id is not None:
+            return await self._fetch(POSTGRES_REMINDER_EVENTS_QUERY.format(user_filter='AND user_id = $2'),
+                                     mask, user_id)
+        rows = await self._fetch(POSTGRES_REMINDER_EVENTS_QUERY.format(user_filter=''), mask)
+        # Напоминания пользователю ставит только его шард
+        return [row for row in rows if shard_for(row[0]) == SHARD_INDEX]
+
+    async def write(self, writes):
+        started = perf_counter()
+        try:
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    for operation, group in itertools.groupby(writes, key=lambda write: write[0]):
+                        await conn.executemany(POSTGRES_WRITES[operation], [params for _, params in group])
+        finally:
+            add_timing(0, perf_counter() - started)
+
+    async def export_rows(self, tables, chunk):
+        async with self.pool.acquire() as conn:
+            async with conn.transaction(isolation='repeatable_read', readonly=True):
+                for table in tables:
+                    # Курсор на сервере: в памяти не больше chunk строк
+                    cursor = await conn.cursor(export_query(table))
+                    while True:
+                        rows = await cursor.fetch(chunk)
+                        if not rows:
+                            break
+                        yield table, [tuple(row) for row in rows]
+
+    async def import_rows(self, table, columns, rows):
+        key = DATA_TABLES[table][1]
+        updates = ", ".join(f"{column} = excluded.{column}" for column in columns if column not in key)
+        sql = (f'INSERT INTO {table} ({", ".join(columns)}) '
+               f'VALUES ({", ".join(f"${i}" for i in range(1, len(columns) + 1))}) '
+               f'ON CONFLICT ({", ".join(key)}) DO ' + (f'UPDATE SET {updates}' if updates else 'NOTHING'))
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.executemany(sql, rows)
+
+
+def make_storage(url=DATABASE_URL):
+    if url.startswith(('postgres://', 'postgresql://')):
+        return PostgresStorage(url)
+    return SQLiteStorage()
+
+
+storage = make_storage()
+
+
+# ОТЛОЖЕННАЯ ЗАПИСЬ
+# WRITE_BEHIND_MS > 0 включает запись пачками: изменения копятся в памяти и
+# пишутся одной транзакцией раз в WRITE_BEHIND_MS миллисекунд или по набору
+# WRITE_BEHIND_OPS изменений. При падении процесса теряется не больше
+# последнего окна WRITE_BEHIND_MS.
+WRITE_BEHIND_MS = float(os.environ.get('WRITE_BEHIND_MS', 0))
+WRITE_BEHIND_OPS = int(os.environ.get('WRITE_BEHIND_OPS', 200))
+
+
+class WriteBehindError(Exception):
+    pass
+
+
+class WriteBehind:
+    """Отложенная запись изменений пользователей.
+
+    Пока изменения пользователя не записаны, он числится "грязным", и
+    чтение его данных из БД сначала сбрасывает очередь - пользователь
+    всегда видит свои изменения.
+    """
+
+    def __init__(self, interval_ms=WRITE_BEHIND_MS, max_ops=WRITE_BEHIND_OPS):
+        self.interval = interval_ms / 1000
+        self.max_ops = max_ops
+        self.pending = []
+        self.dirty = set()
+        self.inflight = set()
+        self._lock = None
+        self._timer = None
+        self.flushes = 0
+        self.written = 0
+        self.failed = 0
+        self.forced = 0
+        self.errors = 0
+
+    @property
+    def enabled(self):
+        return self.interval > 0
+
+    def _arm(self):
+        if self._timer is None:
+            loop = asyncio.get_running_loop()
+            self._timer = loop.call_later(self.interval, lambda: asyncio.ensure_future(self.flush()))
+
+    async def save(self, user_id, write):
+        """Записать изменение: сразу или в очередь, если отложенная запись включена"""
+        if not self.enabled:
+            await storage.write([write])
+            return
+        self.pending.append(write)
+        self.dirty.add(user_id)
+        if len(self.pending) == self.max_ops:
+            # Одна досрочная запись на набранную пачку
+            asyncio.ensure_future(self.flush())
+        else:
+            self._arm()
+
+    async def sync(self, user_id):
+        """Дождаться записи изменений пользователя перед чтением его данных из БД"""
+        if user_id in self.dirty or user_id in self.inflight:
+            self.forced += 1
+            if not await self.flush():
+                # Изменения пользователя еще в очереди - не показываем ему старые данные из БД
+                raise WriteBehindError(f"Изменения пользователя {user_id} не записаны")
+
+    async def flush(self):
+        """Записать очередь; False, если запись не удалась и пачка вернулась в очередь"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        # Пачки пишутся строго по очереди, чтобы сохранить порядок изменений
+        async with self._lock:
+            if not self.pending:
+                return True
+            batch, self.pending = self.pending, []
+            self.inflight, self.dirty = self.dirty, set()
+            try:
+                failed = await storage.write_batch(batch)
+            except Exception:
+                # Флаш обычно идет из таймера, где исключение никто не увидит:
+                # пачка возвращается в начало очереди и пишется со следующим таймером
+                logger.exception(f"Отложенная запись {len(batch)} изменений не удалась, повтор через {self.interval:g} s")
+                self.errors += 1
+                self.pending[:0] = batch
+                self.dirty |= self.inflight
+                self._arm()
+                return False
+            finally:
+                self.inflight = set()
+            self.flushes += 1
+            self.written += len(batch) - failed
+            self.failed += failed
+            return True
+
+
+write_behind = WriteBehind()
+
+
+async def read_user_db(read, user_id, *args):
+    """Чтение данных пользователя из хранилища с учетом его еще не записанных изменений"""
+    await write_behind.sync(user_id)
+    return await read(user_id, *args)
+
+
+# РЕЗЕРВНЫЕ КОПИИ
+# Снимок SQLite делается на ходу через backup API по BACKUP_PAGES страниц за шаг
+# с паузой между шагами, поэтому копия не занимает диск и GIL надолго. Снимок
+# проверяется integrity_check, сжимается gzip, хранятся последние BACKUP_KEEP.
+# Для PostgreSQL копии - забота сервера (pg_dump, реплики).
+BACKUP_INTERVAL_MIN = float(os.environ.get('BACKUP_INTERVAL_MIN', 60))
+BACKUP_DIR = os.environ.get('BACKUP_DIR')
+BACKUP_KEEP = int(os.environ.get('BACKUP_KEEP', 24))
+BACKUP_PAGES = int(os.environ.get('BACKUP_PAGES', 256))
+BACKUP_STEP_PAUSE = 0.005
+# Запись в БД через другое соединение начинает пошаговую копию заново. После
+# стольких перезапусков остаток копируется одним шагом - в режиме WAL это одна
+# транзакция чтения, и запись ее не ждет.
+BACKUP_MAX_RESTARTS = 3
+
+
+class BackupRestarted(Exception):
+    pass
+
+
+class BackupManager:
+    """Периодические снимки БД и метрики: длительность, размер и влияние на задержку обработчиков"""
+
+    def __init__(self, keep=BACKUP_KEEP, pages=BACKUP_PAGES):
+        self.keep = keep
+        self.pages = pages
+        self.running = False
+        self.runs = 0
+        self.failures = 0
+        self.restarts = 0
+        self.last_duration = 0.0
+        self.last_size = 0
+        self.last_success = 0.0
+        # [секунды, вызовы] обработчиков во время копий и вне их
+        self.during = [0.0, 0]
+        self.outside = [0.0, 0]
+
+    def observe_handler(self, seconds):
+        totals = self.during if self.running else self.outside
+        totals[0] += seconds
+        totals[1] += 1
+
+    def added_latency(self):
+        """На сколько секунд обработчики в среднем медленнее во время копий"""
+        if not self.during[1] or not self.outside[1]:
+            return 0.0
+        return self.during[0] / self.during[1] - self.outside[0] / self.outside[1]
+
+    def directory(self):
+        return BACKUP_DIR or os.path.join(os.path.dirname(get_db_path()), 'backups')
+
+    def prefix(self):
+        # У каждого шарда свой файл БД - и свой ряд снимков
+        return os.path.splitext(os.path.basename(get_db_path()))[0] + '-'
+
+    def _copy(self, path):
+        source = sqlite3.connect(get_db_path())
+        target = sqlite3.connect(path)
+        state = {'remaining': None, 'restarts': 0}
+
+        def progress(status, remaining, total):
+            # Копия началась заново - осталось больше страниц, чем шаг назад
+            if state['remaining'] is not None and remaining > state['remaining']:
+                self.restarts += 1
+                state['restarts'] += 1
+                if state['restarts'] >= BACKUP_MAX_RESTARTS:
+                    raise BackupRestarted()
+            state['remaining'] = remaining
+            sleep(BACKUP_STEP_PAUSE)
+
+        try:
+            try:
+                source.backup(target, pages=self.pages, progress=progress)
+            except BackupRestarted:
+                logger.warning(f"Резервная копия перезапускалась {BACKUP_MAX_RESTARTS} раз, копируем одним шагом")
+                source.backup(target)
+        finally:
+            target.close()
+            source.close()
+
+    def snapshot(self):
+        """Копия, проверка, сжатие и ротация (выполняется в потоке); возвращает путь к снимку"""
+        if not os.path.exists(get_db_path()):
+            raise FileNotFoundError(get_db_path())
+        directory = self.directory()
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{self.prefix()}{datetime.now():%Y%m%d-%H%M%S}.db")
+        try:
+            self._copy(path)
+            conn = sqlite3.connect(path)
+            try:
+                result = conn.execute('PRAGMA integrity_check').fetchone()[0]
+            finally:
+                conn.close()
+            if result != 'ok':
+                raise sqlite3.DatabaseError(f"Снимок поврежден: {result}")
+            with open(path, 'rb') as source, gzip.open(path + '.gz.tmp', 'wb', compresslevel=6) as target:
+                shutil.copyfileobj(source, target, 1 << 20)
+            os.replace(path + '.gz.tmp', path + '.gz')
+        finally:
+            for leftover in (path, path + '-wal', path + '-shm', path + '.gz.tmp'):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+        self._rotate(directory)
+        return path + '.gz'
+
+    def _rotate(self, directory):
+        prefix = self.prefix()
+        snapshots = sorted(name for name in os.listdir(directory)
+                           if name.startswith(prefix) and name.endswith('.db.gz'))
+        for name in snapshots[:max(len(snapshots) - self.keep, 0)]:
+            os.remove(os.path.join(directory, name))
+
+    async def run(self):
+        """Сделать снимок, если предыдущий уже закончен; возвращает путь или None"""
+        if self.running:
+            return None
+        # Отложенные изменения тоже должны попасть в снимок
+        await write_behind.flush()
+        self.running = True
+        started = perf_counter()
+        try:
+            path = await asyncio.to_thread(self.snapshot)
+        except Exception:
+            self.failures += 1
+            logger.exception("Резервная копия не удалась")
+            return None
+        finally:
+            self.running = False
+            self.runs += 1
+            self.last_duration = perf_counter() - started
+        self.last_size = os.path.getsize(path)
+        self.last_success = datetime.now().timestamp()
+        logger.info(f"Резервная копия {path}: {self.last_size / 2 ** 20:.1f} MiB за {self.last_duration:.1f} s, "
+                    f"обработчики во время копий медленнее на {self.added_latency() * 1000:.1f} ms")
+        return path
+
+
+backups = BackupManager()
+
+
+async def backup_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    await backups.run()
+
+
+class EntitlementCache:
+    """Купленные функции в памяти: user_id -> битовая маска.
+
+    После load() в кэше лежат все покупатели, поэтому проверка доступа
+    к премиум функции не ходит в БД. Покупки пишутся в БД и сразу в кэш.
+    """
+
+    def __init__(self):
+        self.masks = {}
+        self.loaded = False
+
+    def load(self, rows):
+        self.masks = dict(rows)
+        self.loaded = True
+
+    async def get(self, user_id):
+        mask = self.masks.get(user_id)
+        if mask is None:
+            if self.loaded:
+                return 0
+            mask = self.masks[user_id] = await storage.features_mask(user_id)
+        return mask
+
+    async def has(self, user_id, feature):
+        return mask_grants(await self.get(user_id), feature)
+
+    def set(self, user_id, mask):
+        # Покупки только добавляются, поэтому ответы конкурентных покупок объединяем
+        self.masks[user_id] = self.masks.get(user_id, 0) | mask
+
+
+entitlements = EntitlementCache()
+
+
+# Сколько пользователей держать в кэше состояния (0 - выключить кэш).
+# Около 700 байт на пользователя с отношениями и двумя днями рождения (bench_user_cache.py)
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 50000))
+
+# Поле состояния еще не читалось из БД (None - прочитано, но записи нет)
+NOT_LOADED = object()
+
+
+class UserState:
+    __slots__ = ('relationship', 'birthdays', 'personal_holidays', 'events', 'replies')
+
+    def __init__(self):
+        self.relationship = NOT_LOADED  # (start_date, partner_name) или None
+        self.birthdays = NOT_LOADED  # кортеж (имя, дата)
+        self.personal_holidays = NOT_LOADED  # кортеж (название, DD.MM)
+        self.events = NOT_LOADED  # sort_user_events(personal_holidays, birthdays)
+        self.replies = None  # (дата, {команда: ответ}) - ответы по events за этот день
+
+    def events_changed(self):
+        self.events = NOT_LOADED
+        self.replies = None
+
+
+def compact_state(field, value):
+    """Одинаковые даты у разных пользователей хранятся одной строкой"""
+    if value is None:
+        return None
+    if field == 'relationship':
+        return sys.intern(value[0]), value[1]
+    return tuple((name, sys.intern(date_str)) for name, date_str in value)
+
+
+def sort_user_events(personal_holidays, birthdays):
+    """То же, что storage.user_events, из уже прочитанных личных праздников и дней рождения"""
+    def by_date(rows):
+        events = []
+        for name, date_str in rows:
+            day_month = parse_day_month(date_str)
+            if day_month:
+                events.append(day_month + (name,))
+        events.sort()
+        return tuple(events)
+    return by_date(personal_holidays), by_date(birthdays)
+
+
+class UserStateCache:
+    """LRU кэш отношений, дней рождения и личных праздников пользователей со сквозной записью.
+
+    Записи идут в БД и сразу в кэш. Чтение из БД, во время которого была
+    любая запись, в кэш не попадает, а уже загруженное поле чтение никогда
+    не перезаписывает - так кэш не может получить устаревшее значение.
+    """
+
+    def __init__(self, maxsize=USER_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.users = collections.OrderedDict()
+        self.writes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _entry(self, user_id):
+        entry = self.users.get(user_id)
+        if entry is None:
+            entry = self.users[user_id] = UserState()
+            if len(self.users) > self.maxsize:
+                self.users.popitem(last=False)
+        else:
+            self.users.move_to_end(user_id)
+        return entry
+
+    async def _read(self, user_id, field, loader):
+        entry = self.users.get(user_id)
+        if entry is not None:
+            value = getattr(entry, field)
+            if value is not NOT_LOADED:
+                self.hits += 1
+                self.users.move_to_end(user_id)
+                return value
+        self.misses += 1
+        writes = self.writes
+        value = await read_user_db(loader, user_id)
+        if self.maxsize and writes == self.writes:
+            entry = self._entry(user_id)
+            if getattr(entry, field) is NOT_LOADED:
+                setattr(entry, field, compact_state(field, value))
+        return value
+
+    def _written(self, user_id):
+        self.writes += 1
+        return self._entry(user_id) if self.maxsize else UserState()
+
+    async def relationship(self, user_id):
+        return await self._read(user_id, 'relationship', storage.relationship)
+
+    async def birthdays(self, user_id):
+        return await self._read(user_id, 'birthdays', storage.birthdays)
+
+    async def personal_holidays(self, user_id):
+        return await self._read(user_id, 'personal_holidays', storage.personal_holidays)
+
+    async def user_events(self, user_id):
+        """Личные праздники и дни рождения по дате; сортируются один раз до следующего изменения"""
+        entry = self.users.get(user_id)
+        if entry is not None and entry.events is not NOT_LOADED:
+            self.hits += 1
+            self.users.move_to_end(user_id)
+            return entry.events
+        writes = self.writes
+        events = sort_user_events(await self.personal_holidays(user_id), await self.birthdays(user_id))
+        entry = self.users.get(user_id)
+        if entry is not None and writes == self.writes:
+            entry.events = events
+        return events
+
+    async def events_reply(self, user_id, command, today, render):
+        """render(personal_holidays, birthdays) один раз за день до следующего изменения событий"""
+        entry = self.users.get(user_id)
+        if entry is not None and entry.replies is not None and entry.replies[0] == today:
+            try:
+                reply = entry.replies[1][command]
+            except KeyError:
+                pass
+            else:
+                self.hits += 1
+                self.users.move_to_end(user_id)
+                return reply
+        writes = self.writes
+        reply = render(*await self.user_events(user_id))
+        entry = self.users.get(user_id)
+        if entry is not None and writes == self.writes:
+            if entry.replies is None or entry.replies[0] != today:
+                entry.replies = (today, {})
+            entry.replies[1][command] = reply
+        return reply
+
+    async def set_relationship(self, user_id, start_date, partner_name=None):
+        await write_behind.save(user_id, relationship_write(user_id, start_date, partner_name))
+        self._written(user_id).relationship = compact_state('relationship', (start_date.isoformat(), partner_name))
+
+    async def add_birthday(self, user_id, name, birthday):
+        await write_behind.save(user_id, birthday_write(user_id, name, birthday))
+        entry = self._written(user_id)
+        entry.events_changed()
+        if entry.birthdays is not NOT_LOADED:
+            others = tuple(row for row in entry.birthdays if row[0] != name)
+            entry.birthdays = others + ((name, sys.intern(birthday.isoformat())),)
+
+    async def delete_birthday(self, user_id, name):
+        await write_behind.save(user_id, birthday_delete_write(user_id, name))
+        entry = self._written(user_id)
+        entry.events_changed()
+        if entry.birthdays is not NOT_LOADED:
+            entry.birthdays = tuple(row for row in entry.birthdays if row[0] != name)
+
+    async def add_personal_holiday(self, user_id, name, date_str):
+        await write_behind.save(user_id, personal_holiday_write(user_id, name, date_str))
+        entry = self._written(user_id)
+        entry.events_changed()
+        if entry.personal_holidays is not NOT_LOADED:
+            others = tuple(row for row in entry.personal_holidays if row[0] != name)
+            entry.personal_holidays = others + ((name, sys.intern(date_str)),)
+
+
+user_state = UserStateCache()
+
+
+# ЧАСОВЫЕ ПОЯСА
+DEFAULT_TIMEZONE = os.environ.get('DEFAULT_TIMEZONE', 'Europe/Moscow')
+
+
+@functools.lru_cache(maxsize=None)
+def get_tz(name):
+    """Объект пояса создается один раз на название"""
+    return pytz.timezone(name)
+
+
+class LocalClock:
+    """Текущая местная дата для каждого используемого пояса.
+
+    Дата пересчитывается только когда пояс переходит через полночь,
+    в остальное время обработчики получают готовое значение.
+    """
+
+    def __init__(self):
+        self.zones = {}  # название пояса -> (дата, timestamp следующей полуночи)
+
+    def today(self, zone=None):
+        zone = zone or DEFAULT_TIMEZONE
+        now_ts = datetime.now().timestamp()
+        cached = self.zones.get(zone)
+        if cached is None or now_ts >= cached[1]:
+            tz = get_tz(zone)
+            today = datetime.fromtimestamp(now_ts, tz).date()
+            midnight = tz.localize(datetime.combine(today + timedelta(days=1), time(0, 0)))
+            cached = self.zones[zone] = (today, midnight.timestamp())
+        return cached[0]
+
+    def oldest(self):
+        """Самая ранняя из текущих дат: раньше нее ответы уже никому не нужны"""
+        return min([self.today(zone) for zone in list(self.zones)] or [self.today()])
+
+
+local_clock = LocalClock()
+
+
+class TimezoneCache:
+    """Пояса пользователей в памяти: читаются из БД один раз при запуске"""
+
+    def __init__(self):
+        self.zones = {}
+
+    async def load(self):
+        self.zones = dict(await storage.user_timezones())
+        logger.info(f"Часовые пояса загружены: {len(self.zones)} пользователей")
+
+    def get(self, user_id):
+        return self.zones.get(user_id, DEFAULT_TIMEZONE)
+
+    def set(self, user_id, zone):
+        self.zones[user_id] = zone
+
+
+user_timezones = TimezoneCache()
+
+
+def get_today():
+    return local_clock.today()
+
+
+def user_today(user_id):
+    """Сегодняшняя дата в поясе пользователя"""
+    return local_clock.today(user_timezones.get(user_id))
+
+
+def safe_date(year, month, day):
+    """Дата в заданном году; 29.02 в невисокосный год превращается в 28.02"""
+    if month == 2 and day == 29 and not calendar.isleap(year):
+        day = 28
+    return date(year, month, day)
+
+
+# КАТАЛОГ ПРАЗДНИКОВ
+# Сколько лет держать вычисленными (обычно нужны текущий и следующий)
+HOLIDAY_YEARS_CACHE = 8
+
+
+def easter_date(year):
+    """Католическая Пасха по григорианской пасхалии (алгоритм Meeus/Jones/Butcher)"""
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return date(year, month, day + 1)
+
+
+def orthodox_easter_date(year):
+    """Православная Пасха: юлианская пасхалия, переведенная в григорианский календарь"""
+    a, b, c = year % 4, year % 7, year % 19
+    d = (19 * c + 15) % 30
+    e = (2 * a + 4 * b - d + 34) % 7
+    month, day = divmod(d + e + 114, 31)
+    return date(year, month, day + 1) + timedelta(days=year // 100 - year // 400 - 2)
+
+
+def nth_weekday(year, month, weekday, nth):
+    """n-й день недели в месяце (weekday: 0 - понедельник), nth=-1 - последний"""
+    if nth > 0:
+        first = date(year, month, 1)
+        return first + timedelta(days=(weekday - first.weekday()) % 7 + 7 * (nth - 1))
+    last = date(year, month, calendar.monthrange(year, month)[1])
+    return last - timedelta(days=(last.weekday() - weekday) % 7 + 7 * (-nth - 1))
+
+
+def rule_date(date_str, year):
+    day, month = map(int, date_str.split('.'))
+    return safe_date(year, month, day)
+
+
+def fixed_rule(rule, year):
+    return rule_date(rule['date'], year)
+
+
+def weekday_rule(rule, year):
+    return nth_weekday(year, rule['month'], rule['weekday'], rule['nth'])
+
+
+def weekday_after_rule(rule, year):
+    """Первый заданный день недели начиная с даты"""
+    start = rule_date(rule['date'], year)
+    return start + timedelta(days=(rule['weekday'] - start.weekday()) % 7)
+
+
+def easter_rule(rule, year):
+    return easter_date(year) + timedelta(days=rule.get('offset', 0))
+
+
+def orthodox_easter_rule(rule, year):
+    return orthodox_easter_date(year) + timedelta(days=rule.get('offset', 0))
+
+
+def table_rule(rule, year):
+    """Даты по лунному календарю: таблица по годам, вне таблицы - примерная дата"""
+    return rule_date(rule['dates'].get(str(year), rule['fallback']), year)
+
+
+HOLIDAY_RULES = {
+    'fixed': fixed_rule,
+    'weekday': weekday_rule,
+    'weekday_after': weekday_after_rule,
+    'easter': easter_rule,
+    'orthodox_easter': orthodox_easter_rule,
+    'table': table_rule,
+}
+
+
+class HolidayCatalog:
+    """Праздники из holidays.json.
+
+    Даты года вычисляются по правилам при первом обращении к году
+    и кэшируются, годы, которые никто не запрашивает, не считаются.
+    """
+
+    def __init__(self, holidays, regions=None, categories=None):
+        self.names = []
+        self.rules = {}
+        self.aliases = {}
+        self.tags = {}  # название -> (регион, категория)
+        for entry in holidays:
+            name = entry['name']
+            rule = entry['rule']
+            if name in self.rules:
+                raise ValueError(f"Праздник описан дважды: {name}")
+            if rule.get('type') not in HOLIDAY_RULES:
+                raise ValueError(f"Неизвестное правило даты у праздника {name}: {rule.get('type')}")
+            self.names.append(name)
+            self.rules[name] = rule
+            self.aliases[name] = tuple(entry.get('aliases', ()))
+            self.tags[name] = (entry.get('region'), entry.get('category'))
+        self.regions = regions or {}
+        self.categories = categories or {}
+        self.year = functools.lru_cache(maxsize=HOLIDAY_YEARS_CACHE)(self._materialize)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(data['holidays'], data.get('regions'), data.get('categories'))
+
+    def _materialize(self, year):
+        """Праздники года: (отсортированные даты, названия в том же порядке, название -> дата)"""
+        by_name = {name: HOLIDAY_RULES[self.rules[name]['type']](self.rules[name], year) for name in self.names}
+        ordered = sorted(by_name.items(), key=lambda item: item[1])  # при равных датах - порядок каталога
+        return [d for _, d in ordered], [name for name, _ in ordered], by_name
+
+
+holiday_catalog = HolidayCatalog.load(HOLIDAYS_PATH)
+
+
+class HolidayCalendar:
+    """Ближайшие праздники по каталогу.
+
+    Даты года приходят из кэша каталога уже отсортированными, поэтому ближайшие
+    праздники ищутся бинарным поиском по дате с переходом на следующий год.
+    """
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+
+    def rebuild(self, today=None):
+        """Заранее посчитать текущий и следующий год"""
+        today = today or get_today()
+        self.catalog.year(today.year)
+        self.catalog.year(today.year + 1)
+
+    def iter_upcoming(self, today=None, region=None):
+        """Праздники по порядку начиная с сегодня, каждый один раз: (дата, название)"""
+        today = today or get_today()
+        dates, names, _ = self.catalog.year(today.year)
+        next_dates, next_names, _ = self.catalog.year(today.year + 1)
+        start = bisect.bisect_left(dates, today)
+        seen = set()
+        occurrences = itertools.chain(zip(itertools.islice(dates, start, None), itertools.islice(names, start, None)),
+                                      zip(next_dates, next_names))
+        for holiday_date, name in occurrences:
+            # Праздник, который в этом году еще впереди, в следующем году уже не нужен
+            if name in seen or (region and self.catalog.tags[name][0] != region):
+                continue
+            seen.add(name)
+            yield holiday_date, name
+
+    def upcoming(self, today=None, limit=None, region=None):
+        """Ближайшие праздники: список (название, дата, дней до праздника)"""
+        today = today or get_today()
+        occurrences = itertools.islice(self.iter_upcoming(today, region), limit)
+        return [(name, holiday_date, (holiday_date - today).days) for holiday_date, name in occurrences]
+
+    def next_date(self, name, today=None):
+        today = today or get_today()
+        holiday_date = self.catalog.year(today.year)[2][name]
+        if holiday_date < today:
+            holiday_date = self.catalog.year(today.year + 1)[2][name]
+        return holiday_date
+
+    def days_until(self, name, today=None):
+        today = today or get_today()
+        return (self.next_date(name, today) - today).days
+
+    def by_month(self, today=None):
+        """Все праздники в календарном порядке: {месяц: [(название, дата, дней до праздника)]}"""
+        months = {}
+        for name, holiday_date, days_until in sorted(self.upcoming(today), key=lambda item: (item[1].month, item[1].day)):
+            months.setdefault(holiday_date.month, []).append((name, holiday_date.strftime('%d.%m'), days_until))
+        return months
+
+
+holiday_calendar = HolidayCalendar(holiday_catalog)
+
+
+# ЛИЧНЫЙ КАЛЕНДАРЬ
+# Значки личных событий в общем списке праздников
+PERSONAL_EVENT_ICONS = {'birthday': '🎂', 'holiday': '⭐'}
+
+
+class EventOwners:
+    """Пользователи, у которых есть дни рождения или личные праздники.
+
+    Остальным достаточно общего календаря из кэша ответов, и за их
+    событиями в БД ходить не нужно. Удаления не отслеживаются: лишний
+    пользователь в наборе стоит одного запроса к БД.
+    """
+
+    def __init__(self):
+        self.users = set()
+
+    async def load(self):
+        self.users = set(await storage.event_owner_ids())
+
+    def add(self, user_id):
+        self.users.add(user_id)
+
+    def __contains__(self, user_id):
+        return user_id in self.users
+
+
+event_owners = EventOwners()
+
+
+def iter_personal_events(rows, kind, today):
+    """События из списка по (месяц, день), начиная с сегодня: (дата, название, тип)"""
+    start = bisect.bisect_left(rows, (today.month, today.day))
+    for i in range(start, start + len(rows)):
+        month, day, name = rows[i % len(rows)]
+        year = today.year if i < len(rows) else today.year + 1
+        yield safe_date(year, month, day), name, kind
+
+
+def merge_user_events(today, personal_holidays, birthdays, limit, region=None):
+    """Ближайшие события пользователя: слияние общего календаря, личных праздников
+    и дней рождения, без сборки и сортировки всего объединения.
+
+    Возвращает список (название со значком, дата, дней до события).
+    """
+    streams = [
+        ((holiday_date, name, None) for holiday_date, name in holiday_calendar.iter_upcoming(today, region)),
+        iter_personal_events(personal_holidays, 'holiday', today),
+        iter_personal_events(birthdays, 'birthday', today),
+    ]
+    events = []
+    for event_date, name, kind in itertools.islice(heapq.merge(*streams, key=lambda event: event[0]), limit):
+        if kind:
+            name = f"{PERSONAL_EVENT_ICONS[kind]} {name}"
+        events.append((name, event_date, (event_date - today).days))
+    return events
+
+
+def normalize_search_text(text):
+    """Нижний регистр, ё -> е, только буквы и цифры через одиночный пробел"""
+    return " ".join(re.findall(r"\w+", text.lower().replace("ё", "е")))
+
+
+def edit_distance(a, b, limit):
+    """Расстояние Левенштейна с отсечкой: больше limit - значит limit + 1"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class HolidaySearchIndex:
+    """Поисковый индекс названий праздников и их синонимов.
+
+    Подстроки ищутся пересечением списков триграмм, короткие запросы - как
+    префиксы слов бинарным поиском по отсортированному словарю. Если точных
+    совпадений нет, слова запроса сравниваются с похожими по триграммам словами
+    словаря с допуском в 1-2 опечатки.
+    """
+
+    def __init__(self, names, aliases=None):
+        aliases = aliases or {}
+        self.names = list(names)
+        self.keys = []  # (нормализованный текст, номер праздника)
+        for i, name in enumerate(self.names):
+            for text in (name,) + tuple(aliases.get(name, ())):
+                self.keys.append((normalize_search_text(text), i))
+
+        self.trigrams = {}  # триграмма текста -> номера ключей
+        vocabulary = {}  # слово -> номера ключей
+        for key_id, (text, _) in enumerate(self.keys):
+            for k in range(len(text) - 2):
+                self.trigrams.setdefault(text[k:k + 3], set()).add(key_id)
+            for word in text.split():
+                vocabulary.setdefault(word, set()).add(key_id)
+        self.vocabulary = vocabulary
+        self.words = sorted(vocabulary)
+        self.word_trigrams = {}  # триграмма слова с границами -> слова
+        for word in self.words:
+            for gram in self._word_grams(word):
+                self.word_trigrams.setdefault(gram, []).append(word)
+
+    @staticmethod
+    def _word_grams(word):
+        padded = f" {word} "
+        return {padded[k:k + 3] for k in range(len(padded) - 2)}
+
+    def _prefixed(self, prefix):
+        """Номера ключей, где есть слово с этим префиксом"""
+        result = set()
+        start = bisect.bisect_left(self.words, prefix)
+        for word in itertools.islice(self.words, start, None):
+            if not word.startswith(prefix):
+                break
+            result |= self.vocabulary[word]
+        return result
+
+    def _similar_words(self, word):
+        """Слова словаря на расстоянии до 1-2 правок: слово -> расстояние"""
+        limit = 1 if len(word) <= 5 else 2
+        grams = self._word_grams(word)
+        shared = {}
+        for gram in grams:
+            for candidate in self.word_trigrams.get(gram, ()):
+                shared[candidate] = shared.get(candidate, 0) + 1
+        # Каждая правка портит не больше трех триграмм
+        needed = max(1, len(grams) - 3 * limit)
+        result = {}
+        for candidate, count in shared.items():
+            if count >= needed:
+                distance = edit_distance(word, candidate, limit)
+                if distance <= limit:
+                    result[candidate] = distance
+        return result
+
+    def search(self, query, limit=None):
+        """Названия праздников по убыванию релевантности"""
+        query = normalize_search_text(query)
+        if not query:
+            return []
+
+        # Ранги: 0 - полное совпадение, 1 - начало названия, 2 - начало слова,
+        # 3 - середина слова, 4 и дальше - совпадение с опечатками
+        buckets = {}
+
+        if len(query) >= 3:
+            postings = sorted((self.trigrams.get(query[k:k + 3], set()) for k in range(len(query) - 2)), key=len)
+            candidates = set.intersection(*postings)
+        else:
+            candidates = self._prefixed(query)
+        for key_id in candidates:
+            text = self.keys[key_id][0]
+            position = text.find(query)
+            if position < 0:
+                continue
+            if text == query:
+                rank = 0
+            elif position == 0:
+                rank = 1
+            else:
+                rank = 2 if text[position - 1] == " " else 3
+            buckets.setdefault(rank, []).append(key_id)
+
+        if not buckets:
+            # Опечатки: каждое слово запроса должно совпасть с префиксом или похожим словом
+            matched = None
+            for word in query.split():
+                distances = {key_id: 0 for key_id in self._prefixed(word)}
+                if len(word) >= 4:
+                    for similar, distance in self._similar_words(word).items():
+                        for key_id in self.vocabulary[similar]:
+                            distances[key_id] = min(distance, distances.get(key_id, distance))
+                if matched is None:
+                    matched = distances
+                else:
+                    matched = {key_id: matched[key_id] + distance
+                               for key_id, distance in distances.items() if key_id in matched}
+                if not matched:
+                    break
+            for key_id, distance in (matched or {}).items():
+                buckets.setdefault(4 + distance, []).append(key_id)
+
+        # Ключи создавались в порядке праздников, поэтому сортировка номеров ключей
+        # дает порядок каталога; дальше нужного лимита корзины не разбираем
+        result = []
+        seen = set()
+        for rank in sorted(buckets):
+            for key_id in sorted(buckets[rank]):
+                i = self.keys[key_id][1]
+                if i not in seen:
+                    seen.add(i)
+                    result.append(self.names[i])
+                    if len(result) == limit:
+                        return result
+        return result
+
+
+holiday_index = HolidaySearchIndex(holiday_catalog.names, holiday_catalog.aliases)
+
+
+class DailyResponseCache:
+    """Готовые тексты ответов, которые зависят только от текущей даты.
+
+    Ключ - (команда, дата), поэтому в полночь кэш естественно промахивается,
+    а устаревшие ответы удаляет expire().
+    """
+
+    def __init__(self):
+        self.responses = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, command, today, render):
+        key = (command, today)
+        try:
+            response = self.responses[key]
+        except KeyError:
+            self.misses += 1
+            response = self.responses[key] = render(today)
+        else:
+            self.hits += 1
+        return response
+
+    def expire(self, today):
+        stale = [key for key in self.responses if key[1] < today]
+        for key in stale:
+            del self.responses[key]
+        return len(stale)
+
+
+response_cache = DailyResponseCache()
+
+
+async def on_new_day(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Раз в 15 минут: когда во всех поясах наступил новый день, сбрасываем вчерашние ответы"""
+    today = local_clock.oldest()
+    holiday_calendar.rebuild(today)
+    if not response_cache.expire(today):
+        return
+    logger.info(f"Кэш ответов: {response_cache.hits} попаданий, {response_cache.misses} промахов")
+
+
+# ПОСТРАНИЧНЫЙ ВЫВОД
+# Длинные списки показываются страницами с кнопками. Страница - не больше
+# PAGE_CHARS символов и PAGE_ITEMS блоков (месяц праздников, день рождения),
+# блок не делится между страницами.
+TELEGRAM_TEXT_LIMIT = 4096
+PAGE_CHARS = 1500
+PAGE_ITEMS = 15
+PAGE_CACHE_SIZE = int(os.environ.get('PAGE_CACHE_SIZE', 10000))
+
+
+def split_pages(blocks, chars=PAGE_CHARS, items=PAGE_ITEMS):
+    """Границы страниц [(начало, конец)] по размеру блоков"""
+    bounds, start, size = [], 0, 0
+    for i, block in enumerate(blocks):
+        if i > start and (size + len(block) > chars or i - start >= items):
+            bounds.append((start, i))
+            start, size = i, 0
+        size += len(block)
+    bounds.append((start, len(blocks)))
+    return bounds
+
+
+class PagedList:
+    """Список, разбитый на страницы; текст и кнопки страницы собираются при первом показе"""
+
+    def __init__(self, name, header, blocks, footer='', parse_mode=None):
+        self.name = name  # имя списка в callback_data кнопок
+        self.header = header
+        self.blocks = blocks
+        self.footer = footer
+        self.parse_mode = parse_mode
+        self.bounds = split_pages(blocks)
+        self.pages = {}
+
+    def __len__(self):
+        return len(self.bounds)
+
+    def page(self, number):
+        """(текст, кнопки) страницы; номер за пределами списка прижимается к краю"""
+        number = min(max(number, 0), len(self.bounds) - 1)
+        page = self.pages.get(number)
+        if page is None:
+            start, end = self.bounds[number]
+            footer = self.footer if number == len(self.bounds) - 1 else ''
+            text = (self.header + ''.join(self.blocks[start:end]) + footer)[:TELEGRAM_TEXT_LIMIT]
+            page = self.pages[number] = (text, self._keyboard(number))
+        return page
+
+    def _keyboard(self, number):
+        if len(self.bounds) <= 1:
+            return None
+        buttons = []
+        if number > 0:
+            buttons.append(InlineKeyboardButton("« Назад", callback_data=f"page:{self.name}:{number - 1}"))
+        buttons.append(InlineKeyboardButton(f"{number + 1}/{len(self.bounds)}", callback_data="page:noop"))
+        if number < len(self.bounds) - 1:
+            buttons.append(InlineKeyboardButton("Вперед »", callback_data=f"page:{self.name}:{number + 1}"))
+        return InlineKeyboardMarkup([buttons])
+
+
+class PageCache:
+    """LRU кэш списков пользователей по страницам: user_id -> (дата, PagedList).
+
+    Как и в UserStateCache, список, прочитанный во время чьего-то изменения,
+    в кэш не попадает.
+    """
 
+    def __init__(self, maxsize=PAGE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.views = collections.OrderedDict()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id, today):
+        entry = self.views.get(user_id)
+        if entry is not None and entry[0] == today:
+            self.hits += 1
+            self.views.move_to_end(user_id)
+            return entry[1]
+        self.misses += 1
+        return None
+
+    def put(self, user_id, today, view, generation):
+        if not self.maxsize or generation != self.generation:
+            return
+        self.views[user_id] = (today, view)
+        self.views.move_to_end(user_id)
+        if len(self.views) > self.maxsize:
+            self.views.popitem(last=False)
+
+    def invalidate(self, user_id):
+        self.generation += 1
+        self.views.pop(user_id, None)
+
+
+birthday_pages = PageCache()
+
+
+# ЗАЩИТА ОТ ФЛУДА
+# Перед всеми обработчиками: у каждого пользователя корзина на FLOOD_BURST
+# команд, пополняется на FLOOD_RATE команд в секунду. Та же команда, повторенная
+# быстрее FLOOD_DEDUP_SEC, отбрасывается без траты корзины. FLOOD_RATE=0 - выключить.
+FLOOD_RATE = float(os.environ.get('FLOOD_RATE', 1))
+FLOOD_BURST = float(os.environ.get('FLOOD_BURST', 5))
+FLOOD_DEDUP_SEC = float(os.environ.get('FLOOD_DEDUP_SEC', 1))
+FLOOD_MAX_USERS = int(os.environ.get('FLOOD_MAX_USERS', 100000))
+
+FLOOD_OK = 0
+FLOOD_DUPLICATE = 1
+FLOOD_THROTTLED = 2
+FLOOD_NOTIFY = 3  # первый отказ подряд - пользователя нужно предупредить
+
+
+class FloodState:
+    __slots__ = ('tokens', 'updated', 'last_key', 'last_seen', 'notified')
+
+    def __init__(self, tokens, now):
+        self.tokens = tokens
+        self.updated = now
+        self.last_key = None  # hash текста последней команды
+        self.last_seen = 0.0
+        self.notified = False
+
+
+class FloodLimiter:
+    """Корзины токенов пользователей в порядке последней активности.
+
+    Корзина, которая простояла дольше, чем нужно на полное пополнение,
+    ничем не отличается от новой - такие удаляются с начала очереди.
+    """
+
+    def __init__(self, rate=FLOOD_RATE, burst=FLOOD_BURST, dedup=FLOOD_DEDUP_SEC, max_users=FLOOD_MAX_USERS):
+        self.rate = rate
+        self.burst = burst
+        self.dedup = dedup
+        self.max_users = max_users
+        self.idle = max(burst / rate, dedup) if rate > 0 else 0
+        self.users = collections.OrderedDict()
+        self.passed = 0
+        self.duplicates = 0
+        self.throttled = 0
+        self.notices = 0
+
+    @property
+    def enabled(self):
+        return self.rate > 0
+
+    def _expire(self, now):
+        while self.users:
+            state = next(iter(self.users.values()))
+            if now - state.updated <= self.idle:
+                break
+            self.users.popitem(last=False)
+
+    def check(self, user_id, key, now):
+        """FLOOD_OK, FLOOD_DUPLICATE, FLOOD_THROTTLED или FLOOD_NOTIFY для команды с hash key"""
+        self._expire(now)
+        state = self.users.get(user_id)
+        if state is None:
+            state = self.users[user_id] = FloodState(self.burst, now)
+            if len(self.users) > self.max_users:
+                self.users.popitem(last=False)
+        else:
+            self.users.move_to_end(user_id)
+            state.tokens = min(self.burst, state.tokens + (now - state.updated) * self.rate)
+            state.updated = now
+            if state.tokens >= self.burst:
+                state.notified = False  # пользователь успокоился, следующий отказ - новая серия
+
+        # Повторы в течение FLOOD_DEDUP_SEC после первой такой команды склеиваются
+        if key == state.last_key and now - state.last_seen < self.dedup:
+            self.duplicates += 1
+            return FLOOD_DUPLICATE
+        state.last_key, state.last_seen = key, now
+
+        if state.tokens < 1:
+            self.throttled += 1
+            if state.notified:
+                return FLOOD_THROTTLED
+            state.notified = True
+            self.notices += 1
+            return FLOOD_NOTIFY
+        state.tokens -= 1
+        self.passed += 1
+        return FLOOD_OK
+
+    def wait_time(self, user_id):
+        """Через сколько секунд у пользователя появится команда"""
+        state = self.users.get(user_id)
+        if state is None or state.tokens >= 1:
+            return 0
+        return (1 - state.tokens) / self.rate
+
+
+flood_limiter = FloodLimiter()
+
+
+async def flood_guard(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Группа -1: команды и кнопки сверх лимита дальше не обрабатываются"""
+    user = update.effective_user
+    if not flood_limiter.enabled or user is None or user.id in ADMIN_IDS:
+        return
+    query = update.callback_query
+    if query is not None:
+        key = query.data
+    elif update.message and update.message.text and update.message.text.startswith('/'):
+        key = update.message.text
+    else:
+        return  # платежи и прочие апдейты не ограничиваем
+
+    verdict = flood_limiter.check(user.id, hash(key), monotonic())
+    if verdict == FLOOD_OK:
+        return
+    if verdict == FLOOD_NOTIFY:
+        notice = (f"⏳ Слишком много команд! Подожди {math.ceil(flood_limiter.wait_time(user.id))} сек., "
+                  f"до этого команды не выполняются")
+        if query is not None:
+            await query.answer(notice, show_alert=True)
+        else:
+            await update.message.reply_text(notice)
+    elif query is not None:
+        await query.answer()  # убрать часики с кнопки
+    raise ApplicationHandlerStop
+
+
+# ИСХОДЯЩИЕ СООБЩЕНИЯ
+# Лимиты Telegram: около 30 сообщений в секунду на бота и 1 в секунду в один чат
+SEND_GLOBAL_RATE = float(os.environ.get('SEND_GLOBAL_RATE', 30))
+SEND_CHAT_RATE = float(os.environ.get('SEND_CHAT_RATE', 1))
+SEND_MAX_ATTEMPTS = 5
+SEND_CONCURRENCY = 32
+
+# Приоритеты: меньше - раньше
+PRIORITY_REPLY = 0
+PRIORITY_REMINDER = 1
+PRIORITY_BROADCAST = 2
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше capacity за раз"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
 
-def has_premium_feature(user_id, feature):
-    return feature in get_user_features(user_id)
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
 
+    def wait_time(self, now):
+        """Сколько секунд ждать до появления токена (0 - можно отправлять)"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
 
-def calculate_days_until_date(target_date):
-    moscow_tz = pytz.timezone('Europe/Moscow')
-    current_date = datetime.now(moscow_tz).date()
+    def take(self):
+        self.tokens -= 1
 
-    next_occurrence = target_date.replace(year=current_date.year)
+
+class OutboundQueue:
+    """Очередь исходящих сообщений для массовых рассылок и напоминаний.
+
+    Сообщения отправляются по приоритету с общим ведром токенов на бота и
+    отдельным ведром на каждый чат. Чат, исчерпавший лимит, откладывается,
+    не задерживая остальных. После RetryAfter очередь целиком встает на
+    паузу, которую назвал Telegram, и повторяет сообщение.
+    """
+
+    def __init__(self, global_rate=SEND_GLOBAL_RATE, chat_rate=SEND_CHAT_RATE,
+                 max_attempts=SEND_MAX_ATTEMPTS, concurrency=SEND_CONCURRENCY):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.max_attempts = max_attempts
+        self.concurrency = concurrency
+        self.bot = None
+        self.ready = []    # (приоритет, номер, сообщение)
+        self.delayed = []  # (когда можно отправлять, номер, приоритет, сообщение)
+        self.chat_buckets = {}
+        self.global_bucket = None
+        self.paused_until = 0.0
+        self.metrics = {
+            'enqueued': 0, 'sent': 0, 'failed': 0, 'retried': 0, 'retry_after': 0,
+            'delivery_seconds_total': 0.0, 'delivery_seconds_max': 0.0,
+        }
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._task = None
+        self._sending = set()
+        self._slots = None
+
+    def start(self, bot):
+        self.bot = bot
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self.global_bucket = TokenBucket(self.global_rate, self.global_rate, monotonic())
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout=10):
+        """Дождаться отправки очереди (не дольше timeout) и остановиться"""
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Не отправлено сообщений при остановке: {self.pending()}")
+        self._task.cancel()
+        self._task = None
+
+    async def join(self):
+        while self.pending():
+            await asyncio.sleep(0.05)
+
+    def pending(self):
+        return len(self.ready) + len(self.delayed) + len(self._sending)
+
+    def send(self, chat_id, text, priority=PRIORITY_BROADCAST, **kwargs):
+        """Поставить сообщение в очередь; возвращает future с отправленным Message"""
+        future = asyncio.get_running_loop().create_future()
+        message = [chat_id, text, kwargs, 0, monotonic(), future]
+        heapq.heappush(self.ready, (priority, next(self._seq), message))
+        self.metrics['enqueued'] += 1
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return future
+
+    def stats(self):
+        stats = dict(self.metrics)
+        stats['pending'] = self.pending()
+        return stats
+
+    def _chat_bucket(self, chat_id, now):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) > 10000:
+                # Полное ведро ничем не отличается от нового - такие можно забыть
+                for idle_chat in [c for c, b in self.chat_buckets.items() if now - b.updated > 1 / self.chat_rate]:
+                    del self.chat_buckets[idle_chat]
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, 1, now)
+        return bucket
+
+    async def _run(self):
+        while True:
+            now = monotonic()
+            while self.delayed and self.delayed[0][0] <= now:
+                _, seq, priority, message = heapq.heappop(self.delayed)
+                heapq.heappush(self.ready, (priority, seq, message))
+
+            wait = None
+            if self.paused_until > now:
+                wait = self.paused_until - now
+            elif self.ready:
+                wait = self.global_bucket.wait_time(now)
+                if wait == 0:
+                    priority, seq, message = heapq.heappop(self.ready)
+                    chat_wait = self._chat_bucket(message[0], now).wait_time(now)
+                    if chat_wait > 0:
+                        heapq.heappush(self.delayed, (now + chat_wait, seq, priority, message))
+                    else:
+                        self._chat_bucket(message[0], now).take()
+                        self.global_bucket.take()
+                        await self._slots.acquire()
+                        task = asyncio.create_task(self._deliver(priority, seq, message))
+                        self._sending.add(task)
+                        task.add_done_callback(self._sending.discard)
+                    continue
+            if wait is None and self.delayed:
+                wait = self.delayed[0][0] - now
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _deliver(self, priority, seq, message):
+        chat_id, text, kwargs, attempts, enqueued_at, future = message
+        try:
+            result = await self.bot.send_message(chat_id=chat_id, text=text, **kwargs)
+        except RetryAfter as e:
+            delay = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else e.retry_after
+            self.metrics['retry_after'] += 1
+            self.paused_until = max(self.paused_until, monotonic() + delay)
+            self._retry(priority, seq, message, e, 0)
+        except (TimedOut, NetworkError) as e:
+            self._retry(priority, seq, message, e, 0.5 * 2 ** attempts)
+        except TelegramError as e:
+            # Бот заблокирован, чат не найден и т.п. - повтор не поможет
+            self._fail(message, e)
+        else:
+            elapsed = monotonic() - enqueued_at
+            self.metrics['sent'] += 1
+            self.metrics['delivery_seconds_total'] += elapsed
+            self.metrics['delivery_seconds_max'] = max(self.metrics['delivery_seconds_max'], elapsed)
+            if not future.done():
+                future.set_result(result)
+        finally:
+            self._slots.release()
+            self._wakeup.set()
+
+    def _retry(self, priority, seq, message, error, backoff):
+        message[3] += 1
+        if message[3] >= self.max_attempts:
+            self._fail(message, error)
+            return
+        self.metrics['retried'] += 1
+        heapq.heappush(self.delayed, (monotonic() + backoff, seq, priority, message))
+
+    def _fail(self, message, error):
+        self.metrics['failed'] += 1
+        logger.warning(f"Не удалось отправить сообщение в чат {message[0]}: {error}")
+        future = message[5]
+        if not future.done():
+            future.set_exception(error)
+            future.exception()  # не ругаться, если результат никто не ждет
+
+
+outbound_queue = OutboundQueue()
+
+
+# УМНЫЕ НАПОМИНАНИЯ
+# За сколько дней до события напоминать и во сколько по Москве
+REMINDER_DAYS_BEFORE = (7, 1)
+REMINDER_TIME = time(10, 0)
+
+
+def parse_day_month(date_str):
+    """(месяц, день) из 'DD.MM' или ISO-даты; None, если дату не разобрать"""
+    try:
+        if '-' in date_str:
+            parsed = date.fromisoformat(date_str)
+            return parsed.month, parsed.day
+        day, month = map(int, date_str.split('.')[:2])
+        safe_date(2024, month, day)
+        return month, day
+    except ValueError:
+        return None
+
+
+def format_reminder(kind, title, event_date, days_before):
+    when = "Завтра" if days_before == 1 else f"Через {days_before} дней"
+    if kind == 'birthday':
+        return f"🔔 {when} день рождения у {title}! 🎂 ({event_date.strftime('%d.%m')})"
+    if kind == 'anniversary':
+        partner = f" с {title}" if title else ""
+        return f"🔔 {when} годовщина ваших отношений{partner}! 💖 ({event_date.strftime('%d.%m')})"
+    return f"🔔 {when} твой праздник «{title}»! 🎉 ({event_date.strftime('%d.%m')})"
+
+
+class ReminderScheduler:
+    """Планировщик умных напоминаний на основе min-heap.
+
+    В куче лежит ближайшее время срабатывания каждого события подписчиков.
+    Единственная задача JobQueue будится ровно к вершине кучи, поэтому
+    пользователей не нужно перебирать по таймеру. Изменения событий
+    не ищутся в куче: у события растет версия, а устаревшие записи
+    отбрасываются при извлечении.
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.events = {}  # (user_id, тип, название) -> (версия, месяц, день, заголовок)
+        self.subscribers = set()
+        self.job_queue = None
+        self._job = None
+        self._wake_at = None
+        self._seq = itertools.count()
+
+    async def start(self, job_queue):
+        """Собрать кучу из БД за один проход при запуске бота"""
+        self.job_queue = job_queue
+        rows = await storage.reminder_events()
+        now = datetime.now(pytz.utc)
+        self.heap = []
+        self.events = {}
+        self.subscribers = {row[0] for row in rows}
+        for user_id, kind, name, date_str, title in rows:
+            entry = self._register(user_id, kind, name, date_str, title, now)
+            if entry:
+                self.heap.append(entry)
+        heapq.heapify(self.heap)
+        self._schedule()
+        logger.info(f"Умные напоминания: {len(self.events)} событий у {len(self.subscribers)} пользователей")
+
+    async def subscribe(self, user_id):
+        """Пользователь купил напоминания: добавляем все его события"""
+        self.subscribers.add(user_id)
+        for _, kind, name, date_str, title in await read_user_db(storage.reminder_events, user_id):
+            self.set_event(user_id, kind, name, date_str, title)
+
+    def set_event(self, user_id, kind, name, date_str, title=None):
+        if user_id not in self.subscribers:
+            return
+        entry = self._register(user_id, kind, name, date_str, title, datetime.now(pytz.utc))
+        if entry:
+            heapq.heappush(self.heap, entry)
+            self._compact()
+            self._schedule()
+
+    def remove_event(self, user_id, kind, name):
+        # Запись в куче станет устаревшей и будет пропущена при извлечении
+        self.events.pop((user_id, kind, name), None)
+        self._compact()
+
+    def _compact(self):
+        # Частые правки копят устаревшие записи - иногда чистим кучу целиком
+        if len(self.heap) > 2 * len(self.events) + 64:
+            self.heap = [entry for entry in self.heap if self._is_current(entry)]
+            heapq.heapify(self.heap)
+
+    def _register(self, user_id, kind, name, date_str, title, now):
+        key = (user_id, kind, name)
+        day_month = parse_day_month(date_str) if date_str else None
+        if day_month is None:
+            self.events.pop(key, None)
+            return None
+        month, day = day_month
+        version = self.events[key][0] + 1 if key in self.events else 0
+        self.events[key] = (version, month, day, title or '')
+        return self._next_entry(key, version, month, day, now)
+
+    def _next_entry(self, key, version, month, day, now):
+        # Напоминание приходит в REMINDER_TIME по поясу пользователя
+        tz = get_tz(user_timezones.get(key[0]))
+        today = now.astimezone(tz).date()
+        for year in (today.year, today.year + 1):
+            event_date = safe_date(year, month, day)
+            for days_before in REMINDER_DAYS_BEFORE:
+                fire_at = tz.localize(datetime.combine(event_date - timedelta(days=days_before), REMINDER_TIME))
+                if fire_at > now:
+                    return (fire_at.timestamp(), next(self._seq), key, version, days_before, event_date)
+        return None
+
+    def _is_current(self, entry):
+        event = self.events.get(entry[2])
+        return event is not None and event[0] == entry[3]
+
+    def _schedule(self):
+        """Переставить единственную задачу JobQueue на вершину кучи"""
+        while self.heap and not self._is_current(self.heap[0]):
+            heapq.heappop(self.heap)
+        if self.job_queue is None:
+            return
+        wake_at = self.heap[0][0] if self.heap else None
+        if wake_at == self._wake_at:
+            return
+        if self._job is not None:
+            self._job.schedule_removal()
+            self._job = None
+        self._wake_at = wake_at
+        if wake_at is not None:
+            self._job = self.job_queue.run_once(self._fire, datetime.fromtimestamp(wake_at, pytz.utc),
+                                                name="smart_reminders")
+
+    def pop_due(self, now):
+        """Извлечь наступившие напоминания и запланировать следующие срабатывания событий"""
+        due = []
+        now_ts = now.timestamp()
+        while self.heap and self.heap[0][0] <= now_ts:
+            entry = heapq.heappop(self.heap)
+            if not self._is_current(entry):
+                continue
+            _, _, key, version, days_before, event_date = entry
+            user_id, kind, _ = key
+            _, month, day, title = self.events[key]
+            due.append((user_id, format_reminder(kind, title, event_date, days_before)))
+            following = self._next_entry(key, version, month, day, now)
+            if following:
+                heapq.heappush(self.heap, following)
+        return due
+
+    async def _fire(self, context: ContextTypes.DEFAULT_TYPE) -> None:
+        self._job = None
+        self._wake_at = None
+        for user_id, text in self.pop_due(datetime.now(pytz.utc)):
+            outbound_queue.send(user_id, text, priority=PRIORITY_REMINDER)
+        self._schedule()
+
+
+reminder_scheduler = ReminderScheduler()
+
+
+def calculate_days_until_date(target_date, current_date=None):
+    current_date = current_date or get_today()
+
+    next_occurrence = safe_date(current_date.year, target_date.month, target_date.day)
     if next_occurrence < current_date:
-        next_occurrence = next_occurrence.replace(year=current_date.year + 1)
+        next_occurrence = safe_date(current_date.year + 1, target_date.month, target_date.day)
 
     return (next_occurrence - current_date).days
 
@@ -301,7 +2697,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 /delbirthday Имя - удалить день рождения
 
 🎉 Праздники:
-/holidays - ближайшие праздники
+/holidays [регион] - ближайшие праздники
 /allholidays - все праздники мира
 /find праздник - найти праздник
 /nextholiday - ближайший праздник
@@ -313,6 +2709,9 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 /compatibility - тест совместимости
 /add_holiday - добавить свой праздник
 
+⚙️ Настройки:
+/timezone Область/Город - часовой пояс
+
 ❓ Помощь:
 /help - показать справку
     """
@@ -332,14 +2731,14 @@ async def set_date(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
         partner_name = " ".join(context.args[1:]) if len(context.args) > 1 else None
 
-        moscow_tz = pytz.timezone('Europe/Moscow')
-        current_date = datetime.now(moscow_tz).date()
+        current_date = user_today(user_id)
 
         if start_date > current_date:
             await update.message.reply_text("❌ Дата не может быть в будущем!")
             return
 
-        set_relationship_data(user_id, start_date, partner_name)
+        await user_state.set_relationship(user_id, start_date, partner_name)
+        reminder_scheduler.set_event(user_id, 'anniversary', '', start_date.isoformat(), partner_name)
 
         response = f"✅ Дата начала отношений установлена: {start_date.strftime('%d.%m.%Y')}"
         if partner_name:
@@ -354,7 +2753,7 @@ async def set_date(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
 async def count_days(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.effective_user.id
-    data = get_relationship_data(user_id)
+    data = await user_state.relationship(user_id)
 
     if not data:
         await update.message.reply_text("❌ Сначала установи дату: /setdate DD.MM.YYYY")
@@ -362,8 +2761,7 @@ async def count_days(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
 
     start_date = datetime.fromisoformat(data[0]).date()
     partner_name = data[1]
-    moscow_tz = pytz.timezone('Europe/Moscow')
-    current_date = datetime.now(moscow_tz).date()
+    current_date = user_today(user_id)
 
     days_together = (current_date - start_date).days
 
@@ -402,52 +2800,99 @@ async def count_days(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
     await update.message.reply_text(message)
 
 
-async def add_birthday_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def set_timezone(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Установить часовой пояс пользователя"""
     user_id = update.effective_user.id
 
-    if len(context.args) < 2:
-        await update.message.reply_text("❌ Используй: /addbirthday Имя DD.MM\nНапример: /addbirthday Маша 15.03")
+    if not context.args:
+        await update.message.reply_text(
+            f"🕒 Твой часовой пояс: {user_timezones.get(user_id)}\n"
+            "Изменить: /timezone Область/Город\n"
+            "Например: /timezone Europe/Moscow или /timezone Asia/Novosibirsk"
+        )
         return
 
+    zone = context.args[0]
     try:
-        name = context.args[0]
-        date_str = context.args[1]
-
-        birthday = datetime.strptime(f"{date_str}.{datetime.now().year}", "%d.%m.%Y").date()
-
-        add_birthday(user_id, name, birthday)
+        zone = get_tz(zone).zone
+    except pytz.UnknownTimeZoneError:
+        await update.message.reply_text("❌ Неизвестный часовой пояс! Например: Europe/Moscow, Asia/Yekaterinburg")
+        return
 
-        await update.message.reply_text(f"✅ День рождения добавлен!\n🎂 {name}: {birthday.strftime('%d.%m')}")
+    await storage.set_timezone(user_id, zone)
+    user_timezones.set(user_id, zone)
+    # Напоминания пересчитываются под новый пояс
+    if user_id in reminder_scheduler.subscribers:
+        await reminder_scheduler.subscribe(user_id)
 
-    except ValueError:
-        await update.message.reply_text("❌ Неверный формат даты! Используй: DD.MM")
+    await update.message.reply_text(f"✅ Часовой пояс установлен: {zone}\n📅 У тебя сейчас {user_today(user_id).strftime('%d.%m.%Y')}")
 
 
-async def list_birthdays(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def add_birthday_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.effective_user.id
-    birthdays = get_birthdays(user_id)
 
-    if not birthdays:
-        await update.message.reply_text("📋 Нет добавленных дней рождения.\nДобавь: /addbirthday Имя DD.MM")
+    if len(context.args) < 2:
+        await update.message.reply_text("❌ Используй: /addbirthday Имя DD.MM\nНапример: /addbirthday Маша 15.03")
         return
 
-    moscow_tz = pytz.timezone('Europe/Moscow')
-    current_date = datetime.now(moscow_tz).date()
+    name = context.args[0]
+    day_month = parse_day_month(context.args[1])
+    if day_month is None:
+        await update.message.reply_text("❌ Неверный формат даты! Используй: DD.MM")
+        return
+
+    month, day = day_month
+    year = user_today(user_id).year
+    if (month, day) == (2, 29) and not calendar.isleap(year):
+        year = 2000  # дата хранится в високосном году, в обычные годы отмечается 28.02
+    birthday = date(year, month, day)
+
+    await user_state.add_birthday(user_id, name, birthday)
+    birthday_pages.invalidate(user_id)
+    event_owners.add(user_id)
+    reminder_scheduler.set_event(user_id, 'birthday', name, birthday.isoformat(), name)
+
+    await update.message.reply_text(f"✅ День рождения добавлен!\n🎂 {name}: {birthday.strftime('%d.%m')}")
 
-    message = "🎂 Твои дни рождения:\n\n"
 
+def render_birthdays(birthdays, current_date):
+    blocks = []
     for name, date_str in birthdays:
         birthday = datetime.fromisoformat(date_str).date()
-        days_until = calculate_days_until_date(birthday)
+        days_until = calculate_days_until_date(birthday, current_date)
 
         if days_until == 0:
-            message += f"🎉 Сегодня день рождения у {name}!\n"
+            blocks.append(f"🎉 Сегодня день рождения у {name}!\n")
         elif days_until == 1:
-            message += f"📅 {name}: завтра! ({birthday.strftime('%d.%m')})\n"
+            blocks.append(f"📅 {name}: завтра! ({birthday.strftime('%d.%m')})\n")
         else:
-            message += f"📅 {name}: через {days_until} дней ({birthday.strftime('%d.%m')})\n"
+            blocks.append(f"📅 {name}: через {days_until} дней ({birthday.strftime('%d.%m')})\n")
+    return PagedList('birthdays', "🎂 Твои дни рождения:\n\n", blocks)
+
+
+async def birthdays_view(user_id):
+    """Дни рождения пользователя по страницам или None, если их нет"""
+    today = user_today(user_id)
+    view = birthday_pages.get(user_id, today)
+    if view is None:
+        generation = birthday_pages.generation
+        birthdays = await user_state.birthdays(user_id)
+        if not birthdays:
+            return None
+        view = render_birthdays(birthdays, today)
+        birthday_pages.put(user_id, today, view, generation)
+    return view
 
-    await update.message.reply_text(message)
+
+async def list_birthdays(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    view = await birthdays_view(update.effective_user.id)
+
+    if view is None:
+        await update.message.reply_text("📋 Нет добавленных дней рождения.\nДобавь: /addbirthday Имя DD.MM")
+        return
+
+    text, keyboard = view.page(0)
+    await update.message.reply_text(text, reply_markup=keyboard)
 
 
 async def delete_birthday_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -458,28 +2903,26 @@ async def delete_birthday_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE
         return
 
     name = " ".join(context.args)
-    delete_birthday(user_id, name)
+    await user_state.delete_birthday(user_id, name)
+    birthday_pages.invalidate(user_id)
+    reminder_scheduler.remove_event(user_id, 'birthday', name)
 
     await update.message.reply_text(f"✅ День рождения {name} удален!")
 
 
-async def list_holidays(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    moscow_tz = pytz.timezone('Europe/Moscow')
-    current_date = datetime.now(moscow_tz).date()
+# Сколько событий показывает /holidays
+UPCOMING_LIMIT = 10
 
-    message = "🎉 Ближайшие праздники:\n\n"
 
-    holidays_with_days = []
-
-    for holiday, date_str in HOLIDAYS.items():
-        holiday_date = datetime.strptime(f"{date_str}.{current_date.year}", "%d.%m.%Y").date()
-        days_until = calculate_days_until_date(holiday_date)
-        holidays_with_days.append((holiday, days_until, holiday_date))
-
-    holidays_with_days.sort(key=lambda x: x[1])
+def render_holidays(today, region=None, events=None):
+    if region:
+        message = f"🎉 Ближайшие праздники ({holiday_catalog.regions[region]}):\n\n"
+    else:
+        message = "🎉 Ближайшие праздники:\n\n"
 
-    # Показываем только ближайшие 10 праздников
-    for holiday, days_until, holiday_date in holidays_with_days[:10]:
+    if events is None:
+        events = holiday_calendar.upcoming(today, limit=UPCOMING_LIMIT, region=region)
+    for holiday, holiday_date, days_until in events:
         if days_until == 0:
             message += f"🎊 {holiday}: СЕГОДНЯ! 🎊\n"
         elif days_until == 1:
@@ -488,40 +2931,102 @@ async def list_holidays(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
             message += f"📅 {holiday}: через {days_until} дней ({holiday_date.strftime('%d.%m')})\n"
 
     message += "\n✨ Используй /allholidays чтобы увидеть все праздники"
+    return message
 
-    await update.message.reply_text(message)
 
+async def list_holidays(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    region = context.args[0].lower() if context.args else None
+    if region and region not in holiday_catalog.regions:
+        regions = "\n".join(f"{code} - {title}" for code, title in holiday_catalog.regions.items())
+        await update.message.reply_text(f"❌ Неизвестный регион! Доступны:\n{regions}")
+        return
 
-async def all_holidays(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Показать все праздники сгруппированные по месяцам"""
-    message = "🎊 Все праздники в боте:\n\n"
+    user_id = update.effective_user.id
+    today = user_today(user_id)
+    if user_id in event_owners:
+        def render(personal_holidays, birthdays):
+            if personal_holidays or birthdays:
+                events = merge_user_events(today, personal_holidays, birthdays, UPCOMING_LIMIT, region)
+                return render_holidays(today, region, events)
+        message = await user_state.events_reply(user_id, f"holidays:{region}", today, render)
+        if message:
+            await update.message.reply_text(message)
+            return
 
-    holidays_by_month = {}
+    # Без личных событий ответ одинаков для всех и берется из кэша
+    if region:
+        message = response_cache.get(f"holidays:{region}", today, lambda day: render_holidays(day, region))
+    else:
+        message = response_cache.get("holidays", today, render_holidays)
+    await update.message.reply_text(message)
 
-    # Группируем праздники по месяцам
-    for holiday, date_str in HOLIDAYS.items():
-        month = int(date_str.split('.')[1])
-        if month not in holidays_by_month:
-            holidays_by_month[month] = []
-        holidays_by_month[month].append((holiday, date_str))
 
+def render_all_holidays(today):
     # Месяца по порядку
     months = ["Январь", "Февраль", "Март", "Апрель", "Май", "Июнь",
               "Июль", "Август", "Сентябрь", "Октябрь", "Ноябрь", "Декабрь"]
 
-    for month_num in sorted(holidays_by_month.keys()):
-        message += f"📅 **{months[month_num - 1]}**:\n"
-        for holiday, date_str in sorted(holidays_by_month[month_num], key=lambda x: x[1]):
-            days_until = calculate_days_until_date(datetime.strptime(f"{date_str}.2024", "%d.%m.%Y").date())
+    # Месяц - один блок, чтобы заголовок месяца не отрывался от праздников
+    blocks = []
+    for month_num, holidays in holiday_calendar.by_month(today).items():
+        block = f"📅 **{months[month_num - 1]}**:\n"
+        for holiday, date_str, days_until in holidays:
             if days_until == 0:
-                message += f"  🎉 {holiday} - СЕГОДНЯ!\n"
+                block += f"  🎉 {holiday} - СЕГОДНЯ!\n"
             else:
-                message += f"  📌 {holiday} ({date_str}) - через {days_until} дней\n"
-        message += "\n"
+                block += f"  📌 {holiday} ({date_str}) - через {days_until} дней\n"
+        blocks.append(block + "\n")
 
-    message += "✨ Используй /find чтобы найти конкретный праздник"
+    return PagedList('allholidays', "🎊 Все праздники в боте:\n\n", blocks,
+                     "✨ Используй /find чтобы найти конкретный праздник", parse_mode='Markdown')
 
-    await update.message.reply_text(message, parse_mode='Markdown')
+
+async def all_holidays_view(user_id):
+    # Общий для всех список, кэшируется на дату вместе с остальными ответами
+    return response_cache.get("allholidays", user_today(user_id), render_all_holidays)
+
+
+async def all_holidays(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Показать все праздники сгруппированные по месяцам"""
+    view = await all_holidays_view(update.effective_user.id)
+    text, keyboard = view.page(0)
+    await update.message.reply_text(text, parse_mode=view.parse_mode, reply_markup=keyboard)
+
+
+# Списки, которые листаются кнопками: имя в callback_data -> view(user_id)
+PAGED_VIEWS = {
+    'allholidays': all_holidays_view,
+    'birthdays': birthdays_view,
+}
+
+
+async def show_page(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Кнопки под длинным списком: показать другую страницу в том же сообщении"""
+    query = update.callback_query
+    await query.answer()
+    parts = query.data.split(':')
+    if len(parts) != 3 or parts[1] not in PAGED_VIEWS or not parts[2].isdigit():
+        return  # кнопка с номером текущей страницы
+    view = await PAGED_VIEWS[parts[1]](query.from_user.id)
+    if view is None:
+        await query.edit_message_text("📋 Список пуст")
+        return
+    text, keyboard = view.page(int(parts[2]))
+    try:
+        await query.edit_message_text(text, parse_mode=view.parse_mode, reply_markup=keyboard)
+    except BadRequest as e:
+        # Список укоротился, и старая кнопка привела на уже показанную страницу
+        if 'not modified' not in str(e):
+            raise
+
+
+FIND_LIMIT = 20
+
+
+@functools.lru_cache(maxsize=4096)
+def find_catalog_holidays(search_term):
+    """Каталог не меняется, поэтому результаты частых запросов берутся из кэша"""
+    return tuple(holiday_index.search(search_term, limit=FIND_LIMIT))
 
 
 async def find_holiday(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -534,13 +3039,24 @@ async def find_holiday(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         )
         return
 
+    user_id = update.effective_user.id
     search_term = " ".join(context.args).lower()
     found_holidays = []
-
-    for holiday, date_str in HOLIDAYS.items():
-        if search_term in holiday.lower():
-            days_until = calculate_days_until_date(datetime.strptime(f"{date_str}.2024", "%d.%m.%Y").date())
-            found_holidays.append((holiday, date_str, days_until))
+    today = user_today(user_id)
+
+    # Личные праздники пользователя ищем первыми, их всего несколько - индекс строим на лету
+    personal = await entitlements.has(user_id, "personal_holidays") and dict(await user_state.personal_holidays(user_id))
+    if personal:
+        for holiday in HolidaySearchIndex(personal).search(search_term):
+            date_str = personal[holiday]
+            day_month = parse_day_month(date_str)
+            if day_month:
+                days_until = calculate_days_until_date(date(2000, *day_month), today)
+                found_holidays.append((f"⭐ {holiday}", date_str, days_until))
+
+    for holiday in find_catalog_holidays(search_term):
+        holiday_date = holiday_calendar.next_date(holiday, today)
+        found_holidays.append((holiday, f"{holiday_date.day:02d}.{holiday_date.month:02d}", (holiday_date - today).days))
 
     if not found_holidays:
         await update.message.reply_text(f"❌ Праздники с '{search_term}' не найдены")
@@ -558,55 +3074,55 @@ async def find_holiday(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     await update.message.reply_text(message)
 
 
-async def next_holiday(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    moscow_tz = pytz.timezone('Europe/Moscow')
-    current_date = datetime.now(moscow_tz).date()
+def render_next_holiday(today, upcoming=None):
+    if upcoming is None:
+        upcoming = holiday_calendar.upcoming(today, limit=1)
+    if not upcoming:
+        return None
 
-    next_holiday_info = None
-    min_days = 365
+    holiday, holiday_date, days_until = upcoming[0]
 
-    for holiday, date_str in HOLIDAYS.items():
-        holiday_date = datetime.strptime(f"{date_str}.{current_date.year}", "%d.%m.%Y").date()
-        days_until = calculate_days_until_date(holiday_date)
-
-        if days_until < min_days:
-            min_days = days_until
-            next_holiday_info = (holiday, days_until, holiday_date)
-
-    if next_holiday_info:
-        holiday, days_until, holiday_date = next_holiday_info
+    if days_until == 0:
+        return f"🎊 СЕГОДНЯ {holiday}! 🎉🎉🎉"
+    elif days_until == 1:
+        return f"🎉 Ближайший праздник: {holiday} - ЗАВТРА! 🎊"
+    return f"🎉 Ближайший праздник: {holiday}\n📅 Через {days_until} дней\n🗓️ {holiday_date.strftime('%d.%m.%Y')}"
 
-        if days_until == 0:
-            message = f"🎊 СЕГОДНЯ {holiday}! 🎉🎉🎉"
-        elif days_until == 1:
-            message = f"🎉 Ближайший праздник: {holiday} - ЗАВТРА! 🎊"
-        else:
-            message = f"🎉 Ближайший праздник: {holiday}\n📅 Через {days_until} дней\n🗓️ {holiday_date.strftime('%d.%m.%Y')}"
 
+async def next_holiday(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    user_id = update.effective_user.id
+    today = user_today(user_id)
+    message = None
+    if user_id in event_owners:
+        def render(personal_holidays, birthdays):
+            if personal_holidays or birthdays:
+                return render_next_holiday(today, merge_user_events(today, personal_holidays, birthdays, 1))
+        message = await user_state.events_reply(user_id, "nextholiday", today, render)
+    if message is None:
+        message = response_cache.get("nextholiday", today, render_next_holiday)
+    if message:
         await update.message.reply_text(message)
 
 
-async def bot_birthday_info(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Информация о дне создания бота"""
-    moscow_tz = pytz.timezone('Europe/Moscow')
-    current_date = datetime.now(moscow_tz).date()
-
-    bot_birthday = datetime.strptime(f"15.11.{current_date.year}", "%d.%m.%Y").date()
-    days_until = calculate_days_until_date(bot_birthday)
+def render_bot_day(today):
+    days_until = holiday_calendar.days_until("День рождения бота", today)
 
     if days_until == 0:
-        message = "🎉🎉🎉 СЕГОДНЯ День создания этого бота! 🎉🎉🎉\n\nСпасибо, что используешь меня! 💖"
+        return "🎉🎉🎉 СЕГОДНЯ День создания этого бота! 🎉🎉🎉\n\nСпасибо, что используешь меня! 💖"
     elif days_until == 1:
-        message = "🎊 Завтра День создания бота! Уже готовим праздник! 🎊"
-    else:
-        message = f"🤖 День создания бота: 15 ноября\n📅 Осталось ждать: {days_until} дней"
+        return "🎊 Завтра День создания бота! Уже готовим праздник! 🎊"
+    return f"🤖 День создания бота: 15 ноября\n📅 Осталось ждать: {days_until} дней"
 
+
+async def bot_birthday_info(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Информация о дне создания бота"""
+    message = response_cache.get("botday", user_today(update.effective_user.id), render_bot_day)
     await update.message.reply_text(message)
 
 
 async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.effective_user.id
-    data = get_relationship_data(user_id)
+    data = await user_state.relationship(user_id)
 
     if not data:
         await update.message.reply_text("❌ Сначала установи дату: /setdate DD.MM.YYYY")
@@ -614,8 +3130,7 @@ async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
     start_date = datetime.fromisoformat(data[0]).date()
     partner_name = data[1]
-    moscow_tz = pytz.timezone('Europe/Moscow')
-    current_date = datetime.now(moscow_tz).date()
+    current_date = user_today(user_id)
 
     days_together = (current_date - start_date).days
     weeks = days_together // 7
@@ -642,13 +3157,13 @@ async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 # ПРЕМИУМ ФУНКЦИИ
 async def premium_shop(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Магазин премиум функций"""
-    user_features = get_user_features(update.effective_user.id)
+    features_mask = await entitlements.get(update.effective_user.id)
 
     message = "⭐ **Магазин премиум функций** ⭐\n\n"
     message += "💎 _Разблокируй эксклюзивные функции за Telegram Stars_\n\n"
 
     for feature_id, feature_data in PREMIUM_FEATURES.items():
-        purchased = "✅ КУПЛЕНО" if feature_id in user_features else ""
+        purchased = "✅ КУПЛЕНО" if mask_grants(features_mask, feature_id) else ""
         message += f"{feature_data['name']}\n"
         message += f"💰 {feature_data['cost']} звезд\n"
         message += f"📝 {feature_data['description']}\n"
@@ -678,21 +3193,23 @@ async def buy_feature(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     feature_data = PREMIUM_FEATURES[feature_id]
     user_id = update.effective_user.id
 
-    if has_premium_feature(user_id, feature_id):
+    if await entitlements.has(user_id, feature_id):
         await update.message.reply_text(f"✅ У вас уже куплена функция: {feature_data['name']}")
         return
 
     # В реальном боте здесь будет интеграция с Telegram Stars API
     # Для демо просто активируем функцию
 
-    add_user_feature(user_id, feature_id)
+    entitlements.set(user_id, await storage.add_feature(user_id, feature_id))
+    if feature_id in ("smart_reminders", "premium_pack"):
+        await reminder_scheduler.subscribe(user_id)
 
     message = f"""
 🎉 **Поздравляем с покупкой!**
 
 ✅ **Приобретено:** {feature_data['name']}
 💰 **Стоимость:** {feature_data['cost']} звезд
-📅 **Активировано:** {datetime.now().strftime('%d.%m.%Y %H:%M')}
+📅 **Активировано:** {datetime.now(get_tz(user_timezones.get(user_id))).strftime('%d.%m.%Y %H:%M')}
 
 {feature_data['description']}
 
@@ -706,20 +3223,20 @@ async def advanced_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     """Расширенная статистика отношений"""
     user_id = update.effective_user.id
 
-    if not has_premium_feature(user_id, "advanced_stats"):
+    if not await entitlements.has(user_id, "advanced_stats"):
         await update.message.reply_text(
             "❌ Эта функция доступна в премиум версии!\n"
             "⭐ Разблокируй за 5 звезд: /premium_shop"
         )
         return
 
-    data = get_relationship_data(user_id)
+    data = await user_state.relationship(user_id)
     if not data:
         await update.message.reply_text("❌ Сначала установи дату отношений: /setdate DD.MM.YYYY")
         return
 
     start_date = datetime.fromisoformat(data[0]).date()
-    current_date = datetime.now().date()
+    current_date = user_today(user_id)
     days_together = (current_date - start_date).days
 
     # Расширенная статистика
@@ -748,7 +3265,7 @@ async def add_personal_holiday(update: Update, context: ContextTypes.DEFAULT_TYP
     """Добавление персонального праздника"""
     user_id = update.effective_user.id
 
-    if not has_premium_feature(user_id, "personal_holidays"):
+    if not await entitlements.has(user_id, "personal_holidays"):
         await update.message.reply_text(
             "❌ Эта функция доступна в премиум версии!\n"
             "⭐ Разблокируй за 3 звезды: /premium_shop"
@@ -766,20 +3283,19 @@ async def add_personal_holiday(update: Update, context: ContextTypes.DEFAULT_TYP
         )
         return
 
+    day_month = parse_day_month(context.args[1])
+    if day_month is None:
+        await update.message.reply_text("❌ Неверный формат даты! Используй: /add_holiday 'Название' DD.MM")
+        return
+
     try:
         holiday_name = context.args[0].strip('"\'')
-        date_str = context.args[1]
+        date_str = f"{day_month[1]:02d}.{day_month[0]:02d}"
 
         # Сохраняем в базу персональных праздников
-        db_path = get_db_path()
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT OR REPLACE INTO personal_holidays (user_id, name, date)
-            VALUES (?, ?, ?)
-        ''', (user_id, holiday_name, date_str))
-        conn.commit()
-        conn.close()
+        await user_state.add_personal_holiday(user_id, holiday_name, date_str)
+        event_owners.add(user_id)
+        reminder_scheduler.set_event(user_id, 'holiday', holiday_name, date_str, holiday_name)
 
         await update.message.reply_text(
             f"✅ **Персональный праздник добавлен!**\n\n"
@@ -796,7 +3312,7 @@ async def compatibility_test(update: Update, context: ContextTypes.DEFAULT_TYPE)
     """Тест совместимости"""
     user_id = update.effective_user.id
 
-    if not has_premium_feature(user_id, "compatibility_tests"):
+    if not await entitlements.has(user_id, "compatibility_tests"):
         await update.message.reply_text(
             "❌ Эта функция доступна в премиум версии!\n"
             "⭐ Разблокируй за 7 звезд: /premium_shop"
@@ -806,10 +3322,10 @@ async def compatibility_test(update: Update, context: ContextTypes.DEFAULT_TYPE)
     # Простой тест совместимости
     message = "❤️ **ТЕСТ СОВМЕСТИМОСТИ** 💎\n\n"
 
-    data = get_relationship_data(user_id)
+    data = await user_state.relationship(user_id)
     if data and data[1]:  # Если есть имя партнера
         partner_name = data[1]
-        days_together = (datetime.now().date() - datetime.fromisoformat(data[0]).date()).days
+        days_together = (user_today(user_id) - datetime.fromisoformat(data[0]).date()).days
 
         # "Случайный" результат на основе user_id
         compatibility = (user_id % 70) + 30  # 30-99%
@@ -852,6 +3368,32 @@ async def buy_premium_pack(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await buy_feature(update, context)
 
 
+async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Объявление для всех пользователей (только для администраторов)"""
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+
+    if not context.args:
+        await update.message.reply_text("📣 Используй: /broadcast текст объявления")
+        return
+
+    text = update.message.text.split(maxsplit=1)[1]
+    user_ids = await storage.all_user_ids()
+    deliveries = [outbound_queue.send(user_id, text, priority=PRIORITY_BROADCAST) for user_id in user_ids]
+    # С шардами команда приходит в каждый шард, и каждый отчитывается за своих пользователей
+    shard = f" (шард {SHARD_INDEX + 1} из {SHARDS})" if SHARDS > 1 else ""
+    await update.message.reply_text(f"📣 Рассылка поставлена в очередь{shard}: {len(deliveries)} получателей")
+
+    async def report():
+        results = await asyncio.gather(*deliveries, return_exceptions=True)
+        failed = sum(1 for result in results if isinstance(result, Exception))
+        outbound_queue.send(update.effective_chat.id,
+                            f"📣 Рассылка завершена{shard}: доставлено {len(results) - failed}, ошибок {failed}",
+                            priority=PRIORITY_REPLY)
+
+    context.application.create_task(report())
+
+
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     help_text = """
 💕 Бот для подсчета дней отношений и праздников
@@ -867,7 +3409,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 /delbirthday Имя - удалить
 
 🎉 ПРАЗДНИКИ:
-/holidays - ближайшие праздники
+/holidays [регион] - ближайшие праздники
 /allholidays - все праздники мира
 /find праздник - найти праздник
 /nextholiday - ближайший праздник
@@ -881,6 +3423,9 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 
 ⭐ Стоимость: от 3 до 10 Stars
 
+⚙️ НАСТРОЙКИ:
+/timezone Область/Город - часовой пояс
+
 ❓ ПОМОЩЬ:
 /help - справка
     """
@@ -892,15 +3437,170 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     logger.error(f"Ошибка: {context.error}", exc_info=context.error)
 
 
-def main():
-    # Запускаем веб-сервер для Render
-    keep_alive()
+async def on_startup(application: Application) -> None:
+    # Подключаемся к хранилищу и применяем миграции
+    await storage.open()
+    outbound_queue.start(application.bot)
+    entitlements.load(await storage.feature_masks())
+    await user_timezones.load()
+    await event_owners.load()
 
-    # Инициализируем БД
-    init_db()
+    # Восстанавливаем расписание умных напоминаний из БД
+    if application.job_queue:
+        await reminder_scheduler.start(application.job_queue)
 
-    # Создаем приложение
-    application = Application.builder().token(BOT_TOKEN).build()
+
+async def on_shutdown(application: Application) -> None:
+    await outbound_queue.stop()
+    await write_behind.flush()
+    await storage.close()
+
+
+# ПАРАЛЛЕЛЬНАЯ ОБРАБОТКА АПДЕЙТОВ
+# Апдейты разных пользователей обрабатываются одновременно (не больше
+# CONCURRENT_UPDATES), апдейты одного пользователя - строго в порядке прихода:
+# /setdate и следующий за ним /count не обгоняют друг друга. 1 - по одному.
+CONCURRENT_UPDATES = int(os.environ.get('CONCURRENT_UPDATES', 32))
+# Соединений к Bot API. Больше не нужно: Telegram и так пропускает около 30
+# сообщений в секунду, а пул httpx перебирает все соединения на каждый запрос
+# (квадратично от размера пула) - при 256 соединениях это десятки мс CPU на запрос
+BOT_API_POOL_SIZE = int(os.environ.get('BOT_API_POOL_SIZE', 16))
+
+
+class UserOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Очередь на пользователя + общий лимит одновременно выполняемых апдейтов.
+
+    Семафор базового класса берется до do_process_update, и апдейты, ждущие
+    своей очереди у пользователя, занимали бы слоты остальных. Поэтому он
+    сделан безразмерным, а слот берется только когда очередь пользователя подошла.
+    """
+
+    def __init__(self, concurrency):
+        super().__init__(2 ** 31 - 1)
+        self.concurrency = concurrency
+        self.users = {}  # user_id -> [asyncio.Lock, апдейтов пользователя в работе и в очереди]
+        self._slots = None
+        self.running = 0
+        self.waiting = 0
+        self.user_waits = 0  # апдейтов, ждавших предыдущий апдейт того же пользователя
+
+    async def initialize(self):
+        self._slots = asyncio.Semaphore(self.concurrency)
+
+    async def shutdown(self):
+        pass
+
+    async def do_process_update(self, update, coroutine):
+        user = getattr(update, 'effective_user', None)
+        if user is None:
+            await self._run(coroutine)
+            return
+        # Лок берется без единого await после создания задачи, поэтому очередь
+        # пользователя совпадает с порядком, в котором Application получил апдейты
+        entry = self.users.get(user.id)
+        if entry is None:
+            entry = self.users[user.id] = [asyncio.Lock(), 0]
+        elif entry[0].locked():
+            self.user_waits += 1
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await self._run(coroutine)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self.users[user.id]
+
+    async def _run(self, coroutine):
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.running += 1
+        try:
+            await coroutine
+        finally:
+            self.running -= 1
+            self._slots.release()
+
+
+update_processor = UserOrderedUpdateProcessor(CONCURRENT_UPDATES)
+
+
+# ВЕБ-СЕРВЕР И РЕЖИМЫ РАБОТЫ
+# polling - бот сам опрашивает Telegram; webhook - Telegram присылает апдейты на WEBHOOK_URL
+BOT_MODE = os.environ.get('BOT_MODE', 'polling')
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL')
+WEBHOOK_PATH = os.environ.get('WEBHOOK_PATH', '/telegram')
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET')
+PORT = int(os.environ.get('PORT', 10000))
+# Адрес Bot API (свой сервер telegram-bot-api или заглушка для нагрузочных тестов)
+TELEGRAM_API_URL = os.environ.get('TELEGRAM_API_URL')
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.write(metrics.render())
+
+
+class HomeHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.write("🤖 Love Days Bot is running! 🌟")
+
+
+class HealthHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.write("✅ Bot is healthy and running!")
+
+
+class TelegramWebhookHandler(tornado.web.RequestHandler):
+    """Принимает апдейты от Telegram и кладет их в очередь приложения"""
+
+    def initialize(self, bot_application):
+        self.bot_application = bot_application
+
+    async def post(self):
+        if WEBHOOK_SECRET and self.request.headers.get('X-Telegram-Bot-Api-Secret-Token') != WEBHOOK_SECRET:
+            self.set_status(403)
+            return
+        try:
+            update = Update.de_json(json.loads(self.request.body), self.bot_application.bot)
+        except ValueError:
+            self.set_status(400)
+            return
+        await self.bot_application.update_queue.put(update)
+
+
+def make_web_app(application):
+    return tornado.web.Application([
+        (r"/", HomeHandler),
+        (r"/health", HealthHandler),
+        (r"/metrics", MetricsHandler),
+        (WEBHOOK_PATH, TelegramWebhookHandler, {"bot_application": application}),
+    ])
+
+
+def build_application(token=None, base_url=None, mode=BOT_MODE):
+    """Создать приложение со всеми обработчиками (base_url - для локальной подмены Bot API)"""
+    builder = Application.builder().token(token or BOT_TOKEN)
+    if METRICS_ENABLED:
+        builder = builder.request(InstrumentedRequest(connection_pool_size=BOT_API_POOL_SIZE))
+    else:
+        builder = builder.connection_pool_size(BOT_API_POOL_SIZE)
+    base_url = base_url or TELEGRAM_API_URL
+    if base_url:
+        builder = builder.base_url(base_url)
+    if mode in ('webhook', 'shard'):
+        # Апдейты приходят в наш веб-сервер, Updater для опроса не нужен
+        builder = builder.updater(None)
+    if update_processor.concurrency > 1:
+        builder = builder.concurrent_updates(update_processor)
+    application = builder.build()
+
+    # Защита от флуда раньше всех обработчиков
+    application.add_handler(TypeHandler(Update, flood_guard), group=-1)
 
     # Добавляем обработчики
     application.add_handler(CommandHandler("start", start))
@@ -912,9 +3612,11 @@ def main():
     application.add_handler(CommandHandler("delbirthday", delete_birthday_cmd))
     application.add_handler(CommandHandler("holidays", list_holidays))
     application.add_handler(CommandHandler("allholidays", all_holidays))
+    application.add_handler(CallbackQueryHandler(show_page, pattern=r'^page:'))
     application.add_handler(CommandHandler("find", find_holiday))
     application.add_handler(CommandHandler("nextholiday", next_holiday))
     application.add_handler(CommandHandler("botday", bot_birthday_info))
+    application.add_handler(CommandHandler("timezone", set_timezone))
     application.add_handler(CommandHandler("help", help_command))
 
     # ПРЕМИУМ КОМАНДЫ
@@ -930,17 +3632,598 @@ def main():
     application.add_handler(CommandHandler("buy_compatibility_tests", buy_compatibility_tests))
     application.add_handler(CommandHandler("buy_premium_pack", buy_premium_pack))
 
+    # Рассылки для администраторов
+    application.add_handler(CommandHandler("broadcast", broadcast))
+
+    # Пересборка календаря праздников и кэша ответов после полуночи
+    backups_scheduled = False
+    if application.job_queue:
+        # Полночь в поясах с получасовым смещением тоже должна быть замечена
+        application.job_queue.run_repeating(on_new_day, interval=15 * 60, first=60, name="on_new_day")
+        if BACKUP_INTERVAL_MIN > 0 and isinstance(storage, SQLiteStorage):
+            application.job_queue.run_repeating(backup_job, interval=BACKUP_INTERVAL_MIN * 60,
+                                                first=BACKUP_INTERVAL_MIN * 60, name="backup")
+            backups_scheduled = True
+
     # Добавляем обработчик ошибок
     application.add_error_handler(error_handler)
 
+    if METRICS_ENABLED:
+        instrument_handlers(application)
+    elif backups_scheduled:
+        # Добавка к задержке во время копий считается и без метрик
+        instrument_handlers(application, observe_backups)
+
+    return application
+
+
+def collect_bot_metrics():
+    outbound = outbound_queue.stats()
+    return [
+        ('bot_response_cache_hits_total', 'counter', 'Попадания в кэш ответов', response_cache.hits),
+        ('bot_response_cache_misses_total', 'counter', 'Промахи кэша ответов', response_cache.misses),
+        ('bot_db_queue_depth', 'gauge', 'Запросов к БД в очереди', db_worker.depth()),
+        ('bot_user_cache_hits_total', 'counter', 'Попадания в кэш состояния пользователей', user_state.hits),
+        ('bot_user_cache_misses_total', 'counter', 'Промахи кэша состояния пользователей', user_state.misses),
+        ('bot_user_cache_size', 'gauge', 'Пользователей в кэше состояния', len(user_state.users)),
+        ('bot_updates_running', 'gauge', 'Апдейтов обрабатывается сейчас', update_processor.running),
+        ('bot_updates_waiting_slot', 'gauge', 'Апдейтов ждут свободного слота', update_processor.waiting),
+        ('bot_updates_users_active', 'gauge', 'Пользователей с апдейтами в работе', len(update_processor.users)),
+        ('bot_updates_user_waits_total', 'counter', 'Апдейтов, ждавших предыдущий апдейт пользователя',
+         update_processor.user_waits),
+        ('bot_flood_passed_total', 'counter', 'Команд пропущено защитой от флуда', flood_limiter.passed),
+        ('bot_flood_duplicates_total', 'counter', 'Повторов команд отброшено', flood_limiter.duplicates),
+        ('bot_flood_throttled_total', 'counter', 'Команд отброшено сверх лимита', flood_limiter.throttled),
+        ('bot_flood_notices_total', 'counter', 'Предупреждений о лимите отправлено', flood_limiter.notices),
+        ('bot_flood_users', 'gauge', 'Пользователей с активной корзиной', len(flood_limiter.users)),
+        ('bot_page_cache_hits_total', 'counter', 'Попадания в кэш страниц списков', birthday_pages.hits),
+        ('bot_page_cache_misses_total', 'counter', 'Промахи кэша страниц списков', birthday_pages.misses),
+        ('bot_write_behind_pending', 'gauge', 'Изменений ждут отложенной записи', len(write_behind.pending)),
+        ('bot_write_behind_flushes_total', 'counter', 'Пачек отложенной записи', write_behind.flushes),
+        ('bot_write_behind_written_total', 'counter', 'Изменений записано пачками', write_behind.written),
+        ('bot_write_behind_failed_total', 'counter', 'Изменений потеряно при записи пачек', write_behind.failed),
+        ('bot_write_behind_forced_total', 'counter', 'Досрочных сбросов ради чтения своих изменений', write_behind.forced),
+        ('bot_write_behind_errors_total', 'counter', 'Пачек отложенной записи, возвращенных в очередь после ошибки',
+         write_behind.errors),
+        ('bot_outbound_sent_total', 'counter', 'Отправлено из очереди рассылок', outbound['sent']),
+        ('bot_outbound_failed_total', 'counter', 'Не доставлено из очереди рассылок', outbound['failed']),
+        ('bot_outbound_retry_after_total', 'counter', 'Ответов 429 от Telegram', outbound['retry_after']),
+        ('bot_outbound_pending', 'gauge', 'Сообщений в очереди рассылок', outbound['pending']),
+        ('bot_backup_runs_total', 'counter', 'Резервных копий запущено', backups.runs),
+        ('bot_backup_failures_total', 'counter', 'Резервных копий не удалось', backups.failures),
+        ('bot_backup_restarts_total', 'counter', 'Перезапусков копии из-за записи в БД', backups.restarts),
+        ('bot_backup_running', 'gauge', 'Копия выполняется сейчас', int(backups.running)),
+        ('bot_backup_last_duration_seconds', 'gauge', 'Длительность последней копии', backups.last_duration),
+        ('bot_backup_last_size_bytes', 'gauge', 'Размер последнего сжатого снимка', backups.last_size),
+        ('bot_backup_last_success_timestamp_seconds', 'gauge', 'Время последней удачной копии', backups.last_success),
+        ('bot_backup_handler_seconds_total', 'counter', 'Время обработчиков во время копий', backups.during[0]),
+        ('bot_backup_handler_calls_total', 'counter', 'Вызовов обработчиков во время копий', backups.during[1]),
+        ('bot_backup_added_latency_seconds', 'gauge', 'Средняя добавка к задержке обработчиков во время копий',
+         backups.added_latency()),
+    ]
+
+
+metrics.add_collector(collect_bot_metrics)
+
+
+async def run_bot(application, mode=BOT_MODE, port=PORT, stop_event=None):
+    """Один event loop на все: веб-сервер (health и webhook), обработку апдейтов и задачи"""
+    stop_event = stop_event or asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except (NotImplementedError, RuntimeError, ValueError):  # Windows или не главный поток
+            pass
+
+    # Рабочий процесс шарда принимает апдейты только от роутера на этой же машине
+    address = '127.0.0.1' if mode == 'shard' else ''
+    server = make_web_app(application).listen(port, address=address)
+    try:
+        async with application:
+            await on_startup(application)
+            await application.start()
+            if mode == 'webhook':
+                await application.bot.set_webhook(WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+                                                  secret_token=WEBHOOK_SECRET,
+                                                  allowed_updates=Update.ALL_TYPES)
+            elif mode == 'polling':
+                await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+
+            await stop_event.wait()
+
+            if application.updater and application.updater.running:
+                await application.updater.stop()
+            await application.stop()
+            await on_shutdown(application)
+    finally:
+        server.stop()
+
+
+# ШАРДИРОВАНИЕ
+# SHARDS > 1: роутер принимает вебхук Telegram и передает каждый апдейт одному
+# из SHARDS рабочих процессов по user_id. У каждого процесса свой файл БД,
+# поэтому запросы между шардами не нужны: данные пользователя целиком лежат
+# в его шарде, а праздники считаются из каталога в любом процессе.
+SHARDS = int(os.environ.get('SHARDS', 1))
+SHARD_BASE_PORT = int(os.environ.get('SHARD_BASE_PORT', 10100))
+# Таблицы, строки которых принадлежат пользователю (первая колонка - user_id)
+SHARD_TABLES = tuple(DATA_TABLES)
+RESHARD_CHUNK = 10000
+# Номер шарда этого процесса (задается командой worker)
+SHARD_INDEX = 0
+
+
+def jump_hash(key, buckets):
+    """Jump consistent hash: при переходе с N на N+1 шардов переезжает только 1/(N+1) пользователей"""
+    bucket, j = -1, 0
+    while j < buckets:
+        bucket = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+def shard_for(user_id, shards=SHARDS):
+    return jump_hash(user_id, shards) if shards > 1 else 0
+
+
+def shard_db_path(shard, shards, base=None):
+    """Файл БД шарда: relationships.db -> relationships.2-of-4.db"""
+    base = base or DB_PATH
+    if shards <= 1:
+        return base
+    root, ext = os.path.splitext(base)
+    return f"{root}.{shard}-of-{shards}{ext}"
+
+
+def update_user_id(data):
+    """id пользователя из сырого апдейта Telegram или None (например, для постов каналов)"""
+    for value in data.values():
+        if isinstance(value, dict):
+            sender = value.get('from') or value.get('user')
+            if sender:
+                return sender.get('id')
+    return None
+
+
+def reshard(source_shards, target_shards, base=None, chunk=RESHARD_CHUNK):
+    """Разложить пользователей из source_shards файлов БД по target_shards новым файлам.
+
+    Исходные файлы открываются только на чтение и не меняются; их схема должна
+    быть актуальной (ее обновляет запуск бота). Новые файлы не должны существовать -
+    при сведении в один шард это сам DB_PATH, старый файл нужно убрать.
+    Бот на время переноса нужно остановить, после - запустить с SHARDS=target_shards.
+    Возвращает {таблица: строк}.
+    """
+    if source_shards < 1 or target_shards < 1:
+        raise ValueError("Число шардов должно быть не меньше 1")
+    source_paths = [shard_db_path(shard, source_shards, base) for shard in range(source_shards)]
+    target_paths = [shard_db_path(shard, target_shards, base) for shard in range(target_shards)]
+    if set(source_paths) & set(target_paths):
+        raise ValueError(f"Старое и новое число шардов совпадают ({source_shards}), переносить нечего")
+    schema_version = MIGRATIONS[-1][0]
+    for path in source_paths:
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Нет файла шарда {path}")
+        source = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+        try:
+            version = source.execute('PRAGMA user_version').fetchone()[0]
+        finally:
+            source.close()
+        if version != schema_version:
+            raise ValueError(f"Схема {path} версии {version}, а нужна {schema_version}: "
+                             f"запусти на этом шарде текущую версию бота, чтобы применить миграции")
+    for path in target_paths:
+        if os.path.exists(path):
+            hint = " (при сведении в один шард результат пишется в DB_PATH)" if target_shards == 1 else ""
+            raise FileExistsError(f"{path} уже существует{hint}: перенеси старый файл, например в {path}.bak")
+
+    targets = []
+    copied = {}
+    try:
+        for path in target_paths:
+            conn = sqlite3.connect(path)
+            targets.append(conn)
+            init_db(conn)
+            conn.execute('BEGIN')
+        for source_shard, path in enumerate(source_paths):
+            source = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+            try:
+                for table in SHARD_TABLES:
+                    copied.setdefault(table, 0)
+                    cursor = source.execute(f'SELECT * FROM {table}')
+                    columns = ", ".join(column[0] for column in cursor.description)
+                    placeholders = ", ".join("?" * len(cursor.description))
+                    sql = f'INSERT OR REPLACE INTO {table} ({columns}) VALUES ({placeholders})'
+                    while True:
+                        rows = cursor.fetchmany(chunk)
+                        if not rows:
+                            break
+                        buckets = [[] for _ in targets]
+                        for row in rows:
+                            buckets[shard_for(row[0], target_shards)].append(row)
+                        for conn, bucket in zip(targets, buckets):
+                            if bucket:
+                                conn.executemany(sql, bucket)
+                        copied[table] += len(rows)
+                    logger.info(f"Шард {source_shard}: {table} перенесена, всего строк {copied[table]}")
+            finally:
+                source.close()
+        for conn in targets:
+            conn.commit()
+    except BaseException:
+        # Недоделанные файлы мешали бы повторному запуску
+        for conn in targets:
+            conn.close()
+        for path in target_paths:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+        raise
+    for conn in targets:
+        conn.close()
+    return copied
+
+
+class ShardRouter:
+    """Пересылка апдейтов рабочим процессам и присмотр за ними"""
+
+    def __init__(self, shards=SHARDS, base_port=SHARD_BASE_PORT):
+        self.shards = shards
+        self.base_port = base_port
+        self.client = tornado.httpclient.AsyncHTTPClient()
+        self.forwarded = [0] * shards
+        self.failed = [0] * shards
+        self.restarts = [0] * shards
+        self.processes = [None] * shards
+        self._supervisors = []
+        self._stopping = False
+
+    def targets(self, data):
+        message = data.get('message') or {}
+        # Рассылку каждый шард делает своим пользователям
+        if (message.get('text') or '').startswith('/broadcast'):
+            return range(self.shards)
+        user_id = update_user_id(data)
+        return [shard_for(user_id, self.shards) if user_id else 0]
+
+    async def _post(self, shard, body):
+        headers = {'Content-Type': 'application/json'}
+        if WEBHOOK_SECRET:
+            headers['X-Telegram-Bot-Api-Secret-Token'] = WEBHOOK_SECRET
+        try:
+            await self.client.fetch(f"http://127.0.0.1:{self.base_port + shard}{WEBHOOK_PATH}",
+                                    method='POST', body=body, headers=headers)
+        except Exception as e:
+            self.failed[shard] += 1
+            logger.warning(f"Шард {shard} не принял апдейт: {e}")
+            return False
+        self.forwarded[shard] += 1
+        return True
+
+    async def forward(self, data, body):
+        """True, если апдейт приняли все нужные шарды (иначе Telegram повторит его позже)"""
+        results = await asyncio.gather(*(self._post(shard, body) for shard in self.targets(data)))
+        return all(results)
+
+    async def start(self):
+        self._supervisors = [asyncio.ensure_future(self._supervise(shard)) for shard in range(self.shards)]
+
+    async def _supervise(self, shard):
+        """Запустить рабочий процесс шарда и перезапускать его при падении"""
+        env = dict(os.environ, PORT=str(self.base_port + shard), SHARDS=str(self.shards),
+                   # Лимит Telegram общий на бота - делим его между шардами
+                   SEND_GLOBAL_RATE=str(SEND_GLOBAL_RATE / self.shards))
+        while not self._stopping:
+            process = self.processes[shard] = await asyncio.create_subprocess_exec(
+                sys.executable, os.path.abspath(__file__), 'worker', '--shard', str(shard), env=env)
+            code = await process.wait()
+            if self._stopping:
+                break
+            self.restarts[shard] += 1
+            logger.error(f"Шард {shard} завершился с кодом {code}, перезапуск")
+            await asyncio.sleep(min(30, 2 ** min(self.restarts[shard], 5)))
+
+    async def stop(self):
+        self._stopping = True
+        for process in self.processes:
+            if process is not None and process.returncode is None:
+                process.terminate()
+        await asyncio.gather(*self._supervisors, return_exceptions=True)
+
+    def render_metrics(self):
+        lines = []
+        for metric, help_text, values in (
+            ('bot_router_forwarded_total', 'Апдейтов передано шарду', self.forwarded),
+            ('bot_router_failed_total', 'Апдейтов, которые шард не принял', self.failed),
+            ('bot_router_restarts_total', 'Перезапусков рабочего процесса', self.restarts),
+        ):
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+            lines += [f'{metric}{{shard="{shard}"}} {value}' for shard, value in enumerate(values)]
+        return "\n".join(lines) + "\n"
+
+
+class RouterWebhookHandler(tornado.web.RequestHandler):
+    def initialize(self, router):
+        self.router = router
+
+    async def post(self):
+        if WEBHOOK_SECRET and self.request.headers.get('X-Telegram-Bot-Api-Secret-Token') != WEBHOOK_SECRET:
+            self.set_status(403)
+            return
+        try:
+            data = json.loads(self.request.body)
+        except ValueError:
+            self.set_status(400)
+            return
+        if not await self.router.forward(data, self.request.body):
+            self.set_status(502)
+
+
+class RouterMetricsHandler(tornado.web.RequestHandler):
+    def initialize(self, router):
+        self.router = router
+
+    def get(self):
+        self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.write(self.router.render_metrics())
+
+
+async def run_router(shards=SHARDS, port=PORT, stop_event=None):
+    """Фронтовой процесс: вебхук Telegram -> рабочие процессы шардов"""
+    stop_event = stop_event or asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except (NotImplementedError, RuntimeError, ValueError):
+            pass
+
+    router = ShardRouter(shards)
+    await router.start()
+    server = tornado.web.Application([
+        (r"/", HomeHandler),
+        (r"/health", HealthHandler),
+        (r"/metrics", RouterMetricsHandler, {"router": router}),
+        (WEBHOOK_PATH, RouterWebhookHandler, {"router": router}),
+    ]).listen(port)
+    try:
+        async with Bot(BOT_TOKEN, base_url=TELEGRAM_API_URL or 'https://api.telegram.org/bot') as bot:
+            await bot.set_webhook(WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET,
+                                  allowed_updates=Update.ALL_TYPES)
+        await stop_event.wait()
+    finally:
+        server.stop()
+        await router.stop()
+
+
+# ВЫГРУЗКА И ЗАГРУЗКА ДАННЫХ
+# Формат JSONL: строка-заголовок {"table": ..., "columns": [...]}, за ней строки
+# таблицы JSON массивами. Файлы с окончанием .gz сжимаются gzip.
+EXPORT_CHUNK = 5000
+IMPORT_CHUNK = 10000
+
+
+def open_dump(path, mode):
+    if path == '-':
+        return sys.stdout.buffer if 'w' in mode else sys.stdin.buffer
+    if path.endswith('.gz'):
+        return gzip.open(path, mode, compresslevel=6)
+    return open(path, mode)
+
+
+dump_encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+
+def json_lines(values):
+    return ''.join(dump_encoder.encode(value) + '\n' for value in values).encode()
+
+
+class Progress:
+    """Сколько строк обработано - в stderr не чаще раза в секунду"""
+
+    def __init__(self, action, rows=0):
+        self.action = action
+        self.rows = rows
+        self.done = 0
+        self.started = self.reported = monotonic()
+
+    def add(self, table, count):
+        self.rows += count
+        self.done += count
+        now = monotonic()
+        if now - self.reported >= 1:
+            self.reported = now
+            print(f"{self.action}: {table}, {self.rows:,} строк ({self.done / (now - self.started):,.0f}/s)",
+                  file=sys.stderr)
+
+
+async def export_data(path, tables=tuple(DATA_TABLES), chunk=EXPORT_CHUNK):
+    """Выгрузить таблицы в JSONL (все из одного снимка БД); возвращает {таблица: строк}"""
+    await storage.open()
+    counts = dict.fromkeys(tables, 0)
+    progress = Progress("Выгрузка")
+    output = open_dump(path, 'wb')
+    try:
+        current = None
+        async for table, rows in storage.export_rows(tables, chunk):
+            if table != current:
+                current = table
+                output.write(json_lines([{'table': table, 'columns': DATA_TABLES[table][0]}]))
+            output.write(json_lines(rows))
+            counts[table] += len(rows)
+            progress.add(table, len(rows))
+    finally:
+        if path == '-':
+            output.flush()
+        else:
+            output.close()
+        await storage.close()
+    return counts
+
+
+def dump_header(record):
+    """(таблица, колонки) из заголовка выгрузки; колонки сверяются со схемой"""
+    table, columns = record.get('table'), record.get('columns') or []
+    if table not in DATA_TABLES or 'user_id' not in columns or not set(columns) <= set(DATA_TABLES[table][0]):
+        raise ValueError(f"Неизвестная таблица или колонки в выгрузке: {record}")
+    return table, columns
+
+
+async def import_data(path, chunk=IMPORT_CHUNK, restart=False):
+    """Загрузить выгрузку пачками по chunk строк в транзакции; возвращает {таблица: строк}.
+
+    После каждой пачки позиция в файле сохраняется в path.progress, и
+    повторный запуск после сбоя продолжает с нее. Пачки пишутся с заменой
+    существующих строк, поэтому повтор последней пачки ничего не портит.
+    """
+    checkpoint = None if path == '-' else path + '.progress'
+    state = {'offset': 0, 'table': None, 'columns': None, 'rows': 0}
+    if checkpoint and os.path.exists(checkpoint) and not restart:
+        with open(checkpoint) as f:
+            state = json.load(f)
+        print(f"Продолжаем загрузку с {state['rows']:,} строки", file=sys.stderr)
+
+    await storage.open()
+    counts = {}
+    progress = Progress("Загрузка", state['rows'])
+    lines = []
+
+    async def flush(offset):
+        if lines:
+            # Пачка строк разбирается одним вызовом json.loads
+            rows = json.loads(b'[' + b','.join(lines) + b']')
+            await storage.import_rows(state['table'], state['columns'], rows)
+            counts[state['table']] = counts.get(state['table'], 0) + len(rows)
+            progress.add(state['table'], len(rows))
+            state['rows'] += len(rows)
+            lines.clear()
+        state['offset'] = offset
+        if checkpoint:
+            with open(checkpoint + '.tmp', 'w') as f:
+                json.dump(state, f)
+            os.replace(checkpoint + '.tmp', checkpoint)
+
+    source = open_dump(path, 'rb')
+    try:
+        offset = state['offset']
+        if offset:
+            source.seek(offset)
+        for line in source:
+            if line.startswith(b'{'):
+                await flush(offset)
+                state['table'], state['columns'] = dump_header(json.loads(line))
+            elif state['table'] is None:
+                raise ValueError("Строка данных до заголовка таблицы")
+            elif line.strip():
+                lines.append(line)
+            offset += len(line)
+            if len(lines) >= chunk:
+                await flush(offset)
+        await flush(offset)
+    finally:
+        if path != '-':
+            source.close()
+        await storage.close()
+    if checkpoint:
+        os.remove(checkpoint)
+    return counts
+
+
+def require_token():
+    if not BOT_TOKEN:
+        print("❌ Ошибка: BOT_TOKEN не найден!")
+        print("ℹ️ Установи переменную BOT_TOKEN в настройках Render")
+        exit(1)
+
+
+def run_single(mode=BOT_MODE, port=PORT):
+    """Один процесс бота (без шардов или рабочий процесс шарда)"""
+    # Собираем календарь праздников (БД подключается в on_startup)
+    holiday_calendar.rebuild()
+
+    # Создаем приложение
+    application = build_application(mode=mode)
+
     print("🤖 Бот запущен...")
     print("🎂 День создания бота: 15 Ноября")
-    print("🌍 Загружено праздников:", len(HOLIDAYS))
+    print("🌍 Загружено праздников:", len(holiday_catalog.names))
     print("💎 Система монетизации через Stars активирована!")
-    print("🌐 Веб-сервер запущен на порту 10000")
+    print(f"🌐 Веб-сервер запущен на порту {port}, режим: {mode}")
+
+    asyncio.run(run_bot(application, mode, port))
+
+
+def main(argv=None):
+    global DB_PATH, SHARD_INDEX
+
+    parser = argparse.ArgumentParser(description="Love Days бот")
+    commands = parser.add_subparsers(dest='command')
+    commands.add_parser('run', help="запустить бота (по умолчанию; при SHARDS > 1 - роутер с шардами)")
+    worker_parser = commands.add_parser('worker', help="рабочий процесс шарда (запускается роутером)")
+    worker_parser.add_argument('--shard', type=int, required=True)
+    reshard_parser = commands.add_parser('reshard', help="разложить пользователей по новому числу шардов")
+    reshard_parser.add_argument('--from', dest='source', type=int, default=SHARDS, help="текущее число шардов")
+    reshard_parser.add_argument('--to', dest='target', type=int, required=True, help="новое число шардов")
+    export_parser = commands.add_parser('export', help="выгрузить данные пользователей в JSONL (в файл .gz - со сжатием)")
+    export_parser.add_argument('output', nargs='?', default='-', help="файл, по умолчанию stdout")
+    export_parser.add_argument('--tables', nargs='+', choices=list(DATA_TABLES), default=list(DATA_TABLES))
+    import_parser = commands.add_parser('import', help="загрузить выгрузку (повторный запуск продолжит после сбоя)")
+    import_parser.add_argument('input', help="файл выгрузки, - для stdin")
+    import_parser.add_argument('--chunk', type=int, default=IMPORT_CHUNK, help="строк в одной транзакции")
+    import_parser.add_argument('--restart', action='store_true', help="начать заново, а не продолжать прошлую загрузку")
+    commands.add_parser('backup', help="сделать снимок SQLite сейчас (как периодическая копия)")
+    args = parser.parse_args(argv)
+
+    if args.command == 'backup':
+        path = asyncio.run(backups.run())
+        if not path:
+            exit(1)
+        print(f"✅ {path}")
+        return
+
+    if args.command == 'export':
+        counts = asyncio.run(export_data(args.output, args.tables))
+        for table, rows in counts.items():
+            print(f"✅ {table}: {rows} строк", file=sys.stderr)
+        return
+
+    if args.command == 'import':
+        counts = asyncio.run(import_data(args.input, args.chunk, args.restart))
+        for table, rows in counts.items():
+            print(f"✅ {table}: {rows} строк")
+        return
+
+    if args.command == 'reshard':
+        try:
+            copied = reshard(args.source, args.target)
+        except (OSError, ValueError) as e:
+            reshard_parser.error(str(e))
+        for table, rows in copied.items():
+            print(f"✅ {table}: {rows} строк")
+        print(f"Готово. Запусти бота с SHARDS={args.target}")
+        return
+
+    require_token()
+
+    if args.command == 'worker':
+        SHARD_INDEX = args.shard
+        DB_PATH = shard_db_path(args.shard, SHARDS)
+        run_single('shard', PORT)
+        return
+
+    if (SHARDS > 1 or BOT_MODE == 'webhook') and not WEBHOOK_URL:
+        print("❌ Ошибка: для BOT_MODE=webhook и SHARDS > 1 нужен WEBHOOK_URL")
+        exit(1)
+
+    if SHARDS > 1:
+        print(f"🔀 Роутер на порту {PORT}: {SHARDS} шардов, порты {SHARD_BASE_PORT}-{SHARD_BASE_PORT + SHARDS - 1}")
+        asyncio.run(run_router())
+        return
 
-    application.run_polling()
+    run_single()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()